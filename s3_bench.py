@@ -0,0 +1,442 @@
+"""Benchmarks of the listing, transfer and delete code paths against a local S3
+
+Runs the same S3Engine the GUI and CLI use against the in-process fake
+server (s3_fake_server.py), or any S3-compatible endpoint given with
+--endpoint-url (moto_server, MinIO), and writes one JSON record per
+scenario with ops/s, MB/s, p50/p99 call latency and the peak RSS of the
+process that ran it.
+
+Examples:
+    python s3_bench.py                                  # 1k, 100k and 1M keys plus transfers
+    python s3_bench.py --keys 1k,100k --scenarios list,du
+    python s3_bench.py --compare baseline.json          # exit 1 on a throughput regression
+
+Each scenario runs in a fresh process, so its peak RSS is its own and the
+fake server does not compete with it for the GIL. Transfer and worker
+settings (S3_UPLOAD_WORKERS, S3_DOWNLOAD_PART_MB, ...) are read from the
+environment and .env exactly as the app reads them.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Datasets: every bucket holds N keys in one folder ('flat/') and N keys spread over a tree ('tree/')
+TREE_FANOUT = 100
+
+SCENARIOS = ('list', 'du', 'upload', 'download', 'delete')
+
+
+class CallTimer:
+    """Exact per-call latencies of every S3 call made through a client, for percentiles"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}  # operation name -> [seconds, ...]
+
+    def instrument(self, client):
+        events = client.meta.events
+        events.register('before-parameter-build.s3', self.before_call, unique_id='s3-bench-before')
+        events.register('after-call.s3', self.after_call, unique_id='s3-bench-after')
+
+    def before_call(self, context, **kwargs):
+        context['bench_started'] = time.perf_counter()
+
+    def after_call(self, model, context, **kwargs):
+        started = context.get('bench_started')
+        if started is not None:
+            seconds = time.perf_counter() - started
+            with self.lock:
+                self.latencies.setdefault(model.name, []).append(seconds)
+
+    def summary(self):
+        """Return {'calls', 'p50_ms', 'p99_ms', 'operations': {name: {...}}} over all calls"""
+        with self.lock:
+            by_operation = {name: sorted(values) for name, values in self.latencies.items()}
+        every = sorted(v for values in by_operation.values() for v in values)
+        result = latency_stats(every)
+        result['operations'] = {name: latency_stats(values) for name, values in sorted(by_operation.items())}
+        return result
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def latency_stats(values):
+    stats = {'calls': len(values)}
+    for name, q in (('p50_ms', 0.5), ('p99_ms', 0.99)):
+        value = percentile(values, q)
+        stats[name] = round(value * 1000, 3) if value is not None else None
+    return stats
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unsupported"""
+    # Linux's ru_maxrss survives fork and exec, so a child would report its parent's peak; VmHWM does not
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (MB if sys.platform == 'darwin' else 1024), 1)
+
+
+def parse_count(text):
+    """Parse '1k', '100k', '1m' or '2500' into a number of keys"""
+    text = text.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+def dataset_keys(count, folder):
+    if folder == 'flat':
+        return (f'flat/{i:08d}' for i in range(count))
+    return (f'tree/d{i % TREE_FANOUT:02d}/e{i // TREE_FANOUT % TREE_FANOUT:02d}/{i:08d}' for i in range(count))
+
+
+def write_files(directory, count, size):
+    """Create count files of size bytes under directory (not timed)"""
+    os.makedirs(directory, exist_ok=True)
+    block = os.urandom(min(size, MB)) if size else b''
+    for i in range(count):
+        with open(os.path.join(directory, f'{i:06d}.bin'), 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+
+
+# --- scenarios (run in a child process) ---
+
+def scenario_list_folder(engine, params):
+    """One folder level holding every key, as the GUI lists it"""
+    count = 0
+    for page in engine.list_folder(params['bucket'], 'flat/'):
+        count += len(page.names)
+    return count, 0
+
+
+def scenario_list_recursive(engine, params):
+    count = sum(1 for obj in engine.iter_objects(params['bucket'], 'tree/'))
+    return count, 0
+
+
+def scenario_du(engine, params):
+    total, sizes = engine.du(params['bucket'], 'tree/', use_cache=False)
+    return total.count, 0
+
+
+def bulk_progress(kind, progress):
+    if progress.failures:
+        raise RuntimeError(f"{len(progress.failures)} {kind} failures, first: {progress.failures[0]}")
+    return progress.files_done, progress.bytes_done
+
+
+def scenario_upload(engine, params):
+    from s3_bulk import TransferProgress
+    progress = TransferProgress()
+    items = list(engine.iter_upload_items([params['source']], params['prefix']))
+    engine.upload(items, params['bucket'], progress)
+    return bulk_progress('upload', progress)
+
+
+def scenario_download(engine, params):
+    from s3_bulk import TransferProgress
+    progress = TransferProgress()
+    names = [os.path.basename(params['source']) + '/']
+    objects = list(engine.iter_download_items(params['bucket'], params['prefix'], names, params['target']))
+    engine.download(objects, params['bucket'], params['target'], progress)
+    return bulk_progress('download', progress)
+
+
+def scenario_delete(engine, params):
+    from s3_bulk import TransferProgress
+    progress = TransferProgress()
+    keys = engine.iter_delete_keys(params['bucket'], '', [params['folder']])
+    engine.delete(keys, params['bucket'], progress)
+    files, _ = bulk_progress('delete', progress)
+    return files, 0
+
+
+SCENARIO_FUNCTIONS = {
+    'list_folder': scenario_list_folder,
+    'list_recursive': scenario_list_recursive,
+    'du': scenario_du,
+    'upload': scenario_upload,
+    'download': scenario_download,
+    'delete': scenario_delete,
+}
+
+
+def run_scenario(name, params, environ, results):
+    """Child process entry point: run one scenario and put its record on results"""
+    os.environ.update(environ)
+    logging.basicConfig(level=params['log_level'], format='%(asctime)s - %(levelname)s - %(message)s')
+    from s3_engine import S3Engine
+    record = {'scenario': name, 'dataset': params['dataset']}
+    try:
+        engine = S3Engine()
+        # Resolve the bucket's region up front so its client exists (and is timed) before the clock starts
+        engine.clients.client_for(params['bucket'])
+        timer = CallTimer()
+        for client in engine.clients.clients.values():
+            timer.instrument(client)
+        started = time.perf_counter()
+        ops, transferred = SCENARIO_FUNCTIONS[name](engine, params)
+        seconds = time.perf_counter() - started
+        record.update({
+            'ops': ops,
+            'bytes': transferred,
+            'seconds': round(seconds, 4),
+            'ops_per_sec': round(ops / seconds, 1) if seconds else None,
+            'mb_per_sec': round(transferred / MB / seconds, 2) if seconds and transferred else None,
+            'latency': timer.summary(),
+            'retries': sum(op['retries'] for op in engine.metrics.snapshot()['operations'].values()),
+        })
+    except Exception as e:
+        logger.debug("Scenario failed", exc_info=True)
+        record['error'] = f"{type(e).__name__}: {e}"
+    record['peak_rss_mb'] = peak_rss_mb()
+    results.put(record)
+
+
+# --- driver ---
+
+class BenchTarget:
+    """The S3 endpoint under test and how to seed it"""
+
+    def __init__(self, endpoint_url=None):
+        self.server = None
+        if endpoint_url is None:
+            from s3_fake_server import FakeS3Server
+            self.server = FakeS3Server().start()
+            endpoint_url = self.server.url
+        self.endpoint_url = endpoint_url
+
+    def environ(self):
+        environ = {'AWS_ENDPOINT_URL': self.endpoint_url, 'S3_INDEX_PATH': '', 'S3_QUEUE_PATH': '',
+                   'AWS_DEFAULT_REGION': os.getenv('AWS_DEFAULT_REGION') or 'us-east-1'}
+        if self.server is not None:
+            # The fake server ignores signatures; never sign with real credentials
+            environ.update({'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench',
+                            'AWS_DEFAULT_REGION': 'us-east-1'})
+        return environ
+
+    def client(self):
+        import boto3
+        environ = self.environ()
+        return boto3.client('s3', endpoint_url=self.endpoint_url, region_name=environ['AWS_DEFAULT_REGION'],
+                            aws_access_key_id=environ.get('AWS_ACCESS_KEY_ID'),
+                            aws_secret_access_key=environ.get('AWS_SECRET_ACCESS_KEY'))
+
+    def create_bucket(self, bucket):
+        if self.server is not None:
+            self.server.create_bucket(bucket)
+            return
+        client = self.client()
+        try:
+            client.head_bucket(Bucket=bucket)
+        except Exception:
+            client.create_bucket(Bucket=bucket)
+
+    def seed(self, bucket, keys):
+        """Create empty objects under keys, directly in the fake server or with parallel PUTs"""
+        self.create_bucket(bucket)
+        if self.server is not None:
+            return self.server.seed(bucket, keys)
+        from concurrent.futures import ThreadPoolExecutor
+        client = self.client()
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            return sum(1 for _ in pool.map(lambda key: client.put_object(Bucket=bucket, Key=key, Body=b''), keys))
+
+    def close(self):
+        if self.server is not None:
+            self.server.stop()
+
+
+def run_child(name, params, environ, timeout):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_scenario, args=(name, params, environ, results))
+    process.start()
+    try:
+        record = results.get(timeout=timeout)
+    except Exception:
+        process.kill()
+        record = {'scenario': name, 'dataset': params['dataset'], 'error': f"no result within {timeout}s"}
+    process.join()
+    return record
+
+
+def print_record(record):
+    if 'error' in record:
+        print(f"{record['scenario']:<15} {record['dataset']:<14} ERROR {record['error']}")
+        return
+    latency = record['latency']
+    mb = f"{record['mb_per_sec']:>9.2f} MB/s" if record['mb_per_sec'] else ' ' * 14
+    print(f"{record['scenario']:<15} {record['dataset']:<14} {record['ops']:>9} ops {record['seconds']:>8.2f}s "
+          f"{record['ops_per_sec']:>10.1f} ops/s {mb}  p50 {latency['p50_ms']} ms  p99 {latency['p99_ms']} ms  "
+          f"RSS {record['peak_rss_mb']} MB")
+
+
+def run_benchmarks(args):
+    selected = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(selected) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    target = BenchTarget(args.endpoint_url)
+    environ = target.environ()
+    base = {'log_level': logging.WARNING if not args.verbose else logging.INFO}
+    records = []
+
+    def run(name, dataset, **params):
+        record = run_child(name, dict(base, dataset=dataset, **params), environ, args.timeout)
+        print_record(record)
+        records.append(record)
+
+    key_counts = [k.strip() for k in args.keys.split(',') if k.strip()]
+    if not {'list', 'du', 'delete'} & set(selected):
+        key_counts = []
+    workdir = tempfile.mkdtemp(prefix='s3bench-')
+    try:
+        for text in key_counts:
+            count = parse_count(text)
+            bucket = f'bench-keys-{count}'
+            started = time.perf_counter()
+            target.seed(bucket, dataset_keys(count, 'flat'))
+            target.seed(bucket, dataset_keys(count, 'tree'))
+            logger.info(f"Seeded {bucket} with {2 * count} keys in {time.perf_counter() - started:.1f}s")
+            dataset = f'{text}-keys'
+            if 'list' in selected:
+                run('list_folder', dataset, bucket=bucket)
+                run('list_recursive', dataset, bucket=bucket)
+            if 'du' in selected:
+                run('du', dataset, bucket=bucket)
+            if 'delete' in selected:
+                run('delete', dataset, bucket=bucket, folder='flat/')
+
+        transfers = [('small', args.small_files, int(args.small_kb * 1024)),
+                     ('large', args.large_files, int(args.large_mb * MB))]
+        for label, count, size in transfers:
+            if not count or not {'upload', 'download'} & set(selected):
+                continue
+            bucket = 'bench-transfers'
+            target.create_bucket(bucket)
+            source = os.path.join(workdir, label)
+            write_files(source, count, size)
+            dataset = f'{count}x{size // 1024}KB' if size < MB else f'{count}x{size // MB}MB'
+            params = {'bucket': bucket, 'prefix': '', 'source': source}
+            # Downloads read what the upload wrote, so the upload always runs first
+            run('upload', dataset, **params)
+            if 'download' in selected:
+                target_dir = os.path.join(workdir, f'{label}-download')
+                run('download', dataset, target=target_dir, **params)
+                shutil.rmtree(target_dir, ignore_errors=True)
+            shutil.rmtree(source, ignore_errors=True)
+    finally:
+        target.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return records
+
+
+def compare(records, baseline_path, tolerance):
+    """Print throughput changes against a previous results file; return the number of regressions"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['scenario'], r['dataset']): r for r in json.load(f)['results'] if 'error' not in r}
+    regressions = 0
+    for record in records:
+        before = baseline.get((record['scenario'], record['dataset']))
+        if before is None or 'error' in record or not before.get('ops_per_sec'):
+            continue
+        change = record['ops_per_sec'] / before['ops_per_sec'] - 1
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{record['scenario']:<15} {record['dataset']:<14} {change:+.1%} ops/s{flag}")
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='s3_bench.py', description="Benchmark the S3 engine against a local S3-compatible server")
+    parser.add_argument('--keys', default='1k,100k,1m',
+                        help="comma-separated dataset sizes for list/du/delete (default 1k,100k,1m)")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated subset of {','.join(SCENARIOS)} (default all)")
+    parser.add_argument('--small-files', type=int, default=1000, help="files in the many-small-files run (default 1000)")
+    parser.add_argument('--small-kb', type=float, default=16, help="size of each small file (default 16 KB)")
+    parser.add_argument('--large-files', type=int, default=2, help="files in the few-huge-files run (default 2)")
+    parser.add_argument('--large-mb', type=float, default=256, help="size of each large file (default 256 MB)")
+    parser.add_argument('--endpoint-url', help="benchmark this S3-compatible endpoint instead of the built-in fake")
+    parser.add_argument('--output', default='bench-results.json', help="results file (default bench-results.json)")
+    parser.add_argument('--compare', metavar='BASELINE', help="results file to compare ops/s against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="slowdown allowed before --compare reports a regression (default 0.2 = 20%%)")
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds allowed per scenario (default 3600)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log seeding and engine progress")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    import boto3
+    started = time.time()
+    try:
+        records = run_benchmarks(args)
+    except ValueError as e:
+        print(f"s3_bench.py: {e}", file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        return 130
+
+    settings = {name: value for name, value in sorted(os.environ.items())
+                if name.startswith('S3_') and name not in ('S3_INDEX_PATH', 'S3_QUEUE_PATH')}
+    report = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started)),
+        'endpoint': args.endpoint_url or 'in-process fake (s3_fake_server.py)',
+        'python': platform.python_version(),
+        'boto3': boto3.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': settings,
+        'results': records,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = sum(1 for r in records if 'error' in r)
+    regressions = compare(records, args.compare, args.tolerance) if args.compare else 0
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
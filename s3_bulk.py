@@ -0,0 +1,715 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from s3_tasks import OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# DeleteObjects accepts at most this many keys per request
+DELETE_BATCH_SIZE = 1000
+
+# Per-key DeleteObjects error codes worth retrying
+RETRYABLE_DELETE_ERRORS = ('InternalError', 'ServiceUnavailable', 'SlowDown', 'RequestTimeout')
+
+# CopyObject copies objects up to this size; larger ones need a multipart copy
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * MB
+
+# S3 allows at most this many parts in one multipart upload
+MAX_PARTS = 10000
+
+# HeadObject fields a multipart copy has to set itself; CopyObject carries them over
+COPIED_HEADERS = ('CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage', 'ContentType',
+                  'Expires', 'Metadata', 'StorageClass')
+
+
+def transfer_config_from_env():
+    """Build a boto3 TransferConfig from the S3_MULTIPART_* / S3_TRANSFER_* settings"""
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(
+        multipart_threshold=int(float(os.getenv('S3_MULTIPART_THRESHOLD_MB', '8')) * MB),
+        multipart_chunksize=int(float(os.getenv('S3_MULTIPART_CHUNKSIZE_MB', '8')) * MB),
+        max_concurrency=int(os.getenv('S3_TRANSFER_CONCURRENCY', '10')),
+    )
+
+
+class LocalFile:
+    """A file found by iter_local_files; relpath always uses '/' separators"""
+    __slots__ = ('path', 'relpath', 'size', 'mtime')
+
+    def __init__(self, path, relpath, size, mtime):
+        self.path = path
+        self.relpath = relpath
+        self.size = size
+        self.mtime = mtime
+
+
+def iter_local_files(root):
+    """Yield a LocalFile for every file under root without building a list first"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            logger.warning(f"Skipping unreadable directory {directory}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        relpath = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                        yield LocalFile(entry.path, relpath, stat.st_size, stat.st_mtime)
+                except OSError as e:
+                    logger.warning(f"Skipping {entry.path}: {e}")
+
+
+class TransferProgress:
+    """Thread-safe running totals for one bulk transfer
+
+    on_update(progress) is called from worker threads at most once every
+    update_interval seconds.
+    """
+
+    def __init__(self, on_update=None, update_interval=0.5):
+        self.on_update = on_update
+        self.update_interval = update_interval
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.failures = []  # [(name, exception), ...]
+        self.started = time.monotonic()
+        self.last_update = 0.0
+        self.lock = threading.Lock()
+
+    def add_file(self, size):
+        with self.lock:
+            self.files_total += 1
+            self.bytes_total += size
+
+    def add_bytes(self, amount):
+        with self.lock:
+            self.bytes_done += amount
+        self.maybe_update()
+
+    def file_done(self, count=1):
+        with self.lock:
+            self.files_done += count
+        self.maybe_update()
+
+    def file_failed(self, name, error):
+        logger.error(f"Failed: {name}: {error}")
+        with self.lock:
+            self.failures.append((name, error))
+        self.maybe_update()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def throughput(self):
+        """Return bytes per second since the transfer started"""
+        elapsed = self.elapsed
+        return self.bytes_done / elapsed if elapsed > 0 else 0.0
+
+    def maybe_update(self, force=False):
+        if not self.on_update:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_update < self.update_interval:
+                return
+            self.last_update = now
+        self.on_update(self)
+
+
+class BulkUploader:
+    """Uploads many local files concurrently on a thread pool
+
+    Files at or above small_file_size each get their own job and go through
+    boto3's managed transfer (multipart per transfer_config). Smaller files
+    are grouped into jobs of up to batch_files single put_object calls, so
+    thousands of tiny files do not each pay the scheduling and multipart
+    setup overhead.
+
+    Given a bandwidth TokenBucket (s3_queue), every file draws from it, so
+    bulk uploads stay under the same limit as the transfer queue.
+    """
+
+    def __init__(self, s3_client, transfer_config, max_workers=8, small_file_size=MB, batch_files=64,
+                 bandwidth=None):
+        self.s3_client = s3_client
+        self.transfer_config = transfer_config
+        self.max_workers = max_workers
+        self.small_file_size = small_file_size
+        self.batch_files = batch_files
+        self.bandwidth = bandwidth
+
+    def upload(self, files, bucket, progress, cancel_event=None):
+        """Upload (local_path, key, size) items from any iterable, even a lazy one
+
+        Per-file errors are recorded in progress.failures. Raises
+        OperationCancelled if cancel_event was set.
+        """
+        cancel_event = cancel_event or threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='s3-upload')
+        # Bounds the backlog so a 20k-file walk never queues more than this many jobs
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def submit(job, *args):
+            slots.acquire()
+            future = executor.submit(job, *args)
+            future.add_done_callback(lambda f: slots.release())
+
+        batch = []
+        try:
+            for local_path, key, size in files:
+                if cancel_event.is_set():
+                    break
+                progress.add_file(size)
+                if size < self.small_file_size:
+                    batch.append((local_path, key, size))
+                    if len(batch) >= self.batch_files:
+                        submit(self.upload_batch, bucket, batch, progress, cancel_event)
+                        batch = []
+                else:
+                    submit(self.upload_one, bucket, local_path, key, progress, cancel_event)
+            if batch and not cancel_event.is_set():
+                submit(self.upload_batch, bucket, batch, progress, cancel_event)
+        finally:
+            executor.shutdown(wait=True)
+            progress.maybe_update(force=True)
+
+        if cancel_event.is_set():
+            raise OperationCancelled(f"upload to s3://{bucket}")
+        logger.info(f"Uploaded {progress.files_done}/{progress.files_total} files to s3://{bucket} "
+                    f"in {progress.elapsed:.1f}s ({len(progress.failures)} failed)")
+        return progress
+
+    def upload_one(self, bucket, local_path, key, progress, cancel_event):
+        def callback(bytes_amount):
+            # Raising here aborts the multipart transfer from inside boto3
+            if cancel_event.is_set():
+                raise OperationCancelled(key)
+            if self.bandwidth is not None and bytes_amount > 0:
+                self.bandwidth.consume(bytes_amount, cancel_event)
+            progress.add_bytes(bytes_amount)
+
+        try:
+            self.s3_client.upload_file(local_path, bucket, key, Config=self.transfer_config, Callback=callback)
+        except OperationCancelled:
+            return
+        except Exception as e:
+            progress.file_failed(key, e)
+            return
+        progress.file_done()
+
+    def upload_batch(self, bucket, batch, progress, cancel_event):
+        for local_path, key, size in batch:
+            if cancel_event.is_set():
+                return
+            try:
+                if self.bandwidth is not None:
+                    self.bandwidth.consume(size, cancel_event)
+                with open(local_path, 'rb') as body:
+                    self.s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+            except OperationCancelled:
+                return
+            except Exception as e:
+                progress.file_failed(key, e)
+                continue
+            progress.add_bytes(size)
+            progress.file_done()
+
+
+class DownloadJournal:
+    """Append-only record of finished objects and byte ranges of a download
+
+    Kept as JOURNAL_NAME in the download directory. Each line is a JSON
+    object, either {"key", "etag", "done": true} for a finished object or
+    {"key", "etag", "start"} for a finished range of a large one, so a
+    re-run can skip both. Removed once a run completes without failures.
+    """
+
+    JOURNAL_NAME = '.s3download-journal.jsonl'
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.JOURNAL_NAME)
+        self.done = {}    # key -> etag
+        self.ranges = {}  # (key, etag) -> {start, ...}
+        self.file = None
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line after a crash
+                if record.get('done'):
+                    self.done[record['key']] = record['etag']
+                else:
+                    self.ranges.setdefault((record['key'], record['etag']), set()).add(record['start'])
+        logger.info(f"Resuming download: {len(self.done)} objects and "
+                    f"{sum(len(r) for r in self.ranges.values())} ranges already complete")
+
+    def is_done(self, key, etag):
+        return key in self.done and self.done[key] == etag
+
+    def completed_ranges(self, key, etag):
+        return self.ranges.get((key, etag), set())
+
+    def record_done(self, key, etag):
+        self.write({'key': key, 'etag': etag, 'done': True})
+
+    def record_range(self, key, etag, start):
+        self.write({'key': key, 'etag': etag, 'start': start})
+
+    def write(self, record):
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def close(self, remove=False):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if remove and os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class RangedDownload:
+    """Bookkeeping for one large object being fetched as concurrent ranges"""
+    __slots__ = ('key', 'etag', 'local_path', 'part_path', 'remaining', 'failed', 'lock')
+
+    def __init__(self, key, etag, local_path, part_path, remaining):
+        self.key = key
+        self.etag = etag
+        self.local_path = local_path
+        self.part_path = part_path
+        self.remaining = remaining
+        self.failed = False
+        self.lock = threading.Lock()
+
+
+class BulkDownloader:
+    """Downloads many objects concurrently, splitting large ones into ranged GETs
+
+    Objects below range_threshold are fetched with one GET. Larger ones are
+    preallocated on disk and fetched as part_size byte ranges written in
+    place by separate jobs. Everything is written to a PART_SUFFIX file that
+    is renamed once complete, and a DownloadJournal lets an interrupted run
+    skip finished objects and ranges. Given a bandwidth TokenBucket
+    (s3_queue), every chunk read draws from it.
+    """
+
+    PART_SUFFIX = '.s3part'
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, s3_client, max_workers=16, part_size=16 * MB, range_threshold=16 * MB, retries=3,
+                 bandwidth=None):
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+        self.part_size = part_size
+        self.range_threshold = range_threshold
+        self.retries = retries
+        self.bandwidth = bandwidth
+
+    def download(self, objects, bucket, directory, progress, cancel_event=None):
+        """Download (key, local_path, size, etag) items from any iterable, even a lazy one
+
+        etag may be None when unknown. Per-object errors are recorded in
+        progress.failures. Raises OperationCancelled if cancel_event was set.
+        """
+        cancel_event = cancel_event or threading.Event()
+        journal = DownloadJournal(directory)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='s3-download')
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def submit(job, *args):
+            slots.acquire()
+            future = executor.submit(job, *args)
+            future.add_done_callback(lambda f: slots.release())
+
+        try:
+            for key, local_path, size, etag in objects:
+                if cancel_event.is_set():
+                    break
+                progress.add_file(size)
+                if (journal.is_done(key, etag) and os.path.exists(local_path)
+                        and os.path.getsize(local_path) == size):
+                    progress.add_bytes(size)
+                    progress.file_done()
+                    continue
+
+                os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+                if size < self.range_threshold:
+                    submit(self.download_whole, bucket, key, local_path, etag, progress, cancel_event, journal)
+                else:
+                    self.start_ranged(submit, bucket, key, local_path, size, etag, progress, cancel_event, journal)
+        finally:
+            executor.shutdown(wait=True)
+            progress.maybe_update(force=True)
+            journal.close(remove=not progress.failures and not cancel_event.is_set())
+
+        if cancel_event.is_set():
+            raise OperationCancelled(f"download from s3://{bucket}")
+        logger.info(f"Downloaded {progress.files_done}/{progress.files_total} objects from s3://{bucket} "
+                    f"in {progress.elapsed:.1f}s ({len(progress.failures)} failed)")
+        return progress
+
+    def download_whole(self, bucket, key, local_path, etag, progress, cancel_event, journal):
+        part_path = local_path + self.PART_SUFFIX
+        try:
+            open(part_path, 'wb').close()
+            self.fetch(bucket, key, etag, part_path, 0, None, progress, cancel_event)
+            os.replace(part_path, local_path)
+        except OperationCancelled:
+            return
+        except Exception as e:
+            progress.file_failed(key, e)
+            return
+        journal.record_done(key, etag)
+        progress.file_done()
+
+    def start_ranged(self, submit, bucket, key, local_path, size, etag, progress, cancel_event, journal):
+        """Preallocate the part file (or reuse a resumable one) and queue its missing ranges"""
+        part_path = local_path + self.PART_SUFFIX
+        done = set()
+        if os.path.exists(part_path) and os.path.getsize(part_path) == size:
+            done = journal.completed_ranges(key, etag)
+        if not done:
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+
+        pending = []
+        for start in range(0, size, self.part_size):
+            if start in done:
+                progress.add_bytes(min(self.part_size, size - start))
+            else:
+                pending.append(start)
+
+        state = RangedDownload(key, etag, local_path, part_path, len(pending))
+        if not pending:
+            self.finish_ranged(state, progress, journal)
+            return
+        for start in pending:
+            end = min(start + self.part_size, size) - 1
+            submit(self.download_range, bucket, state, start, end, progress, cancel_event, journal)
+
+    def download_range(self, bucket, state, start, end, progress, cancel_event, journal):
+        try:
+            self.fetch(bucket, state.key, state.etag, state.part_path, start, end, progress, cancel_event)
+        except OperationCancelled:
+            return
+        except Exception as e:
+            with state.lock:
+                first_failure = not state.failed
+                state.failed = True
+            if first_failure:
+                progress.file_failed(state.key, e)
+            return
+
+        journal.record_range(state.key, state.etag, start)
+        with state.lock:
+            state.remaining -= 1
+            finished = state.remaining == 0 and not state.failed
+        if finished:
+            self.finish_ranged(state, progress, journal)
+
+    def finish_ranged(self, state, progress, journal):
+        os.replace(state.part_path, state.local_path)
+        journal.record_done(state.key, state.etag)
+        progress.file_done()
+
+    def fetch(self, bucket, key, etag, part_path, start, end, progress, cancel_event):
+        """GET key (or bytes start..end of it) into part_path at offset start
+
+        Dropped connections are retried with backoff; S3 errors such as
+        412 Precondition Failed (object changed) are raised straight away.
+        """
+        kwargs = {'Bucket': bucket, 'Key': key}
+        if etag:
+            kwargs['IfMatch'] = etag
+        if end is not None:
+            kwargs['Range'] = f'bytes={start}-{end}'
+
+        for attempt in range(self.retries + 1):
+            written = 0
+            try:
+                body = self.s3_client.get_object(**kwargs)['Body']
+                with open(part_path, 'r+b') as f:
+                    f.seek(start)
+                    for chunk in body.iter_chunks(self.CHUNK_SIZE):
+                        if self.bandwidth is not None:
+                            # Reading slower than the link lets TCP flow control slow the sender down
+                            self.bandwidth.consume(len(chunk), cancel_event)
+                        if cancel_event.is_set():
+                            raise OperationCancelled(key)
+                        f.write(chunk)
+                        written += len(chunk)
+                        progress.add_bytes(len(chunk))
+                return
+            except (ClientError, OperationCancelled):
+                raise
+            except Exception as e:
+                progress.add_bytes(-written)
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Retrying s3://{bucket}/{key} bytes {start}-{end} after error: {e}")
+                time.sleep(2 ** attempt)
+
+
+class BatchDeleter:
+    """Deletes keys with DeleteObjects, 1000 keys per request, several requests at once
+
+    Keys are consumed lazily, so a recursive listing can feed batches while
+    it is still paginating. Keys that come back with a transient per-key
+    error are retried in a smaller follow-up request.
+    """
+
+    def __init__(self, s3_client, max_workers=8, retries=3):
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+        self.retries = retries
+
+    def delete(self, keys, bucket, progress, cancel_event=None):
+        """Delete every key from any iterable; failures go to progress.failures"""
+        cancel_event = cancel_event or threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='s3-delete')
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def submit(batch):
+            slots.acquire()
+            future = executor.submit(self.delete_batch, bucket, batch, progress, cancel_event)
+            future.add_done_callback(lambda f: slots.release())
+
+        batch = []
+        try:
+            for key in keys:
+                if cancel_event.is_set():
+                    break
+                progress.add_file(0)
+                batch.append(key)
+                if len(batch) == DELETE_BATCH_SIZE:
+                    submit(batch)
+                    batch = []
+            if batch and not cancel_event.is_set():
+                submit(batch)
+        finally:
+            executor.shutdown(wait=True)
+            progress.maybe_update(force=True)
+
+        if cancel_event.is_set():
+            raise OperationCancelled(f"delete from s3://{bucket}")
+        logger.info(f"Deleted {progress.files_done}/{progress.files_total} objects from s3://{bucket} "
+                    f"in {progress.elapsed:.1f}s ({len(progress.failures)} failed)")
+        return progress
+
+    def delete_batch(self, bucket, keys, progress, cancel_event):
+        pending = keys
+        for attempt in range(self.retries + 1):
+            if cancel_event.is_set():
+                return
+            if attempt:
+                time.sleep(0.5 * 2 ** attempt)
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=bucket, Delete={'Objects': [{'Key': key} for key in pending], 'Quiet': True})
+            except ClientError as e:
+                if e.response['Error']['Code'] not in RETRYABLE_DELETE_ERRORS or attempt == self.retries:
+                    for key in pending:
+                        progress.file_failed(key, e)
+                    return
+                logger.warning(f"Retrying delete of {len(pending)} keys after error: {e}")
+                continue
+
+            # Quiet mode only reports the keys that were not deleted
+            errors = response.get('Errors', [])
+            progress.file_done(len(pending) - len(errors))
+            retry = []
+            for error in errors:
+                if error.get('Code') in RETRYABLE_DELETE_ERRORS:
+                    retry.append(error['Key'])
+                else:
+                    progress.file_failed(error['Key'], f"{error.get('Code')}: {error.get('Message')}")
+            if not retry:
+                return
+            logger.warning(f"Retrying delete of {len(retry)} keys with transient errors")
+            pending = retry
+
+        for key in pending:
+            progress.file_failed(key, "Delete still failing after retries")
+
+
+class MultipartCopy:
+    """Bookkeeping for one large object being copied as concurrent UploadPartCopy parts"""
+    __slots__ = ('source_key', 'key', 'etag', 'size', 'upload_id', 'part_size', 'etags', 'remaining', 'failed',
+                 'lock')
+
+    def __init__(self, source_key, key, etag, size, upload_id, part_size):
+        self.source_key = source_key
+        self.key = key
+        self.etag = etag
+        self.size = size
+        self.upload_id = upload_id
+        self.part_size = part_size
+        self.etags = {}  # part number -> ETag
+        self.remaining = -(-size // part_size)
+        self.failed = False
+        self.lock = threading.Lock()
+
+
+class BulkCopier:
+    """Copies many objects inside S3, several at once, without moving their data through this machine
+
+    Objects up to multipart_threshold (at most 5 GB, the CopyObject limit)
+    take one CopyObject, which keeps their metadata and tags. Larger ones
+    become a multipart upload whose UploadPartCopy parts are separate jobs
+    on the same pool, so a single huge object is copied in parallel too;
+    its metadata is carried over from a HeadObject, its tags are not.
+    """
+
+    def __init__(self, s3_client, max_workers=16, part_size=512 * MB, multipart_threshold=MAX_COPY_OBJECT_SIZE):
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+        self.part_size = part_size
+        self.multipart_threshold = min(multipart_threshold, MAX_COPY_OBJECT_SIZE)
+
+    def copy(self, items, bucket, dest_bucket, progress, cancel_event=None, on_copied=None):
+        """Copy (source_key, dest_key, size, etag) items from bucket to dest_bucket, from any iterable
+
+        etag may be None when unknown; otherwise the copy fails if the
+        source changed since. on_copied(item) is called from worker threads
+        for every object copied. Per-object errors are recorded in
+        progress.failures. Raises OperationCancelled if cancel_event was set.
+        """
+        cancel_event = cancel_event or threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='s3-copy')
+        slots = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def submit(job, *args):
+            slots.acquire()
+            future = executor.submit(job, *args)
+            future.add_done_callback(lambda f: slots.release())
+
+        try:
+            for item in items:
+                if cancel_event.is_set():
+                    break
+                source_key, key, size, etag = item
+                progress.add_file(size)
+                if size <= self.multipart_threshold:
+                    submit(self.copy_object, bucket, dest_bucket, item, progress, cancel_event, on_copied)
+                else:
+                    self.start_multipart(submit, bucket, dest_bucket, item, progress, cancel_event, on_copied)
+        finally:
+            executor.shutdown(wait=True)
+            progress.maybe_update(force=True)
+
+        if cancel_event.is_set():
+            raise OperationCancelled(f"copy from s3://{bucket}")
+        logger.info(f"Copied {progress.files_done}/{progress.files_total} objects from s3://{bucket} "
+                    f"to s3://{dest_bucket} in {progress.elapsed:.1f}s ({len(progress.failures)} failed)")
+        return progress
+
+    @staticmethod
+    def copy_source(bucket, key, etag):
+        kwargs = {'CopySource': {'Bucket': bucket, 'Key': key}}
+        if etag:
+            kwargs['CopySourceIfMatch'] = etag
+        return kwargs
+
+    def copy_object(self, bucket, dest_bucket, item, progress, cancel_event, on_copied):
+        source_key, key, size, etag = item
+        if cancel_event.is_set():
+            return
+        try:
+            self.s3_client.copy_object(Bucket=dest_bucket, Key=key, **self.copy_source(bucket, source_key, etag))
+        except Exception as e:
+            progress.file_failed(source_key, e)
+            return
+        progress.add_bytes(size)
+        progress.file_done()
+        if on_copied:
+            on_copied(item)
+
+    def start_multipart(self, submit, bucket, dest_bucket, item, progress, cancel_event, on_copied):
+        """Start the multipart upload for a large object and queue a job per part"""
+        source_key, key, size, etag = item
+        try:
+            head = self.s3_client.head_object(Bucket=bucket, Key=source_key, **({'IfMatch': etag} if etag else {}))
+            upload_id = self.s3_client.create_multipart_upload(
+                Bucket=dest_bucket, Key=key, **{name: head[name] for name in COPIED_HEADERS if name in head}
+            )['UploadId']
+        except Exception as e:
+            progress.file_failed(source_key, e)
+            return
+        # Pin every part to the version the HEAD saw, even if no ETag was listed
+        state = MultipartCopy(source_key, key, etag or head['ETag'], size, upload_id,
+                              max(self.part_size, -(-size // MAX_PARTS)))
+        logger.info(f"Copying s3://{bucket}/{source_key} in {state.remaining} parts")
+        for number in range(1, state.remaining + 1):
+            submit(self.copy_part, bucket, dest_bucket, item, state, number, progress, cancel_event, on_copied)
+
+    def copy_part(self, bucket, dest_bucket, item, state, number, progress, cancel_event, on_copied):
+        try:
+            if not state.failed and not cancel_event.is_set():
+                start = (number - 1) * state.part_size
+                end = min(start + state.part_size, state.size) - 1
+                response = self.s3_client.upload_part_copy(
+                    Bucket=dest_bucket, Key=state.key, UploadId=state.upload_id, PartNumber=number,
+                    CopySourceRange=f'bytes={start}-{end}', **self.copy_source(bucket, state.source_key, state.etag))
+                with state.lock:
+                    state.etags[number] = response['CopyPartResult']['ETag']
+                progress.add_bytes(end - start + 1)
+        except Exception as e:
+            with state.lock:
+                first_failure = not state.failed
+                state.failed = True
+            if first_failure:
+                progress.file_failed(state.source_key, e)
+
+        with state.lock:
+            state.remaining -= 1
+            last = state.remaining == 0
+        if last:
+            self.finish_multipart(dest_bucket, item, state, progress, cancel_event, on_copied)
+
+    def finish_multipart(self, dest_bucket, item, state, progress, cancel_event, on_copied):
+        """Complete the upload once every part is copied, or abort it so no parts are left behind"""
+        if not state.failed and not cancel_event.is_set():
+            try:
+                self.s3_client.complete_multipart_upload(
+                    Bucket=dest_bucket, Key=state.key, UploadId=state.upload_id,
+                    MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etag}
+                                               for number, etag in sorted(state.etags.items())]})
+            except Exception as e:
+                progress.file_failed(state.source_key, e)
+            else:
+                progress.file_done()
+                if on_copied:
+                    on_copied(item)
+                return
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=dest_bucket, Key=state.key, UploadId=state.upload_id)
+        except ClientError as e:
+            logger.warning(f"Could not abort multipart copy to s3://{dest_bucket}/{state.key}: {e}")
@@ -0,0 +1,354 @@
+"""Command-line front end to the same S3 operations the GUI uses
+
+Examples:
+    python s3_cli.py ls s3://my-bucket/documents/
+    python s3_cli.py cp -r ./build s3://my-bucket/artifacts/
+    python s3_cli.py mv -r s3://my-bucket/incoming s3://archive-bucket/2024/
+    python s3_cli.py sync --delete ./site s3://my-bucket/www/
+    python s3_cli.py du s3://my-bucket/logs/
+
+boto3 is only imported once a command actually needs S3, so --help and
+argument errors return immediately.
+"""
+import argparse
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='s3_cli.py', description="Headless AWS S3 client (same engine as s3_client_gui.py)")
+    parser.add_argument('-v', '--verbose', action='count', default=0, help="-v for info, -vv for debug logging")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="write API call and transfer metrics to FILE when done (Prometheus text for .prom, else JSON)")
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    ls = commands.add_parser('ls', help="list a bucket/folder")
+    ls.add_argument('path', help="s3://bucket[/prefix]")
+    ls.add_argument('-r', '--recursive', action='store_true', help="list every key under the prefix")
+
+    cp = commands.add_parser('cp', help="copy files between the local disk and S3, or within S3 (server-side)")
+    cp.add_argument('source', help="local path or s3://bucket/key")
+    cp.add_argument('destination', help="local path or s3://bucket/key")
+    cp.add_argument('-r', '--recursive', action='store_true',
+                    help="copy a directory or folder; it is created inside the destination")
+
+    mv = commands.add_parser('mv', help="move or rename objects within S3 (server-side copy, then delete)")
+    mv.add_argument('source', help="s3://bucket/key")
+    mv.add_argument('destination', help="s3://bucket/key, or s3://bucket/folder/ to keep the name")
+    mv.add_argument('-r', '--recursive', action='store_true',
+                    help="move a folder; it is created inside the destination")
+
+    rm = commands.add_parser('rm', help="delete an object, or a folder with -r")
+    rm.add_argument('path', help="s3://bucket/key")
+    rm.add_argument('-r', '--recursive', action='store_true', help="delete every key under the prefix")
+
+    sync = commands.add_parser('sync', help="transfer only new and changed files")
+    sync.add_argument('source', help="local directory or s3://bucket/prefix")
+    sync.add_argument('destination', help="local directory or s3://bucket/prefix")
+    sync.add_argument('--delete', action='store_true', help="delete files that only exist on the destination")
+    sync.add_argument('--dryrun', action='store_true', help="print the plan without changing anything")
+
+    du = commands.add_parser('du', help="size and object count of a prefix and each of its folders")
+    du.add_argument('path', help="s3://bucket[/prefix]")
+    du.add_argument('-s', '--summarize', action='store_true', help="only print the total")
+
+    index = commands.add_parser('index', help="build the local metadata index of a bucket/prefix")
+    index.add_argument('path', help="s3://bucket[/prefix]")
+    index.add_argument('--refresh', action='store_true', help="only re-list prefixes marked stale")
+
+    find = commands.add_parser('find', help="search the local metadata index")
+    find.add_argument('path', help="s3://bucket[/prefix]")
+    find.add_argument('query', nargs='+',
+                      help="words, a glob like '*.jpg', size>10MB, size<1GB, after:2024-01-01, before:2024-12-31")
+    find.add_argument('--limit', type=int, default=1000, help="maximum number of results (default 1000)")
+
+    return parser
+
+
+def is_s3_url(path):
+    return path.startswith('s3://')
+
+
+def progress_printer(label):
+    """Return a TransferProgress on_update callback writing one status line to stderr"""
+    from s3_engine import format_size
+
+    def update(progress):
+        if sys.stderr.isatty():
+            sys.stderr.write(f"\r{label}: {progress.files_done}/{progress.files_total} files, "
+                             f"{format_size(progress.bytes_done)} @ {format_size(progress.throughput())}/s   ")
+            sys.stderr.flush()
+    return update
+
+
+def report(progress, verb):
+    """Print the outcome of a bulk operation; return the exit status"""
+    from s3_engine import format_size
+    if sys.stderr.isatty():
+        sys.stderr.write('\n')
+    print(f"{verb} {progress.files_done}/{progress.files_total} files "
+          f"({format_size(progress.bytes_done)}) in {progress.elapsed:.1f}s")
+    for name, error in progress.failures:
+        print(f"failed: {name}: {error}", file=sys.stderr)
+    return 1 if progress.failures else 0
+
+
+def cmd_ls(engine, args):
+    import time
+    from s3_engine import S3Engine
+    from s3_listing import normalize_prefix
+    bucket, prefix = S3Engine.parse_s3_url(args.path)
+    if args.recursive:
+        for obj in engine.iter_objects(bucket, normalize_prefix(prefix)):
+            modified = obj['LastModified'].strftime('%Y-%m-%d %H:%M:%S')
+            print(f"{modified} {obj['Size']:>14} {obj['Key']}")
+        return 0
+
+    for page in engine.list_folder(bucket, prefix):
+        for folder in page.folders:
+            print(f"{'PRE':>34} {folder}")
+        for name, size, mtime in zip(page.names, page.sizes, page.mtimes):
+            modified = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(mtime))
+            print(f"{modified} {size:>14} {name}")
+    return 0
+
+
+def cmd_cp(engine, args):
+    from s3_bulk import TransferProgress
+    from s3_engine import S3Engine
+    if is_s3_url(args.source) and is_s3_url(args.destination):
+        return copy_within_s3(engine, args, move=False)
+    if not is_s3_url(args.source) and not is_s3_url(args.destination):
+        print("cp: source or destination must be an s3:// URL", file=sys.stderr)
+        return 2
+
+    if is_s3_url(args.destination):
+        bucket, prefix = S3Engine.parse_s3_url(args.destination)
+        if os.path.isdir(args.source) and not args.recursive:
+            print(f"cp: {args.source} is a directory (use -r)", file=sys.stderr)
+            return 2
+        if os.path.isdir(args.source) or not prefix or prefix.endswith('/'):
+            files = engine.iter_upload_items([args.source], prefix)
+        else:
+            # An explicit key name was given for a single file
+            files = [(args.source, prefix, os.path.getsize(args.source))]
+        progress = TransferProgress(on_update=progress_printer("upload"))
+        engine.upload(files, bucket, progress)
+        return report(progress, "Uploaded")
+
+    bucket, key = S3Engine.parse_s3_url(args.source)
+    if args.recursive:
+        parent, _, name = (key or '').rstrip('/').rpartition('/')
+        if not name:
+            print("cp: use sync to copy a whole bucket", file=sys.stderr)
+            return 2
+        os.makedirs(args.destination, exist_ok=True)
+        progress = TransferProgress(on_update=progress_printer("download"))
+        objects = engine.iter_download_items(bucket, parent, [name + '/'], args.destination)
+        engine.download(objects, bucket, args.destination, progress)
+        return report(progress, "Downloaded")
+
+    if not key:
+        print("cp: source must name an object (or use -r)", file=sys.stderr)
+        return 2
+    local_path = args.destination
+    if os.path.isdir(local_path):
+        local_path = os.path.join(local_path, key.rsplit('/', 1)[-1])
+    progress = TransferProgress(on_update=progress_printer("download"))
+    engine.download_file(bucket, key, local_path, progress)
+    if not progress.failures:
+        print(f"download: s3://{bucket}/{key} -> {local_path}")
+    return report(progress, "Downloaded")
+
+
+def cmd_mv(engine, args):
+    if not is_s3_url(args.source) or not is_s3_url(args.destination):
+        print("mv: source and destination must both be s3:// URLs", file=sys.stderr)
+        return 2
+    return copy_within_s3(engine, args, move=True)
+
+
+def copy_within_s3(engine, args, move):
+    """cp/mv between two s3:// URLs; objects are copied by S3 itself, never downloaded"""
+    from s3_bulk import TransferProgress
+    from s3_engine import S3Engine
+    command = 'mv' if move else 'cp'
+    bucket, key = S3Engine.parse_s3_url(args.source)
+    dest_bucket, dest_key = S3Engine.parse_s3_url(args.destination)
+    key, dest_key = key or '', dest_key or ''
+
+    parent, _, name = key.rstrip('/').rpartition('/')
+    if args.recursive:
+        if not name:
+            print(f"{command}: source must name a folder (whole buckets are not copied)", file=sys.stderr)
+            return 2
+        names, dest_prefix, new_name = [name + '/'], dest_key, None
+    elif not name or key.endswith('/'):
+        print(f"{command}: source must name an object (or use -r)", file=sys.stderr)
+        return 2
+    elif not dest_key or dest_key.endswith('/'):
+        names, dest_prefix, new_name = [name], dest_key, None
+    else:
+        # An explicit key name was given for the copy
+        dest_prefix, _, new_name = dest_key.rpartition('/')
+        names = [name]
+
+    try:
+        S3Engine.check_copy(bucket, parent, names, dest_bucket, dest_prefix, new_name)
+    except ValueError as e:
+        print(f"{command}: {e}", file=sys.stderr)
+        return 2
+    progress = TransferProgress(on_update=progress_printer(command))
+    items = engine.iter_copy_items(bucket, parent, names, dest_bucket, dest_prefix, new_name)
+    if move:
+        engine.move(items, bucket, dest_bucket, progress)
+        return report(progress, "Moved")
+    engine.copy(items, bucket, dest_bucket, progress)
+    return report(progress, "Copied")
+
+
+def cmd_rm(engine, args):
+    from s3_bulk import TransferProgress
+    from s3_engine import S3Engine
+    from s3_listing import normalize_prefix
+    bucket, key = S3Engine.parse_s3_url(args.path)
+    if args.recursive:
+        keys = (obj['Key'] for obj in engine.iter_objects(bucket, normalize_prefix(key)))
+        progress = TransferProgress(on_update=progress_printer("delete"))
+        engine.delete(keys, bucket, progress)
+        return report(progress, "Deleted")
+
+    if not key:
+        print("rm: path must name an object (or use -r)", file=sys.stderr)
+        return 2
+    engine.delete_object(bucket, key)
+    print(f"delete: s3://{bucket}/{key}")
+    return 0
+
+
+def cmd_sync(engine, args):
+    from s3_bulk import TransferProgress
+    from s3_engine import S3Engine, format_size
+    from s3_sync import DOWNLOAD, UPLOAD
+    if is_s3_url(args.source) == is_s3_url(args.destination):
+        print("sync: exactly one of source and destination must be an s3:// URL", file=sys.stderr)
+        return 2
+
+    if is_s3_url(args.destination):
+        direction, local_root, url = UPLOAD, args.source, args.destination
+    else:
+        direction, local_root, url = DOWNLOAD, args.destination, args.source
+    bucket, prefix = S3Engine.parse_s3_url(url)
+
+    plan = engine.sync_plan(direction, local_root, bucket, prefix, args.delete)
+    if args.dryrun:
+        for line in plan.describe():
+            print(f"(dryrun) {line}")
+        print(f"{len(plan.transfers)} to {direction} ({format_size(plan.transfer_bytes)}), "
+              f"{len(plan.deletes)} to delete, {plan.unchanged} unchanged")
+        return 0
+    if not plan.transfers and not plan.deletes:
+        print(f"Already in sync ({plan.unchanged} files unchanged)")
+        return 0
+
+    progress = TransferProgress(on_update=progress_printer("sync"))
+    engine.sync_execute(plan, progress)
+    return report(progress, "Synced")
+
+
+def cmd_du(engine, args):
+    from s3_engine import S3Engine, format_size
+    from s3_listing import normalize_prefix
+    bucket, prefix = S3Engine.parse_s3_url(args.path)
+    prefix = normalize_prefix(prefix)
+    total, folders = engine.du(bucket, prefix)
+    if not args.summarize:
+        for name in sorted(folders):
+            usage = folders[name]
+            print(f"{format_size(usage.bytes)}\t{usage.count} objects\ts3://{bucket}/{prefix}{name}")
+    print(f"{format_size(total.bytes)}\t{total.count} objects\ts3://{bucket}/{prefix}")
+    return 0
+
+
+def cmd_index(engine, args):
+    from s3_engine import S3Engine
+    if engine.index is None:
+        print("index: the metadata index is disabled (S3_INDEX_PATH is empty)", file=sys.stderr)
+        return 1
+    bucket, prefix = S3Engine.parse_s3_url(args.path)
+
+    def on_progress(count):
+        if sys.stderr.isatty():
+            sys.stderr.write(f"\rindex: {count} keys   ")
+            sys.stderr.flush()
+
+    if args.refresh:
+        refreshed = engine.refresh_index(bucket, on_progress=on_progress)
+        print(f"Refreshed {refreshed} stale prefix(es) of s3://{bucket}")
+    else:
+        count = engine.build_index(bucket, prefix, on_progress=on_progress)
+        print(f"Indexed {count} keys of s3://{bucket}/{prefix or ''}")
+    return 0
+
+
+def cmd_find(engine, args):
+    import time
+    from s3_engine import S3Engine
+    if engine.index is None:
+        print("find: the metadata index is disabled (S3_INDEX_PATH is empty)", file=sys.stderr)
+        return 1
+    bucket, prefix = S3Engine.parse_s3_url(args.path)
+    try:
+        rows = engine.search_index(bucket, ' '.join(args.query), prefix, args.limit)
+    except ValueError as e:
+        print(f"find: {e}", file=sys.stderr)
+        return 2
+    for key, size, mtime in rows:
+        modified = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(mtime))
+        print(f"{modified} {size:>14} {key}")
+    if engine.index.covers(bucket, prefix) is None:
+        print(f"find: s3://{bucket}/{prefix or ''} has not been indexed; run 'index' first", file=sys.stderr)
+    return 0
+
+
+COMMANDS = {'ls': cmd_ls, 'cp': cmd_cp, 'mv': cmd_mv, 'rm': cmd_rm, 'sync': cmd_sync, 'du': cmd_du,
+            'index': cmd_index, 'find': cmd_find}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)],
+        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    from s3_engine import S3Engine
+    engine = None
+    try:
+        engine = S3Engine()
+        return COMMANDS[args.command](engine, args)
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        # ClientError carries the S3 error code; anything else is reported as is
+        error = getattr(e, 'response', {}).get('Error', {})
+        if error:
+            print(f"{args.command}: AWS Error ({error.get('Code')}): {error.get('Message')}", file=sys.stderr)
+        else:
+            logger.debug("Command failed", exc_info=True)
+            print(f"{args.command}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.metrics and engine is not None:
+            engine.metrics.export(args.metrics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,29 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
-import boto3
+import base64
+import io
 from botocore.exceptions import ClientError, NoCredentialsError
 import os
 from dotenv import load_dotenv
 import threading
 import logging
+import time
+import queue
+from array import array
 
-# Set up console logging
+from s3_bulk import TransferProgress
+from s3_engine import OFFLINE_ERRORS, S3Engine, format_size
+from s3_listing import ListingCache, ListingPrefetcher, ListingResult, normalize_prefix
+from s3_preview import HEX_WIDTH, TK_IMAGE_EXTENSIONS, detect_encoding, hexdump, text_decoder
+from s3_queue import FAILED, PAUSED, QUEUED, RUNNING
+from s3_sync import DOWNLOAD, UPLOAD
+from s3_tasks import TaskRunner
+
+load_dotenv()
+
+# Set up console logging; at DEBUG botocore logs every request, which slows large transfers down
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv('S3_LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(),  # Console output
@@ -17,17 +31,549 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+class VirtualObjectView:
+    """Treeview over a ListingResult that only materializes the visible rows
+
+    Entries stay in the columnar ListingResult. Display order is kept as two
+    index arrays (folders first, then files), so sorting permutes integers
+    instead of re-inserting widgets, and each scroll re-creates just the few
+    dozen rows that fit in the window. Row iids are 'd<index>' for folders
+    and 'f<index>' for files.
+    """
+    
+    SORT_HEADINGS = {'Name': 'Name', 'Size': 'Size', 'Modified': 'Last Modified'}
+    
+    def __init__(self, tree, scrollbar, format_size):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.format_size = format_size
+        self.listing = ListingResult()
+        self.folder_order = array('l')
+        self.file_order = array('l')
+        self.sort_column = 'Name'
+        self.sort_reverse = False
+        self.offset = 0
+        self.visible_rows = 25
+        self.selected = set()
+        self.folder_sizes = {}  # folder name -> PrefixUsage, once calculated
+        self.render_pending = False
+        
+        self.scrollbar.configure(command=self.yview)
+        for column in self.SORT_HEADINGS:
+            self.tree.heading(column, command=lambda c=column: self.sort_by(c))
+        self.tree.bind('<Configure>', self.on_configure)
+        self.tree.bind('<<TreeviewSelect>>', self.on_select)
+        self.tree.bind('<MouseWheel>', self.on_mousewheel)
+        self.tree.bind('<Button-4>', lambda e: self.scroll_to(self.offset - 3))
+        self.tree.bind('<Button-5>', lambda e: self.scroll_to(self.offset + 3))
+        for key in ('Up', 'Down', 'Prior', 'Next', 'Home', 'End'):
+            self.tree.bind(f'<{key}>', self.on_key)
+    
+    def __len__(self):
+        return len(self.folder_order) + len(self.file_order)
+    
+    @property
+    def folder_count(self):
+        return len(self.listing.folders)
+    
+    @property
+    def file_count(self):
+        return len(self.listing.names)
+    
+    def clear(self):
+        self.listing = ListingResult()
+        self.folder_order = array('l')
+        self.file_order = array('l')
+        self.offset = 0
+        self.selected = set()
+        self.folder_sizes = {}
+        self.schedule_render()
+    
+    def set_folder_sizes(self, sizes):
+        """Show calculated totals ({folder name: PrefixUsage}) in the folder rows"""
+        self.folder_sizes.update(sizes)
+        self.schedule_render()
+    
+    def append_page(self, page):
+        """Add a page of entries; they go to the end of each group until finish()"""
+        first_folder, first_file = self.folder_count, self.file_count
+        self.listing.add_page(page)
+        self.folder_order.extend(range(first_folder, self.folder_count))
+        self.file_order.extend(range(first_file, self.file_count))
+        self.schedule_render()
+    
+    def finish(self):
+        """Apply the active sort once the listing is complete"""
+        if (self.sort_column, self.sort_reverse) != ('Name', False):
+            self.apply_sort()
+    
+    def sort_by(self, column):
+        """Sort by a column, toggling direction when it is already the sort column"""
+        if column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = False
+        self.apply_sort()
+    
+    def apply_sort(self):
+        listing = self.listing
+        file_key = {'Name': listing.names.__getitem__,
+                    'Size': listing.sizes.__getitem__,
+                    'Modified': listing.mtimes.__getitem__}[self.sort_column]
+        # Folders sort by their calculated totals when there are any, otherwise by name
+        folder_key = listing.folders.__getitem__
+        folder_reverse = self.sort_reverse
+        if self.sort_column != 'Name':
+            if self.folder_sizes:
+                attribute = 'bytes' if self.sort_column == 'Size' else 'newest'
+                sizes = self.folder_sizes
+                folder_key = lambda i: getattr(sizes.get(listing.folders[i]), attribute, -1)
+            else:
+                folder_reverse = False
+        self.folder_order = array('l', sorted(range(self.folder_count), key=folder_key, reverse=folder_reverse))
+        self.file_order = array('l', sorted(range(self.file_count), key=file_key, reverse=self.sort_reverse))
+        
+        for column, text in self.SORT_HEADINGS.items():
+            if column == self.sort_column:
+                text += ' ▼' if self.sort_reverse else ' ▲'
+            self.tree.heading(column, text=text)
+        self.schedule_render()
+    
+    def iid_at(self, position):
+        """Return the row iid shown at a display position"""
+        folders = len(self.folder_order)
+        if position < folders:
+            return f'd{self.folder_order[position]}'
+        return f'f{self.file_order[position - folders]}'
+    
+    def name_for(self, iid):
+        """Return the display name of a row ('name/' for folders)"""
+        index = int(iid[1:])
+        return self.listing.folders[index] if iid[0] == 'd' else self.listing.names[index]
+    
+    def selected_names(self):
+        """Return display names of every selected entry, in display order"""
+        return [self.name_for(iid) for iid in sorted(self.selected, key=lambda i: (i[0], int(i[1:])))]
+    
+    def visible_folders(self):
+        """Return names of the folder rows currently in the window"""
+        return [self.name_for(iid) for iid in self.tree.get_children() if iid[0] == 'd']
+    
+    def schedule_render(self):
+        # Coalesce bursts of updates (e.g. one per listing page) into one redraw
+        if not self.render_pending:
+            self.render_pending = True
+            self.tree.after_idle(self.render)
+    
+    def render(self):
+        """Re-create the Treeview rows for the visible window"""
+        self.render_pending = False
+        total = len(self)
+        self.offset = max(0, min(self.offset, total - self.visible_rows))
+        focus = self.tree.focus()
+        
+        self.tree.delete(*self.tree.get_children())
+        for position in range(self.offset, min(total, self.offset + self.visible_rows)):
+            iid = self.iid_at(position)
+            index = int(iid[1:])
+            if iid[0] == 'd':
+                name = self.listing.folders[index]
+                usage = self.folder_sizes.get(name)
+                if usage is None:
+                    values = (name, '', '')
+                else:
+                    newest = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(usage.newest)) if usage.count else ''
+                    values = (name, self.format_size(usage.bytes), newest)
+                self.tree.insert('', tk.END, iid=iid, text='📁', values=values)
+            else:
+                modified = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self.listing.mtimes[index]))
+                self.tree.insert('', tk.END, iid=iid, text='📄',
+                                 values=(self.listing.names[index],
+                                         self.format_size(self.listing.sizes[index]), modified))
+        
+        self.tree.selection_set([iid for iid in self.tree.get_children() if iid in self.selected])
+        if focus and self.tree.exists(focus):
+            self.tree.focus(focus)
+        
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.visible_rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def scroll_to(self, offset):
+        offset = max(0, min(offset, len(self) - self.visible_rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.schedule_render()
+    
+    def yview(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'|'pages')"""
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * len(self)))
+        elif args[0] == 'scroll':
+            step = self.visible_rows if args[2] == 'pages' else 1
+            self.scroll_to(self.offset + int(args[1]) * step)
+    
+    def on_configure(self, event):
+        rowheight = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        # One row's worth of height goes to the column headings
+        visible_rows = max(1, event.height // rowheight - 1)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.schedule_render()
+    
+    def on_select(self, event):
+        # Rows outside the window keep their selection state
+        visible = set(self.tree.get_children())
+        self.selected = (self.selected - visible) | set(self.tree.selection())
+    
+    def on_mousewheel(self, event):
+        self.scroll_to(self.offset - int(event.delta / 120 or (1 if event.delta > 0 else -1)) * 3)
+        return 'break'
+    
+    def on_key(self, event):
+        """Move the window when keyboard navigation reaches its edge"""
+        children = self.tree.get_children()
+        focus = self.tree.focus()
+        if event.keysym == 'Prior':
+            self.scroll_to(self.offset - self.visible_rows)
+        elif event.keysym == 'Next':
+            self.scroll_to(self.offset + self.visible_rows)
+        elif event.keysym == 'Home':
+            self.scroll_to(0)
+        elif event.keysym == 'End':
+            self.scroll_to(len(self))
+        elif event.keysym == 'Up' and children and focus == children[0] and self.offset > 0:
+            self.step_selection(self.offset - 1)
+        elif event.keysym == 'Down' and children and focus == children[-1] and self.offset + len(children) < len(self):
+            self.step_selection(self.offset + len(children))
+        else:
+            return None
+        return 'break'
+    
+    def step_selection(self, position):
+        """Select and focus the entry at a display position just outside the window"""
+        iid = self.iid_at(position)
+        self.selected = {iid}
+        self.scroll_to(position if position < self.offset else position - self.visible_rows + 1)
+        self.render()
+        self.tree.focus(iid)
+
+class PreviewPane:
+    """Shows part of one object, fetched with ranged GETs rather than a download
+    
+    The first and last window_size bytes are fetched up front; the gap
+    between them is filled one window at a time as it scrolls into view,
+    and "Go to..." restarts the view at any offset. Text is decoded as it
+    arrives, binary objects are shown as a hex dump, and images up to
+    image_limit bytes are rendered straight from the fetched bytes. Fetched
+    chunks stay in the engine's LRU cache, so going back is free.
+    """
+    
+    def __init__(self, parent, app, window_size=64 * 1024, image_limit=5 * 1024 * 1024):
+        self.app = app
+        self.window_size = window_size
+        self.image_limit = image_limit
+        self.handle = None
+        self.current = None       # (bucket, key) shown or loading
+        self.task = None
+        self.generation = 0       # results of older loads are ignored
+        self.encoding = None      # None for hex dumps
+        self.decoder = None
+        self.loaded_end = 0       # end of the region shown above the gap
+        self.gap_end = 0          # start of the tail region; equal to loaded_end once joined
+        self.loading = False
+        self.check_pending = False
+        self.photo = None
+        
+        self.frame = ttk.Frame(parent, padding=(5, 0, 0, 0))
+        self.title_label = ttk.Label(self.frame, text="Select a file to preview", foreground="gray")
+        self.title_label.pack(anchor=tk.W)
+        
+        nav_frame = ttk.Frame(self.frame)
+        nav_frame.pack(fill=tk.X, pady=(2, 2))
+        ttk.Button(nav_frame, text="Start", command=lambda: self.go_to(0)).pack(side=tk.LEFT)
+        ttk.Button(nav_frame, text="End", command=lambda: self.text.see(tk.END)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(nav_frame, text="Go to...", command=self.ask_offset).pack(side=tk.LEFT)
+        
+        self.body = ttk.Frame(self.frame)
+        self.body.pack(fill=tk.BOTH, expand=True)
+        self.text = tk.Text(self.body, wrap=tk.NONE, width=60, font='TkFixedFont', state=tk.DISABLED)
+        self.yscroll = ttk.Scrollbar(self.body, orient=tk.VERTICAL, command=self.text.yview)
+        self.xscroll = ttk.Scrollbar(self.body, orient=tk.HORIZONTAL, command=self.text.xview)
+        self.text.configure(yscrollcommand=self.on_scroll, xscrollcommand=self.xscroll.set)
+        self.text.tag_configure('note', foreground='gray', justify=tk.CENTER)
+        self.image_label = ttk.Label(self.body, anchor=tk.CENTER)
+        self.pack_text()
+    
+    def clear(self, message="Select a file to preview"):
+        self.cancel()
+        self.handle = None
+        self.current = None
+        self.title_label.config(text=message, foreground="gray")
+        self.set_text("")
+    
+    def cancel(self):
+        self.generation += 1
+        self.loading = False
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+    
+    def show(self, bucket, key):
+        """Preview s3://bucket/key, replacing whatever is shown"""
+        self.cancel()
+        self.handle = None
+        self.current = (bucket, key)
+        self.title_label.config(text=f"Loading {key}...", foreground="gray")
+        self.set_text("")
+        self.submit(f"Preview s3://{bucket}/{key}", self.open_worker, bucket, key, on_success=self.on_opened)
+    
+    def go_to(self, offset):
+        """Restart the view at offset, keeping the end of the object below it"""
+        if self.handle is None or self.photo is not None:
+            return
+        offset = max(0, min(offset, self.handle.size))
+        if self.encoding is None:
+            offset -= offset % HEX_WIDTH
+        self.cancel()
+        self.submit(f"Preview s3://{self.handle.bucket}/{self.handle.key} at {offset}",
+                    self.window_worker, self.handle, offset, self.encoding, on_success=self.show_window)
+    
+    def ask_offset(self):
+        if self.handle is None:
+            return
+        answer = simpledialog.askstring(
+            "Go to", f"Byte offset (0 - {self.handle.size}) or a percentage such as 50%:", parent=self.frame)
+        if not answer:
+            return
+        try:
+            answer = answer.strip()
+            if answer.endswith('%'):
+                offset = int(self.handle.size * float(answer[:-1]) / 100)
+            else:
+                offset = int(answer)
+        except ValueError:
+            messagebox.showerror("Go to", f"Not an offset: {answer}", parent=self.frame)
+            return
+        self.go_to(offset)
+    
+    def submit(self, name, fn, *args, on_success):
+        generation = self.generation
+        
+        def success(result):
+            if generation == self.generation:
+                self.task = None
+                on_success(result)
+        
+        def error(e):
+            if generation == self.generation:
+                self.task = None
+                self.on_error(e)
+        self.task = self.app.runner.submit(name, fn, *args, on_success=success, on_error=error)
+    
+    # --- worker threads ---
+    
+    def open_worker(self, task, bucket, key):
+        handle = self.app.engine.open_object(bucket, key)
+        if handle.is_image and handle.size <= self.image_limit:
+            return handle, self.app.engine.read_object(handle, 0, handle.size, task.cancel_event)
+        sample = self.app.engine.read_object(handle, 0, self.window_size, task.cancel_event)
+        return handle, self.window_worker(task, handle, 0, detect_encoding(sample))
+    
+    def window_worker(self, task, handle, start, encoding):
+        """Return (start, head, tail_start, tail, encoding) for a view starting at start"""
+        head = self.app.engine.read_object(handle, start, self.window_size, task.cancel_event)
+        tail_start = max(start + len(head), handle.size - self.window_size)
+        if encoding is None:
+            tail_start = min(handle.size, tail_start + (-tail_start) % HEX_WIDTH)
+        tail = self.app.engine.read_object(handle, tail_start, handle.size - tail_start, task.cancel_event)
+        return start, head, tail_start, tail, encoding
+    
+    # --- main thread ---
+    
+    def on_opened(self, result):
+        handle, content = result
+        self.handle = handle
+        self.title_label.config(
+            text=f"{handle.key} ({self.app.format_size(handle.size)}, {handle.content_type or 'unknown type'})",
+            foreground="black")
+        if isinstance(content, bytes):
+            self.show_image(content)
+        else:
+            self.show_window(content)
+    
+    def show_window(self, window):
+        start, head, tail_start, tail, encoding = window
+        self.encoding = encoding
+        self.decoder = text_decoder(encoding) if encoding else None
+        self.loaded_end = start + len(head)
+        self.gap_end = tail_start
+        self.show_text_widget()
+        
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete('1.0', tk.END)
+        if start:
+            self.text.insert(tk.END, f"--- first {self.app.format_size(start)} not shown (Start) ---\n", 'note')
+        self.text.insert(tk.END, self.render_bytes(head, start, self.decoder))
+        # Windows loaded later go in at this mark, between the head and the gap note
+        self.text.mark_set('gap', 'end-1c')
+        self.text.mark_gravity('gap', tk.LEFT)
+        if tail:
+            if self.loaded_end < self.gap_end:
+                self.text.insert(tk.END, self.gap_note(), ('note', 'gap'))
+            self.text.insert(tk.END, self.render_bytes(tail, tail_start, text_decoder(encoding) if encoding else None))
+        self.text.configure(state=tk.DISABLED)
+        self.text.see('1.0')
+    
+    def render_bytes(self, data, offset, decoder):
+        if decoder is None:
+            return hexdump(data, offset)
+        return decoder.decode(data)
+    
+    def gap_note(self):
+        gap = self.app.format_size(self.gap_end - self.loaded_end)
+        return f"\n--- {gap} not loaded yet; scroll here to load more ---\n"
+    
+    def on_scroll(self, first, last):
+        self.yscroll.set(first, last)
+        if not self.check_pending:
+            self.check_pending = True
+            self.text.after_idle(self.check_gap)
+    
+    def check_gap(self):
+        """Load the next window once the gap note is visible"""
+        self.check_pending = False
+        if self.loading or self.handle is None or self.loaded_end >= self.gap_end:
+            return
+        if not self.text.tag_ranges('gap') or self.text.bbox('gap.first') is None:
+            return
+        self.loading = True
+        length = min(self.window_size, self.gap_end - self.loaded_end)
+        self.submit(f"Preview s3://{self.handle.bucket}/{self.handle.key} at {self.loaded_end}",
+                    lambda task, handle, start: self.app.engine.read_object(handle, start, length, task.cancel_event),
+                    self.handle, self.loaded_end, on_success=self.append)
+    
+    def append(self, data):
+        self.loading = False
+        offset = self.loaded_end
+        self.loaded_end += len(data)
+        text = self.render_bytes(data, offset, self.decoder)
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete('gap.first', 'gap.last')
+        if self.loaded_end >= self.gap_end or not data:
+            self.loaded_end = self.gap_end
+            if self.decoder is not None:
+                text += self.decoder.decode(b'', final=True)
+        else:
+            # The mark has left gravity, so it stays in front of the new note
+            self.text.insert('gap', self.gap_note(), ('note', 'gap'))
+        self.text.mark_gravity('gap', tk.RIGHT)
+        self.text.insert('gap', text)
+        self.text.mark_gravity('gap', tk.LEFT)
+        self.text.configure(state=tk.DISABLED)
+        self.on_scroll(*self.text.yview())
+    
+    def show_image(self, data):
+        """Render image bytes (Pillow if installed, else Tk's own PNG/GIF/PPM support)"""
+        width = max(self.body.winfo_width(), 200)
+        height = max(self.body.winfo_height(), 200)
+        try:
+            try:
+                from PIL import Image, ImageTk
+            except ImportError:
+                if not self.handle.key.lower().endswith(TK_IMAGE_EXTENSIONS) and 'png' not in self.handle.content_type \
+                        and 'gif' not in self.handle.content_type:
+                    self.set_text("Install Pillow to preview this image type")
+                    return
+                photo = tk.PhotoImage(data=base64.b64encode(data))
+                factor = max(1, -(-photo.width() // width), -(-photo.height() // height))
+                photo = photo.subsample(factor) if factor > 1 else photo
+            else:
+                image = Image.open(io.BytesIO(data))
+                image.thumbnail((width, height))
+                photo = ImageTk.PhotoImage(image)
+        except Exception as e:
+            logger.warning(f"Cannot render {self.handle.key} as an image: {e}")
+            self.set_text(f"Cannot render this image: {e}")
+            return
+        self.photo = photo  # Tk does not keep its own reference
+        for widget in (self.text, self.yscroll, self.xscroll):
+            widget.pack_forget()
+        self.image_label.config(image=photo)
+        self.image_label.pack(fill=tk.BOTH, expand=True)
+    
+    def pack_text(self):
+        self.yscroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.xscroll.pack(side=tk.BOTTOM, fill=tk.X)
+        self.text.pack(fill=tk.BOTH, expand=True)
+    
+    def show_text_widget(self):
+        if self.photo is not None:
+            self.image_label.pack_forget()
+            self.image_label.config(image='')
+            self.photo = None
+            self.pack_text()
+    
+    def set_text(self, text):
+        self.show_text_widget()
+        self.encoding = None
+        self.loaded_end = self.gap_end = 0
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete('1.0', tk.END)
+        self.text.insert('1.0', text, 'note')
+        self.text.configure(state=tk.DISABLED)
+    
+    def on_error(self, e):
+        self.loading = False
+        if isinstance(e, ClientError):
+            error_code = e.response['Error']['Code']
+            error_message = e.response['Error']['Message']
+            logger.error(f"Preview failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
+            if error_code in ('PreconditionFailed', '412'):
+                message = "The object changed on S3; select it again to reload"
+            elif error_code in ('NoSuchKey', '404'):
+                message = "The object no longer exists"
+            elif error_code == 'AccessDenied':
+                message = f"Access denied. You need 's3:GetObject' permission.\n\nAWS Error: {error_message}"
+            else:
+                message = f"AWS Error ({error_code}): {error_message}"
+        else:
+            logger.error(f"Preview failed with unexpected error: {e}", exc_info=e)
+            message = f"Failed to preview: {e}"
+        self.handle = None
+        self.set_text(message)
 
 class S3ClientGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("AWS S3 Client")
-        self.root.geometry("800x600")
+        self.root.geometry("800x700")
         
+        self.engine = None
         self.s3_client = None
+        self.prefetcher = None
+        self.stats_window = None
+        self.transfers_window = None
+        # Queue jobs finish on worker threads; poll_transfers applies them on the main thread
+        self.finished_transfers = queue.Queue()
+        self.preview_after = None
         self.current_bucket = None
         self.current_prefix = None
+        self.listing_task = None
+        self.history_back = []
+        self.history_forward = []
+        
+        # Folder listings are reused until they expire or we change them
+        self.listing_cache = ListingCache(
+            ttl=float(os.getenv('S3_LISTING_CACHE_TTL', '300')),
+            max_rows=int(os.getenv('S3_LISTING_CACHE_MAX_ROWS', '200000')))
+        
+        # All S3 calls run on this pool; results come back through root.after
+        self.runner = TaskRunner(self.root, max_workers=int(os.getenv('S3_WORKER_THREADS', '4')))
+        self.runner.on_change = self.refresh_operations
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         self.setup_ui()
         self.connect_to_s3()
@@ -48,6 +594,15 @@ class S3ClientGUI:
         self.status_label.pack(side=tk.LEFT)
         
         ttk.Button(top_frame, text="Refresh", command=self.refresh_objects).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(top_frame, text="Stats", command=self.show_stats).pack(side=tk.RIGHT, padx=5)
+        self.transfers_button = ttk.Button(top_frame, text="Transfers", command=self.show_transfers)
+        self.transfers_button.pack(side=tk.RIGHT, padx=5)
+        self.preview_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(top_frame, text="Preview", variable=self.preview_var,
+                        command=self.toggle_preview).pack(side=tk.RIGHT, padx=5)
+        
+        self.cache_label = ttk.Label(top_frame, text="", foreground="gray")
+        self.cache_label.pack(side=tk.RIGHT, padx=10)
         
         # Bucket and path selection frame
         bucket_frame = ttk.Frame(self.root, padding="10")
@@ -68,13 +623,31 @@ class S3ClientGUI:
         help_text = "Examples: 'my-bucket' or 'my-bucket/documents' or 'my-bucket/images/2024/'"
         ttk.Label(help_frame, text=help_text, foreground="gray").pack(side=tk.LEFT)
         
+        # Search over the local metadata index
+        ttk.Button(help_frame, text="Index", command=self.build_index).pack(side=tk.RIGHT, padx=(5, 0))
+        ttk.Button(help_frame, text="Search", command=self.search_index).pack(side=tk.RIGHT, padx=5)
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(help_frame, textvariable=self.search_var, width=25)
+        search_entry.pack(side=tk.RIGHT)
+        search_entry.bind('<Return>', lambda e: self.search_index())
+        
         # Main container for objects
         main_frame = ttk.LabelFrame(self.root, text="Objects", padding="10")
         main_frame.grid(row=3, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=10)
         
+        # Objects on the left; the preview pane is added on the right when "Preview" is ticked
+        self.paned = ttk.PanedWindow(main_frame, orient=tk.HORIZONTAL)
+        self.paned.pack(fill=tk.BOTH, expand=True)
+        tree_frame = ttk.Frame(self.paned)
+        self.paned.add(tree_frame, weight=3)
+        self.preview = PreviewPane(
+            self.paned, self,
+            window_size=int(float(os.getenv('S3_PREVIEW_KB', '64')) * 1024),
+            image_limit=int(float(os.getenv('S3_PREVIEW_IMAGE_MB', '5')) * 1024 * 1024))
+        
         # Treeview for objects
         columns = ('Name', 'Size', 'Modified')
-        self.object_tree = ttk.Treeview(main_frame, columns=columns, show='tree headings')
+        self.object_tree = ttk.Treeview(tree_frame, columns=columns, show='tree headings')
         self.object_tree.heading('#0', text='Type')
         self.object_tree.heading('Name', text='Name')
         self.object_tree.heading('Size', text='Size')
@@ -85,23 +658,48 @@ class S3ClientGUI:
         self.object_tree.column('Size', width=100)
         self.object_tree.column('Modified', width=150)
         
-        scrollbar = ttk.Scrollbar(main_frame, orient=tk.VERTICAL, command=self.object_tree.yview)
-        self.object_tree.configure(yscrollcommand=scrollbar.set)
+        # The scrollbar drives the virtual view, not the Treeview itself
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL)
+        self.object_view = VirtualObjectView(self.object_tree, scrollbar, self.format_size)
         
         self.object_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         # Bind double-click for folder navigation
         self.object_tree.bind('<Double-1>', self.on_object_double_click)
+        self.object_tree.bind('<<TreeviewSelect>>', self.on_object_select, add='+')
         
         # Object operations frame
         obj_btn_frame = ttk.Frame(self.root, padding="10")
         obj_btn_frame.grid(row=4, column=0, sticky=(tk.W, tk.E))
         
-        ttk.Button(obj_btn_frame, text="Upload File", command=self.upload_file).pack(side=tk.LEFT, padx=5)
+        ttk.Button(obj_btn_frame, text="Upload Files", command=self.upload_file).pack(side=tk.LEFT, padx=5)
+        ttk.Button(obj_btn_frame, text="Upload Folder", command=self.upload_folder).pack(side=tk.LEFT, padx=5)
         ttk.Button(obj_btn_frame, text="Download File", command=self.download_file).pack(side=tk.LEFT, padx=5)
         ttk.Button(obj_btn_frame, text="Delete File", command=self.delete_file).pack(side=tk.LEFT, padx=5)
+        ttk.Button(obj_btn_frame, text="Copy/Move...", command=self.open_copy_dialog).pack(side=tk.LEFT, padx=5)
+        ttk.Button(obj_btn_frame, text="Rename...", command=self.rename_selection).pack(side=tk.LEFT, padx=5)
+        ttk.Button(obj_btn_frame, text="Sync...", command=self.open_sync_dialog).pack(side=tk.LEFT, padx=5)
+        ttk.Button(obj_btn_frame, text="Calculate Size", command=self.calculate_size).pack(side=tk.LEFT, padx=5)
         ttk.Button(obj_btn_frame, text="Go Up", command=self.go_up_folder).pack(side=tk.LEFT, padx=5)
+        ttk.Button(obj_btn_frame, text="Back", command=self.go_back).pack(side=tk.LEFT, padx=5)
+        ttk.Button(obj_btn_frame, text="Forward", command=self.go_forward).pack(side=tk.LEFT, padx=5)
+        
+        # Background operations
+        ops_frame = ttk.LabelFrame(self.root, text="Operations", padding="10")
+        ops_frame.grid(row=5, column=0, sticky=(tk.W, tk.E), padx=10, pady=(0, 10))
+        
+        self.ops_tree = ttk.Treeview(ops_frame, columns=('Status', 'Progress'), show='tree headings', height=3)
+        self.ops_tree.heading('#0', text='Operation')
+        self.ops_tree.heading('Status', text='Status')
+        self.ops_tree.heading('Progress', text='Progress')
+        self.ops_tree.column('#0', width=450)
+        self.ops_tree.column('Status', width=100)
+        self.ops_tree.column('Progress', width=150)
+        self.ops_tree.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.ops_by_iid = {}
+        
+        ttk.Button(ops_frame, text="Cancel", command=self.cancel_operation).pack(side=tk.RIGHT, padx=5)
         
         # Configure grid weights
         self.root.columnconfigure(0, weight=1)
@@ -109,9 +707,19 @@ class S3ClientGUI:
     
     def connect_to_s3(self):
         try:
-            logger.info("Initializing S3 client...")
-            self.s3_client = boto3.client('s3')
+            self.engine = S3Engine()
+            self.s3_client = self.engine.s3_client
             logger.info("S3 client initialized successfully")
+            # Warms the listing cache with the folders the user is likely to open next
+            self.prefetcher = ListingPrefetcher(
+                self.s3_client, self.listing_cache,
+                max_workers=int(os.getenv('S3_PREFETCH_THREADS', '2')),
+                max_folders=int(os.getenv('S3_PREFETCH_FOLDERS', '20')),
+                is_busy=self.is_busy)
+            # Continue the transfers left in the queue when the app was last closed
+            self.engine.on_transfer_finished = self.finished_transfers.put
+            self.engine.transfers.start()
+            self.root.after(500, self.poll_transfers)
             # Skip connection test - we'll validate when accessing specific bucket
             self.status_label.config(text="Status: Ready", foreground="green")
         except NoCredentialsError as e:
@@ -123,22 +731,15 @@ class S3ClientGUI:
             messagebox.showerror("Error", f"Failed to initialize S3 client: {str(e)}")
             self.status_label.config(text="Status: Initialization failed", foreground="red")
     
+    def is_busy(self):
+        """True while operations or queued transfers are running (safe from any thread)"""
+        return self.runner.is_busy() or (self.engine is not None and self.engine.transfers.is_busy())
+    
     def on_bucket_path_change(self, event):
         """Handle Enter key press in bucket/path entry"""
         self.load_bucket_path()
     
-    def parse_bucket_path(self, bucket_path):
-        """Parse bucket/path string into bucket and prefix"""
-        if not bucket_path:
-            return None, None
-        
-        parts = bucket_path.split('/', 1)
-        bucket = parts[0]
-        prefix = parts[1] if len(parts) > 1 else None
-        
-        return bucket, prefix
-    
-    def load_bucket_path(self):
+    def load_bucket_path(self, record_history=True):
         """Load the specified bucket and path"""
         bucket_path = self.bucket_path_var.get().strip()
         if not bucket_path:
@@ -150,13 +751,17 @@ class S3ClientGUI:
             return
         
         # Parse bucket and prefix
-        bucket, prefix = self.parse_bucket_path(bucket_path)
+        bucket, prefix = S3Engine.parse_bucket_path(bucket_path)
         if not bucket:
             messagebox.showerror("Error", "Invalid bucket/path format")
             return
         
         logger.info(f"Loading bucket: {bucket}, prefix: {prefix}")
         
+        if record_history and self.current_bucket and (bucket, prefix) != (self.current_bucket, self.current_prefix):
+            self.history_back.append((self.current_bucket, self.current_prefix))
+            self.history_forward.clear()
+        
         self.current_bucket = bucket
         self.current_prefix = prefix
         
@@ -174,101 +779,142 @@ class S3ClientGUI:
             self.current_prefix = None
             self.status_label.config(text="Status: Ready", foreground="orange")
     
-    def load_objects(self):
+    def cancel_listing(self):
+        """Stop the in-flight listing so it no longer touches the tree"""
+        if self.listing_task is not None:
+            self.listing_task.cancel()
+            self.listing_task = None
+    
+    def load_objects(self, use_cache=True):
         if not self.s3_client or not self.current_bucket:
             return
         
+        # Only the latest listing may update the tree; older ones are dropped
+        self.cancel_listing()
+        self.prefetcher.cancel()
+        
         logger.info(f"Loading objects from bucket: {self.current_bucket}, prefix: {self.current_prefix}")
-        self.object_tree.delete(*self.object_tree.get_children())
+        self.object_view.clear()
+        if self.preview_var.get():
+            self.preview.clear()
+        
+        bucket, prefix = self.current_bucket, self.current_prefix
+        if use_cache:
+            cached = self.listing_cache.get(bucket, prefix)
+            if cached is not None:
+                logger.info(f"Using cached listing of s3://{bucket}/{prefix or ''}")
+                self.append_listing_page(cached.as_page())
+                if cached.complete:
+                    self.on_listing_done(cached)
+                    return
+        else:
+            cached = None
+        
+        # A prefetched first page is shown straight away; the rest is listed from its token
+        self.listing_task = self.runner.submit(
+            f"List s3://{bucket}/{prefix or ''}", self.list_objects_worker, bucket, prefix, cached,
+            on_success=self.on_listing_done, on_error=self.on_listing_error)
+    
+    def list_objects_worker(self, task, bucket, prefix, resume_from=None):
+        """Paginate bucket/prefix on a worker thread, posting each page to the tree"""
+        result = ListingResult()
+        start_token = None
+        if resume_from is not None:
+            result.add_page(resume_from.as_page())
+            start_token = resume_from.next_token
         
         try:
-            # List objects with prefix if specified
-            kwargs = {'Bucket': self.current_bucket}
-            if self.current_prefix:
-                kwargs['Prefix'] = self.current_prefix
-                if not self.current_prefix.endswith('/'):
-                    kwargs['Prefix'] += '/'
-            
-            logger.info(f"Calling list_objects_v2 with kwargs: {kwargs}")
-            response = self.s3_client.list_objects_v2(**kwargs)
-            logger.info(f"list_objects_v2 response keys: {list(response.keys())}")
-            
-            if 'Contents' in response:
-                logger.info(f"Found {len(response['Contents'])} objects")
-                # Group objects by folders
-                folders = set()
-                files = []
-                
-                for obj in response['Contents']:
-                    key = obj['Key']
-                    logger.debug(f"Processing object: {key}")
-                    
-                    # Remove current prefix from display
-                    display_key = key
-                    if self.current_prefix:
-                        prefix_with_slash = self.current_prefix if self.current_prefix.endswith('/') else self.current_prefix + '/'
-                        if key.startswith(prefix_with_slash):
-                            display_key = key[len(prefix_with_slash):]
-                    
-                    # Check if this is a folder or file
-                    if '/' in display_key:
-                        folder_name = display_key.split('/')[0]
-                        folders.add(folder_name)
-                    else:
-                        if display_key:  # Don't show empty keys
-                            files.append((display_key, obj))
-                
-                # Add folders first
-                for folder in sorted(folders):
-                    self.object_tree.insert('', tk.END, text='📁', 
-                                          values=(folder + '/', '', ''))
-                
-                # Add files
-                for display_key, obj in files:
-                    size = self.format_size(obj['Size'])
-                    modified = obj['LastModified'].strftime('%Y-%m-%d %H:%M:%S')
-                    self.object_tree.insert('', tk.END, text='📄', 
-                                          values=(display_key, size, modified))
-                
-                logger.info(f"Displayed {len(folders)} folders and {len(files)} files")
-            else:
-                logger.info("No 'Contents' key in response - bucket/path is empty or no matches")
-                                          
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            error_message = e.response['Error']['Message']
-            logger.error(f"AWS ClientError - Code: {error_code}, Message: {error_message}")
-            logger.error(f"Full error response: {e.response}")
-            
-            if error_code == 'AccessDenied':
-                logger.error(f"Access denied for bucket '{self.current_bucket}' - check IAM permissions")
-                messagebox.showerror("Permission Error", 
-                    f"Access denied when listing objects in bucket '{self.current_bucket}'.\n\n"
-                    f"Required permissions for bucket '{self.current_bucket}':\n"
-                    f"- s3:ListBucket (to browse contents)\n"
-                    f"- s3:GetObject (for downloads)\n"
-                    f"- s3:PutObject (for uploads)\n"
-                    f"- s3:DeleteObject (for deletions)\n\n"
-                    f"AWS Error: {error_message}\n\n"
-                    f"You can still upload/download/delete files if you know the exact object keys.")
-            elif error_code == 'NoSuchBucket':
-                logger.error(f"Bucket '{self.current_bucket}' does not exist")
-                messagebox.showerror("Error", f"Bucket '{self.current_bucket}' does not exist or you don't have access to it.")
-            else:
-                logger.error(f"Unexpected AWS error: {error_code} - {error_message}")
-                messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
-        except Exception as e:
-            logger.error(f"Unexpected error loading objects: {e}", exc_info=True)
+            for page in self.engine.list_folder(bucket, prefix, task.cancel_event, start_token=start_token):
+                result.add_page(page)
+                task.post(self.append_listing_page, page)
+        except OFFLINE_ERRORS:
+            # S3 is unreachable: fall back to the metadata index if it covers this folder
+            listing, indexed_at = self.engine.browse_index(bucket, prefix)
+            if listing is None:
+                raise
+            logger.warning(f"S3 unreachable, showing s3://{bucket}/{prefix or ''} from the index")
+            task.post(self.show_offline_listing, bucket, prefix, listing, indexed_at)
+            return listing
+        
+        # Partial (cancelled) listings are never cached
+        if not task.cancelled:
+            self.listing_cache.put(bucket, prefix, result)
+        return result
+    
+    def on_listing_done(self, result):
+        self.listing_task = None
+        # Folder sizes calculated earlier are still valid unless something was written since
+        sizes = self.engine.cached_folder_usage(self.current_bucket, self.current_prefix,
+                                                self.object_view.listing.folders)
+        if sizes:
+            self.object_view.set_folder_sizes(sizes)
+        
+        self.object_view.finish()
+        logger.info(f"Displayed {self.object_view.folder_count} folders and {self.object_view.file_count} files")
+        self.update_cache_label()
+        
+        # Visible child folders are the likely next double-click
+        self.object_view.render()
+        folders = self.object_view.visible_folders()
+        if folders:
+            self.prefetcher.prefetch(self.current_bucket, self.current_prefix, folders)
+    
+    def update_cache_label(self):
+        stats = self.listing_cache.stats()
+        self.cache_label.config(text=f"Cache: {stats['hits']} hits / {stats['misses']} misses")
+    
+    def on_listing_error(self, e):
+        self.listing_task = None
+        if isinstance(e, ClientError):
+            self.show_listing_error(e)
+        else:
+            logger.error(f"Unexpected error loading objects: {e}", exc_info=e)
             messagebox.showerror("Error", f"Failed to load objects: {str(e)}")
     
+    def show_offline_listing(self, bucket, prefix, listing, indexed_at):
+        """Replace the view with a folder level read from the metadata index"""
+        self.object_view.clear()
+        self.object_view.append_page(listing.as_page())
+        indexed = time.strftime('%Y-%m-%d %H:%M', time.localtime(indexed_at))
+        self.status_label.config(text=f"Status: Offline - {bucket}/{prefix or ''} from index of {indexed}",
+                                 foreground="orange")
+    
+    def append_listing_page(self, page):
+        """Add one page of folders and files to the object view"""
+        self.object_view.append_page(page)
+    
+    def show_listing_error(self, e):
+        """Report a ClientError raised while listing the current bucket/path"""
+        error_code = e.response['Error']['Code']
+        error_message = e.response['Error']['Message']
+        logger.error(f"AWS ClientError - Code: {error_code}, Message: {error_message}")
+        logger.error(f"Full error response: {e.response}")
+        
+        if error_code == 'AccessDenied':
+            logger.error(f"Access denied for bucket '{self.current_bucket}' - check IAM permissions")
+            messagebox.showerror("Permission Error", 
+                f"Access denied when listing objects in bucket '{self.current_bucket}'.\n\n"
+                f"Required permissions for bucket '{self.current_bucket}':\n"
+                f"- s3:ListBucket (to browse contents)\n"
+                f"- s3:GetObject (for downloads)\n"
+                f"- s3:PutObject (for uploads)\n"
+                f"- s3:DeleteObject (for deletions)\n\n"
+                f"AWS Error: {error_message}\n\n"
+                f"You can still upload/download/delete files if you know the exact object keys.")
+        elif error_code == 'NoSuchBucket':
+            logger.error(f"Bucket '{self.current_bucket}' does not exist")
+            messagebox.showerror("Error", f"Bucket '{self.current_bucket}' does not exist or you don't have access to it.")
+        else:
+            logger.error(f"Unexpected AWS error: {error_code} - {error_message}")
+            messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
+    
     def on_object_double_click(self, event):
         """Handle double-click on folders to navigate into them"""
-        selection = self.object_tree.selection()
-        if not selection:
+        iid = self.object_tree.identify_row(event.y)
+        if not iid:
             return
         
-        item = self.object_tree.item(selection[0])
-        object_name = item['values'][0]
+        object_name = self.object_view.name_for(iid)
         
         # If it's a folder (ends with /), navigate into it
         if object_name.endswith('/'):
@@ -287,49 +933,159 @@ class S3ClientGUI:
             self.bucket_path_var.set(new_path)
             self.load_bucket_path()
     
+    def toggle_preview(self):
+        """Show or hide the preview pane next to the object list"""
+        if self.preview_var.get():
+            self.paned.add(self.preview.frame, weight=2)
+            self.preview_selection()
+        else:
+            self.preview.clear()
+            self.paned.forget(self.preview.frame)
+    
+    def on_object_select(self, event):
+        # Wait for the selection to settle (keyboard repeat, re-renders while scrolling)
+        if not self.preview_var.get():
+            return
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+        self.preview_after = self.root.after(250, self.preview_selection)
+    
+    def preview_selection(self):
+        """Preview the selected file, if exactly one file is selected"""
+        self.preview_after = None
+        if not self.engine:
+            self.preview.clear("Not connected to S3")
+            return
+        selection = self.object_view.selected_names()
+        if len(selection) != 1 or selection[0].endswith('/'):
+            self.preview.clear()
+            return
+        location = (self.current_bucket, normalize_prefix(self.current_prefix) + selection[0])
+        if location != self.preview.current:
+            self.preview.show(*location)
+    
     def format_size(self, size):
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size < 1024.0:
-                return f"{size:.2f} {unit}"
-            size /= 1024.0
-        return f"{size:.2f} PB"
+        return format_size(size)
     
     def upload_file(self):
         if not self.current_bucket:
             messagebox.showwarning("Warning", "Please load a bucket/path first")
             return
         
-        file_path = filedialog.askopenfilename()
-        if not file_path:
+        file_paths = filedialog.askopenfilenames()
+        if not file_paths:
             return
         
-        file_name = os.path.basename(file_path)
+        # Construct the S3 keys using current prefix
+        prefix = normalize_prefix(self.current_prefix)
+        keys = [prefix + os.path.basename(path) for path in file_paths]
         
-        # Construct the S3 key using current prefix
-        if self.current_prefix:
-            if not self.current_prefix.endswith('/'):
-                s3_key = self.current_prefix + '/' + file_name
-            else:
-                s3_key = self.current_prefix + file_name
+        # Ask user to confirm the upload path
+        if len(file_paths) == 1:
+            confirm_msg = f"Upload '{os.path.basename(file_paths[0])}' as:\ns3://{self.current_bucket}/{keys[0]}\n\nProceed?"
         else:
-            s3_key = file_name
+            name = f"Upload {len(file_paths)} files -> s3://{self.current_bucket}/{prefix}"
+            confirm_msg = f"Upload {len(file_paths)} files to:\ns3://{self.current_bucket}/{prefix}\n\nProceed?"
+        if not messagebox.askyesno("Confirm Upload", confirm_msg):
+            return
         
-        logger.info(f"Uploading file: {file_path} -> s3://{self.current_bucket}/{s3_key}")
+        if len(file_paths) == 1:
+            # A queued job survives a restart and can be paused, reordered and throttled
+            self.engine.transfers.add_upload(file_paths[0], self.current_bucket, keys[0])
+            self.show_transfers()
+            return
         
-        # Ask user to confirm the upload path
-        confirm_msg = f"Upload '{file_name}' as:\ns3://{self.current_bucket}/{s3_key}\n\nProceed?"
+        # Several files go up together as one parallel bulk upload, small ones batched
+        bucket = self.current_bucket
+        files = [(path, key, os.path.getsize(path)) for path, key in zip(file_paths, keys)]
+        
+        def invalidate():
+            for key in keys:
+                self.listing_cache.invalidate_key(bucket, key)
+        
+        self.start_upload(name, bucket, files, invalidate)
+    
+    def upload_folder(self):
+        """Upload a local directory tree under the current bucket/path"""
+        if not self.current_bucket:
+            messagebox.showwarning("Warning", "Please load a bucket/path first")
+            return
+        
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        
+        folder_name = os.path.basename(os.path.normpath(folder))
+        base = normalize_prefix(self.current_prefix) + folder_name + '/'
+        confirm_msg = f"Upload folder '{folder}' and everything in it to:\ns3://{self.current_bucket}/{base}\n\nProceed?"
         if not messagebox.askyesno("Confirm Upload", confirm_msg):
             return
         
+        bucket = self.current_bucket
+        # The walk is lazy: files are queued for upload as they are discovered
+        files = self.engine.iter_upload_items([folder], self.current_prefix)
+        self.start_upload(f"Upload {folder} -> s3://{bucket}/{base}", bucket, files,
+                          lambda: self.listing_cache.invalidate_tree(bucket, base))
+    
+    def start_upload(self, name, bucket, files, invalidate):
+        """Run a bulk upload in the background; invalidate() drops the cached listings it changes"""
+        prefix = self.current_prefix
+        logger.info(f"Starting: {name}")
+        self.runner.submit(
+            name, self.upload_worker, bucket, files, invalidate,
+            on_success=lambda progress: self.on_upload_done(bucket, prefix, progress),
+            on_error=self.on_upload_error)
+    
+    def upload_worker(self, task, bucket, files, invalidate):
+        progress = TransferProgress(on_update=lambda p: task.set_progress(self.format_progress(p)))
         try:
-            self.s3_client.upload_file(file_path, self.current_bucket, s3_key)
-            logger.info(f"Successfully uploaded: {s3_key}")
-            messagebox.showinfo("Success", f"File uploaded as 's3://{self.current_bucket}/{s3_key}'")
-            
-            # Refresh the current view
+            return self.engine.upload(files, bucket, progress, task.cancel_event)
+        finally:
+            # Even a failed or cancelled run may have written some keys
+            invalidate()
+    
+    def on_upload_done(self, bucket, prefix, progress):
+        logger.info(f"Uploaded {progress.files_done} files to s3://{bucket}")
+        self.show_transfer_summary("Upload", progress)
+        
+        # Refresh the view if the user is still looking at that folder
+        if (bucket, prefix) == (self.current_bucket, self.current_prefix):
             self.load_objects()
-            
-        except ClientError as e:
+    
+    def format_progress(self, progress, with_bytes=True):
+        """Return aggregate progress text for the operations panel"""
+        text = f"{progress.files_done}/{progress.files_total} files"
+        if with_bytes:
+            text += f", {self.format_size(progress.bytes_done)} @ {self.format_size(progress.throughput())}/s"
+        if progress.failures:
+            text += f", {len(progress.failures)} failed"
+        return text
+    
+    def show_transfer_summary(self, title, progress, with_bytes=True):
+        """One dialog for a whole bulk operation, listing the first few failures"""
+        if with_bytes:
+            message = (f"{title} finished: {progress.files_done} of {progress.files_total} files, "
+                       f"{self.format_size(progress.bytes_done)} in {progress.elapsed:.1f}s "
+                       f"({self.format_size(progress.throughput())}/s).")
+        else:
+            message = (f"{title} finished: {progress.files_done} of {progress.files_total} objects "
+                       f"in {progress.elapsed:.1f}s.")
+        if not progress.failures:
+            messagebox.showinfo("Success", message)
+            return
+        
+        lines = []
+        for name, error in progress.failures[:10]:
+            if isinstance(error, ClientError):
+                error = f"{error.response['Error']['Code']}: {error.response['Error']['Message']}"
+            lines.append(f"- {name}: {error}")
+        if len(progress.failures) > 10:
+            lines.append(f"... and {len(progress.failures) - 10} more")
+        messagebox.showwarning("Completed with errors",
+                               message + f"\n\n{len(progress.failures)} failed:\n" + "\n".join(lines))
+    
+    def on_upload_error(self, e):
+        if isinstance(e, ClientError):
             error_code = e.response['Error']['Code']
             error_message = e.response['Error']['Message']
             logger.error(f"Upload failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
@@ -339,24 +1095,23 @@ class S3ClientGUI:
                 messagebox.showerror("Permission Error", f"Access denied when uploading file. You need 's3:PutObject' permission.\n\nAWS Error: {error_message}")
             else:
                 messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
-        except Exception as e:
-            logger.error(f"Upload failed with unexpected error: {e}", exc_info=True)
+        else:
+            logger.error(f"Upload failed with unexpected error: {e}", exc_info=e)
             messagebox.showerror("Error", f"Failed to upload file: {str(e)}")
     
     def download_file(self):
-        selection = self.object_tree.selection()
+        selection = self.object_view.selected_names()
         if not selection:
             messagebox.showwarning("Warning", "Please select a file")
             return
         
-        item = self.object_tree.item(selection[0])
-        display_name = item['values'][0]
-        
-        # Skip folders
-        if display_name.endswith('/'):
-            messagebox.showwarning("Warning", "Cannot download folders. Please select a file.")
+        # Folders and multi-selections are downloaded into a directory
+        if len(selection) > 1 or selection[0].endswith('/'):
+            self.download_selection(selection)
             return
         
+        display_name = selection[0]
+        
         # Reconstruct full S3 key
         if self.current_prefix:
             if not self.current_prefix.endswith('/'):
@@ -366,18 +1121,36 @@ class S3ClientGUI:
         else:
             object_key = display_name
         
-        logger.info(f"Downloading file: s3://{self.current_bucket}/{object_key}")
-        
         save_path = filedialog.asksaveasfilename(initialfile=display_name)
         if not save_path:
             return
         
-        try:
-            self.s3_client.download_file(self.current_bucket, object_key, save_path)
-            logger.info(f"Successfully downloaded to: {save_path}")
-            messagebox.showinfo("Success", f"File downloaded to '{save_path}'")
-            
-        except ClientError as e:
+        logger.info(f"Queueing download: s3://{self.current_bucket}/{object_key}")
+        self.engine.transfers.add_download(self.current_bucket, object_key, save_path)
+        self.show_transfers()
+    
+    def download_selection(self, names):
+        """Download selected files and folders (recursively) into a local directory"""
+        directory = filedialog.askdirectory(title="Download to folder")
+        if not directory:
+            return
+        
+        bucket, prefix = self.current_bucket, normalize_prefix(self.current_prefix)
+        label = names[0] if len(names) == 1 else f"{len(names)} items"
+        logger.info(f"Downloading {label} from s3://{bucket}/{prefix} to {directory}")
+        self.runner.submit(
+            f"Download {label} from s3://{bucket}/{prefix} -> {directory}",
+            self.download_selection_worker, bucket, prefix, names, directory,
+            on_success=lambda progress: self.show_transfer_summary("Download", progress),
+            on_error=lambda e: self.on_download_error(e, bucket, prefix))
+    
+    def download_selection_worker(self, task, bucket, prefix, names, directory):
+        progress = TransferProgress(on_update=lambda p: task.set_progress(self.format_progress(p)))
+        objects = self.engine.iter_download_items(bucket, prefix, names, directory, task.cancel_event)
+        return self.engine.download(objects, bucket, directory, progress, task.cancel_event)
+    
+    def on_download_error(self, e, bucket, object_key):
+        if isinstance(e, ClientError):
             error_code = e.response['Error']['Code']
             error_message = e.response['Error']['Message']
             logger.error(f"Download failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
@@ -385,28 +1158,27 @@ class S3ClientGUI:
             
             if error_code == 'AccessDenied':
                 messagebox.showerror("Permission Error", f"Access denied when downloading file. You need 's3:GetObject' permission.\n\nAWS Error: {error_message}")
-            elif error_code == 'NoSuchKey':
-                messagebox.showerror("Error", f"File '{object_key}' not found in bucket '{self.current_bucket}'.")
+            elif error_code in ('NoSuchKey', '404'):
+                messagebox.showerror("Error", f"File '{object_key}' not found in bucket '{bucket}'.")
             else:
                 messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
-        except Exception as e:
-            logger.error(f"Download failed with unexpected error: {e}", exc_info=True)
+        else:
+            logger.error(f"Download failed with unexpected error: {e}", exc_info=e)
             messagebox.showerror("Error", f"Failed to download file: {str(e)}")
     
     def delete_file(self):
-        selection = self.object_tree.selection()
+        selection = self.object_view.selected_names()
         if not selection:
             messagebox.showwarning("Warning", "Please select a file")
             return
         
-        item = self.object_tree.item(selection[0])
-        display_name = item['values'][0]
-        
-        # Skip folders
-        if display_name.endswith('/'):
-            messagebox.showwarning("Warning", "Cannot delete folders directly. Delete all files in the folder first.")
+        # Folders and multi-selections go through batched DeleteObjects
+        if len(selection) > 1 or selection[0].endswith('/'):
+            self.delete_selection(selection)
             return
         
+        display_name = selection[0]
+        
         # Reconstruct full S3 key
         if self.current_prefix:
             if not self.current_prefix.endswith('/'):
@@ -416,30 +1188,706 @@ class S3ClientGUI:
         else:
             object_key = display_name
         
-        logger.info(f"Deleting file: s3://{self.current_bucket}/{object_key}")
+        if not messagebox.askyesno("Confirm", f"Delete file 's3://{self.current_bucket}/{object_key}'?"):
+            return
         
-        if messagebox.askyesno("Confirm", f"Delete file 's3://{self.current_bucket}/{object_key}'?"):
-            try:
-                self.s3_client.delete_object(Bucket=self.current_bucket, Key=object_key)
-                logger.info(f"Successfully deleted: {object_key}")
-                messagebox.showinfo("Success", f"File 's3://{self.current_bucket}/{object_key}' deleted")
-                
-                # Refresh the current view
-                self.load_objects()
-                
-            except ClientError as e:
-                error_code = e.response['Error']['Code']
-                error_message = e.response['Error']['Message']
-                logger.error(f"Delete failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
-                logger.error(f"Full error response: {e.response}")
-                
-                if error_code == 'AccessDenied':
-                    messagebox.showerror("Permission Error", f"Access denied when deleting file. You need 's3:DeleteObject' permission.\n\nAWS Error: {error_message}")
+        bucket, prefix = self.current_bucket, self.current_prefix
+        logger.info(f"Deleting file: s3://{bucket}/{object_key}")
+        self.runner.submit(
+            f"Delete s3://{bucket}/{object_key}", self.delete_worker, bucket, object_key,
+            on_success=lambda result: self.on_delete_done(bucket, prefix, object_key),
+            on_error=self.on_delete_error)
+    
+    def delete_worker(self, task, bucket, object_key):
+        self.engine.delete_object(bucket, object_key)
+    
+    def on_delete_done(self, bucket, prefix, object_key):
+        logger.info(f"Successfully deleted: {object_key}")
+        self.listing_cache.invalidate_key(bucket, object_key, removed=True)
+        messagebox.showinfo("Success", f"File 's3://{bucket}/{object_key}' deleted")
+        
+        # Refresh the view if the user is still looking at that folder
+        if (bucket, prefix) == (self.current_bucket, self.current_prefix):
+            self.load_objects()
+    
+    def delete_selection(self, names):
+        """Delete selected files and everything under selected folders"""
+        bucket, prefix = self.current_bucket, normalize_prefix(self.current_prefix)
+        folders = [name for name in names if name.endswith('/')]
+        confirm_msg = f"Delete {len(names)} selected item(s) from s3://{bucket}/{prefix}?"
+        if folders:
+            confirm_msg += f"\n\nThis includes {len(folders)} folder(s) and every object under them."
+        if not messagebox.askyesno("Confirm", confirm_msg):
+            return
+        
+        label = names[0] if len(names) == 1 else f"{len(names)} items"
+        logger.info(f"Deleting {label} from s3://{bucket}/{prefix}")
+        current_prefix = self.current_prefix
+        self.runner.submit(
+            f"Delete {label} from s3://{bucket}/{prefix}", self.delete_selection_worker, bucket, prefix, names,
+            on_success=lambda progress: self.on_delete_selection_done(bucket, current_prefix, progress),
+            on_error=self.on_delete_error)
+    
+    def delete_selection_worker(self, task, bucket, prefix, names):
+        progress = TransferProgress(on_update=lambda p: task.set_progress(self.format_progress(p, with_bytes=False)))
+        keys = self.engine.iter_delete_keys(bucket, prefix, names, task.cancel_event)
+        try:
+            return self.engine.delete(keys, bucket, progress, task.cancel_event)
+        finally:
+            for name in names:
+                if name.endswith('/'):
+                    self.listing_cache.invalidate_tree(bucket, prefix + name)
+                else:
+                    self.listing_cache.invalidate_key(bucket, prefix + name, removed=True)
+    
+    def on_delete_selection_done(self, bucket, prefix, progress):
+        self.show_transfer_summary("Delete", progress, with_bytes=False)
+        
+        # Refresh the view if the user is still looking at that folder
+        if (bucket, prefix) == (self.current_bucket, self.current_prefix):
+            self.load_objects()
+    
+    def on_delete_error(self, e):
+        if isinstance(e, ClientError):
+            error_code = e.response['Error']['Code']
+            error_message = e.response['Error']['Message']
+            logger.error(f"Delete failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
+            logger.error(f"Full error response: {e.response}")
+            
+            if error_code == 'AccessDenied':
+                messagebox.showerror("Permission Error", f"Access denied when deleting file. You need 's3:DeleteObject' permission.\n\nAWS Error: {error_message}")
+            else:
+                messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
+        else:
+            logger.error(f"Delete failed with unexpected error: {e}", exc_info=e)
+            messagebox.showerror("Error", f"Failed to delete file: {str(e)}")
+    
+    def open_copy_dialog(self):
+        """Ask where to copy or move the selected files and folders, then do it inside S3"""
+        names = self.object_view.selected_names()
+        if not names:
+            messagebox.showwarning("Warning", "Please select files or folders")
+            return
+        
+        bucket, prefix = self.current_bucket, normalize_prefix(self.current_prefix)
+        label = names[0] if len(names) == 1 else f"{len(names)} items"
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Copy/Move")
+        dialog.transient(self.root)
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(frame, text=f"Copy or move {label} from s3://{bucket}/{prefix}").grid(
+            row=0, column=0, columnspan=2, sticky=tk.W)
+        ttk.Label(frame, text="To bucket/path:").grid(row=1, column=0, sticky=tk.W, pady=5)
+        dest_var = tk.StringVar(value=f"{bucket}/{prefix}")
+        ttk.Entry(frame, textvariable=dest_var, width=50).grid(row=1, column=1, padx=5)
+        
+        move_var = tk.BooleanVar(value=False)
+        ttk.Radiobutton(frame, text="Copy", variable=move_var, value=False).grid(
+            row=2, column=0, columnspan=2, sticky=tk.W)
+        ttk.Radiobutton(frame, text="Move (delete the originals once copied)", variable=move_var,
+                        value=True).grid(row=3, column=0, columnspan=2, sticky=tk.W)
+        
+        def start():
+            dest_bucket, dest_prefix = S3Engine.parse_s3_url(dest_var.get().strip())
+            if not dest_bucket:
+                messagebox.showwarning("Warning", "Please enter a destination bucket/path", parent=dialog)
+                return
+            if self.start_copy(move_var.get(), bucket, prefix, names, dest_bucket, normalize_prefix(dest_prefix)):
+                dialog.destroy()
+        
+        ttk.Button(frame, text="Start", command=start).grid(row=4, column=1, sticky=tk.E, pady=(10, 0))
+    
+    def rename_selection(self):
+        """Rename the selected file or folder (a server-side copy and delete)"""
+        names = self.object_view.selected_names()
+        if len(names) != 1:
+            messagebox.showwarning("Warning", "Please select one file or folder")
+            return
+        
+        name = names[0]
+        is_folder = name.endswith('/')
+        new_name = simpledialog.askstring("Rename", "New name:", initialvalue=name.rstrip('/'), parent=self.root)
+        if not new_name or new_name.strip('/') == name.rstrip('/'):
+            return
+        new_name = new_name.strip('/') + ('/' if is_folder else '')
+        prefix = normalize_prefix(self.current_prefix)
+        if is_folder and not messagebox.askyesno(
+                "Confirm Rename", f"Rename folder s3://{self.current_bucket}/{prefix}{name} to {new_name}?\n\n"
+                                  "Every object under it is copied to the new name and then deleted."):
+            return
+        self.start_copy(True, self.current_bucket, prefix, names, self.current_bucket, prefix, new_name)
+    
+    def start_copy(self, move, bucket, prefix, names, dest_bucket, dest_prefix, new_name=None):
+        """Copy or move names from prefix into dest_prefix in the background; False if refused"""
+        try:
+            S3Engine.check_copy(bucket, prefix, names, dest_bucket, dest_prefix, new_name)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return False
+        
+        verb = "Move" if move else "Copy"
+        label = names[0] if len(names) == 1 else f"{len(names)} items"
+        target = f"s3://{dest_bucket}/{dest_prefix}{new_name or ''}"
+        logger.info(f"{verb} {label} from s3://{bucket}/{prefix} to {target}")
+        current_prefix = self.current_prefix
+        self.runner.submit(
+            f"{verb} {label} from s3://{bucket}/{prefix} -> {target}",
+            self.copy_worker, move, bucket, prefix, names, dest_bucket, dest_prefix, new_name,
+            on_success=lambda progress: self.on_copy_done(verb, bucket, current_prefix, progress),
+            on_error=self.on_copy_error)
+        return True
+    
+    def copy_worker(self, task, move, bucket, prefix, names, dest_bucket, dest_prefix, new_name):
+        progress = TransferProgress(on_update=lambda p: task.set_progress(self.format_progress(p)))
+        items = self.engine.iter_copy_items(bucket, prefix, names, dest_bucket, dest_prefix, new_name,
+                                            task.cancel_event)
+        try:
+            if move:
+                return self.engine.move(items, bucket, dest_bucket, progress, task.cancel_event)
+            return self.engine.copy(items, bucket, dest_bucket, progress, task.cancel_event)
+        finally:
+            # Even a failed or cancelled run may have written (and for a move, deleted) some keys
+            for name in names:
+                target = dest_prefix + (new_name or name)
+                if name.endswith('/'):
+                    self.listing_cache.invalidate_tree(dest_bucket, target)
+                    if move:
+                        self.listing_cache.invalidate_tree(bucket, prefix + name)
                 else:
-                    messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
-            except Exception as e:
-                logger.error(f"Delete failed with unexpected error: {e}", exc_info=True)
-                messagebox.showerror("Error", f"Failed to delete file: {str(e)}")
+                    self.listing_cache.invalidate_key(dest_bucket, target)
+                    if move:
+                        self.listing_cache.invalidate_key(bucket, prefix + name, removed=True)
+    
+    def on_copy_done(self, verb, bucket, prefix, progress):
+        self.show_transfer_summary(verb, progress)
+        
+        # Copies may land in the folder in view and moves always change it
+        if bucket == self.current_bucket and prefix == self.current_prefix:
+            self.load_objects()
+    
+    def on_copy_error(self, e):
+        if isinstance(e, ClientError):
+            error_code = e.response['Error']['Code']
+            error_message = e.response['Error']['Message']
+            logger.error(f"Copy failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
+            
+            if error_code == 'AccessDenied':
+                messagebox.showerror("Permission Error", f"Access denied when copying. You need 's3:GetObject' on the source and 's3:PutObject' on the destination ('s3:DeleteObject' too for moves).\n\nAWS Error: {error_message}")
+            else:
+                messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
+        else:
+            logger.error(f"Copy failed with unexpected error: {e}", exc_info=e)
+            messagebox.showerror("Error", f"Copy failed: {str(e)}")
+    
+    def open_sync_dialog(self):
+        """Ask for a local folder and sync options, then sync it with the current bucket/path"""
+        if not self.current_bucket:
+            messagebox.showwarning("Warning", "Please load a bucket/path first")
+            return
+        
+        bucket, prefix = self.current_bucket, normalize_prefix(self.current_prefix)
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Sync")
+        dialog.transient(self.root)
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(frame, text=f"Remote: s3://{bucket}/{prefix}").grid(row=0, column=0, columnspan=3, sticky=tk.W)
+        ttk.Label(frame, text="Local folder:").grid(row=1, column=0, sticky=tk.W, pady=5)
+        local_var = tk.StringVar()
+        ttk.Entry(frame, textvariable=local_var, width=50).grid(row=1, column=1, padx=5)
+        ttk.Button(frame, text="Browse...",
+                   command=lambda: local_var.set(filedialog.askdirectory(parent=dialog) or local_var.get())
+                   ).grid(row=1, column=2)
+        
+        direction_var = tk.StringVar(value=UPLOAD)
+        ttk.Radiobutton(frame, text="Upload (local -> S3)", variable=direction_var,
+                        value=UPLOAD).grid(row=2, column=0, columnspan=3, sticky=tk.W)
+        ttk.Radiobutton(frame, text="Download (S3 -> local)", variable=direction_var,
+                        value=DOWNLOAD).grid(row=3, column=0, columnspan=3, sticky=tk.W)
+        delete_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="Delete files that only exist on the destination",
+                        variable=delete_var).grid(row=4, column=0, columnspan=3, sticky=tk.W)
+        dry_run_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(frame, text="Dry run (only show the plan)",
+                        variable=dry_run_var).grid(row=5, column=0, columnspan=3, sticky=tk.W)
+        
+        def start():
+            local_root = local_var.get().strip()
+            if not local_root:
+                messagebox.showwarning("Warning", "Please choose a local folder", parent=dialog)
+                return
+            dialog.destroy()
+            self.start_sync(direction_var.get(), local_root, bucket, prefix, delete_var.get(), dry_run_var.get())
+        
+        ttk.Button(frame, text="Sync", command=start).grid(row=6, column=2, pady=(10, 0))
+    
+    def start_sync(self, direction, local_root, bucket, prefix, delete, dry_run):
+        name = f"Sync {local_root} {'->' if direction == UPLOAD else '<-'} s3://{bucket}/{prefix}"
+        if dry_run:
+            name += " (dry run)"
+        logger.info(f"Starting: {name}")
+        current_prefix = self.current_prefix
+        self.runner.submit(
+            name, self.sync_worker, direction, local_root, bucket, prefix, delete, dry_run,
+            on_success=lambda result: self.on_sync_done(bucket, current_prefix, *result),
+            on_error=self.on_sync_error)
+    
+    def sync_worker(self, task, direction, local_root, bucket, prefix, delete, dry_run):
+        task.set_progress("Comparing...")
+        plan = self.engine.sync_plan(direction, local_root, bucket, prefix, delete, task.cancel_event)
+        for line in plan.describe():
+            logger.info(line)
+        if dry_run:
+            return plan, None
+        
+        progress = TransferProgress(on_update=lambda p: task.set_progress(self.format_progress(p)))
+        try:
+            self.engine.sync_execute(plan, progress, task.cancel_event)
+        finally:
+            if direction == UPLOAD:
+                self.listing_cache.invalidate_tree(bucket, prefix)
+        return plan, progress
+    
+    def on_sync_done(self, bucket, prefix, plan, progress):
+        if progress is None:
+            # Dry run: show what would happen
+            summary = (f"{len(plan.transfers)} file(s) to {plan.direction} ({self.format_size(plan.transfer_bytes)}), "
+                       f"{len(plan.deletes)} to delete, {plan.unchanged} unchanged.")
+            self.show_text_window("Sync plan (dry run)", summary + "\n\n" + "\n".join(plan.describe(limit=5000)))
+            return
+        
+        if not plan.transfers and not plan.deletes:
+            messagebox.showinfo("Success", f"Already in sync ({plan.unchanged} files unchanged).")
+        else:
+            self.show_transfer_summary("Sync", progress)
+        if plan.direction == UPLOAD and (bucket, prefix) == (self.current_bucket, self.current_prefix):
+            self.load_objects()
+    
+    def on_sync_error(self, e):
+        if isinstance(e, ClientError):
+            error_code = e.response['Error']['Code']
+            error_message = e.response['Error']['Message']
+            logger.error(f"Sync failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
+            messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
+        else:
+            logger.error(f"Sync failed with unexpected error: {e}", exc_info=e)
+            messagebox.showerror("Error", f"Sync failed: {str(e)}")
+    
+    def calculate_size(self):
+        """Total up the selected folders, or every folder in view if none is selected"""
+        if not self.current_bucket:
+            messagebox.showwarning("Warning", "Please load a bucket/path first")
+            return
+        
+        folders = [name for name in self.object_view.selected_names() if name.endswith('/')]
+        if not folders:
+            folders = list(self.object_view.listing.folders)
+        if not folders:
+            messagebox.showinfo("Calculate Size", "There are no folders here to size")
+            return
+        
+        bucket, prefix = self.current_bucket, self.current_prefix
+        label = folders[0] if len(folders) == 1 else f"{len(folders)} folders"
+        self.runner.submit(
+            f"Size of {label} in s3://{bucket}/{normalize_prefix(prefix)}", self.size_worker, bucket, prefix, folders,
+            on_success=lambda result: self.on_size_done(bucket, prefix, *result),
+            on_error=self.on_size_error)
+    
+    def size_worker(self, task, bucket, prefix, folders):
+        def on_update(total, sizes):
+            task.set_progress(f"{total.count} objects, {self.format_size(total.bytes)}")
+            task.post(self.show_folder_sizes, bucket, prefix, sizes)
+        return self.engine.du(bucket, prefix, folders, task.cancel_event, on_update)
+    
+    def show_folder_sizes(self, bucket, prefix, sizes):
+        # Totals only apply to the folder they were calculated for
+        if (bucket, prefix) == (self.current_bucket, self.current_prefix):
+            self.object_view.set_folder_sizes(sizes)
+    
+    def on_size_done(self, bucket, prefix, total, sizes):
+        logger.info(f"Sized {len(sizes)} folders in s3://{bucket}/{prefix or ''}: "
+                    f"{total.count} objects, {total.bytes} bytes")
+        if (bucket, prefix) == (self.current_bucket, self.current_prefix):
+            self.object_view.set_folder_sizes(sizes)
+            if self.object_view.sort_column != 'Name':
+                self.object_view.apply_sort()
+        self.status_label.config(
+            text=f"Status: {len(sizes)} folder(s) hold {total.count} objects, {self.format_size(total.bytes)}",
+            foreground="green")
+    
+    def on_size_error(self, e):
+        if isinstance(e, ClientError):
+            error_code = e.response['Error']['Code']
+            error_message = e.response['Error']['Message']
+            logger.error(f"Size calculation failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
+            messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
+        else:
+            logger.error(f"Size calculation failed with unexpected error: {e}", exc_info=e)
+            messagebox.showerror("Error", f"Failed to calculate size: {str(e)}")
+    
+    def build_index(self):
+        """Index everything under the current bucket/path for search and offline browsing"""
+        if not self.current_bucket:
+            messagebox.showwarning("Warning", "Please load a bucket/path first")
+            return
+        if self.engine.index is None:
+            messagebox.showerror("Error", "The metadata index is disabled (S3_INDEX_PATH is empty)")
+            return
+        
+        bucket, prefix = self.current_bucket, normalize_prefix(self.current_prefix)
+        self.runner.submit(
+            f"Index s3://{bucket}/{prefix}", self.index_worker, bucket, prefix,
+            on_success=lambda count: self.on_index_done(bucket, prefix, count),
+            on_error=self.on_index_error)
+    
+    def index_worker(self, task, bucket, prefix):
+        return self.engine.build_index(bucket, prefix, task.cancel_event,
+                                       on_progress=lambda count: task.set_progress(f"{count} keys"))
+    
+    def on_index_done(self, bucket, prefix, count):
+        self.status_label.config(text=f"Status: Indexed {count} keys of {bucket}/{prefix}", foreground="green")
+    
+    def on_index_error(self, e):
+        if isinstance(e, ClientError):
+            error_code = e.response['Error']['Code']
+            error_message = e.response['Error']['Message']
+            logger.error(f"Indexing failed - AWS ClientError - Code: {error_code}, Message: {error_message}")
+            messagebox.showerror("Error", f"AWS Error ({error_code}): {error_message}")
+        else:
+            logger.error(f"Indexing failed with unexpected error: {e}", exc_info=e)
+            messagebox.showerror("Error", f"Indexing failed: {str(e)}")
+    
+    def search_index(self):
+        """Search the metadata index under the current bucket/path with the query in the search box"""
+        query = self.search_var.get().strip()
+        if not self.current_bucket or not query:
+            return
+        if self.engine.index is None:
+            messagebox.showerror("Error", "The metadata index is disabled (S3_INDEX_PATH is empty)")
+            return
+        
+        bucket, prefix = self.current_bucket, normalize_prefix(self.current_prefix)
+        if self.engine.index.covers(bucket, prefix) is None:
+            if messagebox.askyesno("Search", f"s3://{bucket}/{prefix} has not been indexed yet.\n\nIndex it now?"):
+                self.runner.submit(
+                    f"Index s3://{bucket}/{prefix}", self.index_worker, bucket, prefix,
+                    on_success=lambda count: self.on_index_done(bucket, prefix, count),
+                    on_error=self.on_index_error)
+            return
+        
+        self.runner.submit(
+            f"Search s3://{bucket}/{prefix} for {query}", self.search_worker, bucket, prefix, query,
+            on_success=lambda rows: self.show_search_results(bucket, prefix, query, rows),
+            on_error=self.on_search_error)
+    
+    def search_worker(self, task, bucket, prefix, query):
+        # Folders our own operations could not update exactly are re-listed first
+        if self.engine.index.stale_prefixes(bucket):
+            task.set_progress("Updating index...")
+            self.engine.refresh_index(bucket, task.cancel_event)
+        return self.engine.search_index(bucket, query, prefix)
+    
+    def on_search_error(self, e):
+        if isinstance(e, ValueError):
+            messagebox.showerror("Search", str(e))
+        else:
+            self.on_index_error(e)
+    
+    def show_search_results(self, bucket, prefix, query, rows):
+        """List search results in a window; double-click one to open its folder"""
+        window = tk.Toplevel(self.root)
+        window.title(f"Search: {query}")
+        window.geometry("700x400")
+        
+        more = " (showing the first 1000)" if len(rows) >= 1000 else ""
+        summary = f"{len(rows)} object(s) in s3://{bucket}/{prefix} match '{query}'{more}"
+        ttk.Label(window, text=summary).pack(anchor=tk.W, padx=10, pady=5)
+        
+        tree = ttk.Treeview(window, columns=('Size', 'Modified'), show='tree headings')
+        tree.heading('#0', text='Key')
+        tree.heading('Size', text='Size')
+        tree.heading('Modified', text='Last Modified')
+        tree.column('#0', width=400)
+        tree.column('Size', width=100)
+        tree.column('Modified', width=150)
+        scrollbar = ttk.Scrollbar(window, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.pack(fill=tk.BOTH, expand=True)
+        
+        for key, size, mtime in rows:
+            modified = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(mtime))
+            tree.insert('', tk.END, text=key, values=(self.format_size(size), modified))
+        
+        def open_folder(event):
+            iid = tree.identify_row(event.y)
+            if iid:
+                folder = tree.item(iid, 'text').rpartition('/')[0]
+                self.bucket_path_var.set(f"{bucket}/{folder}/" if folder else bucket)
+                self.load_bucket_path()
+        tree.bind('<Double-1>', open_folder)
+    
+    def show_text_window(self, title, text):
+        """Show read-only text in a scrollable window"""
+        window = tk.Toplevel(self.root)
+        window.title(title)
+        window.geometry("700x400")
+        text_widget = tk.Text(window, wrap=tk.NONE)
+        scrollbar = ttk.Scrollbar(window, orient=tk.VERTICAL, command=text_widget.yview)
+        text_widget.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        text_widget.pack(fill=tk.BOTH, expand=True)
+        text_widget.insert('1.0', text)
+        text_widget.configure(state=tk.DISABLED)
+    
+    def show_stats(self):
+        """Show S3 call and transfer metrics in a window that refreshes every second"""
+        if not self.engine:
+            messagebox.showerror("Error", "Not connected to S3")
+            return
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+        metrics = self.engine.metrics
+        window = tk.Toplevel(self.root)
+        window.title("S3 Stats")
+        window.geometry("760x460")
+        self.stats_window = window
+        
+        summary_label = ttk.Label(window, text="")
+        summary_label.pack(anchor=tk.W, padx=10, pady=5)
+        
+        op_columns = ('Calls', 'Errors', 'Retries', 'Throttled', 'p50', 'p99', 'Avg')
+        op_tree = ttk.Treeview(window, columns=op_columns, show='tree headings', height=8)
+        op_tree.heading('#0', text='Operation')
+        op_tree.column('#0', width=200)
+        for column in op_columns:
+            op_tree.heading(column, text=column)
+            op_tree.column(column, width=75, anchor=tk.E)
+        op_tree.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        transfer_columns = ('Runs', 'Files', 'Bytes', 'Throughput', 'Failed')
+        transfer_tree = ttk.Treeview(window, columns=transfer_columns, show='tree headings', height=4)
+        transfer_tree.heading('#0', text='Transfers')
+        transfer_tree.column('#0', width=200)
+        for column in transfer_columns:
+            transfer_tree.heading(column, text=column)
+            transfer_tree.column(column, width=100, anchor=tk.E)
+        transfer_tree.pack(fill=tk.X, padx=10, pady=5)
+        
+        def export(fmt):
+            path = filedialog.asksaveasfilename(
+                parent=window, title="Export Metrics",
+                defaultextension='.json' if fmt == 'json' else '.prom',
+                filetypes=[("JSON", "*.json")] if fmt == 'json' else [("Prometheus text", "*.prom *.txt")])
+            if not path:
+                return
+            try:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(metrics.to_json() if fmt == 'json' else metrics.to_prometheus())
+            except OSError as e:
+                messagebox.showerror("Export Metrics", str(e), parent=window)
+        
+        def millis(seconds):
+            if seconds is None:
+                return "-"
+            return f"<{seconds * 1000:.0f} ms" if seconds != float('inf') else ">60 s"
+        
+        def refresh():
+            if not window.winfo_exists():
+                return
+            data = metrics.snapshot()
+            operations = data['operations']
+            calls = sum(op['calls'] for op in operations.values())
+            errors = sum(sum(op['errors'].values()) for op in operations.values())
+            summary_label.config(text=f"{calls} API calls, {errors} errors in {data['uptime_seconds']:.0f}s "
+                                      f"(latencies are histogram bucket bounds)")
+            op_tree.delete(*op_tree.get_children())
+            for name, op in operations.items():
+                latency = op['latency_seconds']
+                average = f"{latency['sum'] / op['calls'] * 1000:.1f} ms" if op['calls'] else "-"
+                op_tree.insert('', tk.END, text=name, values=(
+                    op['calls'], sum(op['errors'].values()), op['retries'], op['throttles'],
+                    millis(latency['p50']), millis(latency['p99']), average))
+            transfer_tree.delete(*transfer_tree.get_children())
+            for kind, transfer in data['transfers'].items():
+                transfer_tree.insert('', tk.END, text=kind, values=(
+                    transfer['runs'], transfer['files'], self.format_size(transfer['bytes']),
+                    f"{self.format_size(transfer['bytes_per_second'])}/s", transfer['failures']))
+            window.after(1000, refresh)
+        
+        button_frame = ttk.Frame(window, padding=(10, 0, 10, 10))
+        button_frame.pack(fill=tk.X)
+        ttk.Button(button_frame, text="Export JSON...", command=lambda: export('json')).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Export Prometheus...",
+                   command=lambda: export('prometheus')).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Reset", command=metrics.reset).pack(side=tk.RIGHT)
+        refresh()
+    
+    def show_transfers(self):
+        """Show the transfer queue in a window that refreshes twice a second"""
+        if not self.engine:
+            messagebox.showerror("Error", "Not connected to S3")
+            return
+        if self.transfers_window is not None and self.transfers_window.winfo_exists():
+            self.transfers_window.lift()
+            return
+        manager = self.engine.transfers
+        window = tk.Toplevel(self.root)
+        window.title("Transfers")
+        window.geometry("900x420")
+        self.transfers_window = window
+        
+        summary_label = ttk.Label(window, text="")
+        summary_label.pack(anchor=tk.W, padx=10, pady=5)
+        
+        columns = ('Status', 'Priority', 'Progress', 'Rate')
+        tree = ttk.Treeview(window, columns=columns, show='tree headings', height=10)
+        tree.heading('#0', text='Transfer')
+        tree.column('#0', width=420)
+        for column, width in zip(columns, (80, 70, 200, 90)):
+            tree.heading(column, text=column)
+            tree.column(column, width=width)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        priorities = {'High': 1, 'Normal': 0, 'Low': -1}
+        priority_names = {value: name for name, value in priorities.items()}
+        
+        def selected_ids():
+            return [int(iid) for iid in tree.selection()]
+        
+        def apply(action, *args):
+            for job_id in selected_ids():
+                try:
+                    action(job_id, *args)
+                except KeyError:
+                    pass  # Cleared since the last refresh
+            refresh(reschedule=False)
+        
+        def move(offset):
+            ids = selected_ids()
+            # Move the job nearest the destination first so a group keeps its order
+            for job_id in (ids if offset < 0 else reversed(ids)):
+                manager.move(job_id, offset)
+            refresh(reschedule=False)
+        
+        def cancel():
+            ids = selected_ids()
+            if not ids:
+                return
+            if messagebox.askyesno("Cancel Transfers", f"Cancel {len(ids)} transfer(s)? "
+                                   "Partly uploaded or downloaded data is discarded.", parent=window):
+                apply(manager.cancel)
+        
+        def toggle_pause_all():
+            if manager.paused:
+                manager.resume_all()
+            else:
+                manager.pause_all()
+            refresh(reschedule=False)
+        
+        def apply_limits():
+            try:
+                rate = float(bandwidth_var.get() or 0)
+                max_active = int(max_active_var.get())
+            except ValueError:
+                messagebox.showerror("Transfers", "Enter the limit in MB/s and a whole number of transfers",
+                                     parent=window)
+                return
+            manager.set_bandwidth(int(max(rate, 0) * 1024 * 1024))
+            manager.set_max_active(max_active)
+        
+        def progress_text(job):
+            if job.state == FAILED and job.error:
+                return job.error
+            if not job.size:
+                return self.format_size(job.bytes_done)
+            return (f"{self.format_size(job.bytes_done)} of {self.format_size(job.size)} "
+                    f"({job.bytes_done * 100 // job.size}%)")
+        
+        def refresh(reschedule=True):
+            if not window.winfo_exists():
+                return
+            jobs = manager.ordered()
+            rows = {str(job.id): (job.state, priority_names.get(job.priority, str(job.priority)), progress_text(job),
+                                  f"{self.format_size(job.throughput())}/s" if job.state == RUNNING else "")
+                    for job in jobs}
+            if list(tree.get_children()) == list(rows):
+                # Same rows in the same order: update in place so selection and scrolling stay put
+                for iid, values in rows.items():
+                    tree.item(iid, values=values)
+            else:
+                selected = set(tree.selection())
+                tree.delete(*tree.get_children())
+                for job in jobs:
+                    iid = str(job.id)
+                    tree.insert('', tk.END, iid=iid, text=job.name, values=rows[iid])
+                    if iid in selected:
+                        tree.selection_add(iid)
+            counts = manager.counts()
+            rate = manager.bandwidth.rate
+            summary_label.config(text=f"{counts.get(RUNNING, 0)} running, {counts.get(QUEUED, 0)} queued, "
+                                      f"{counts.get(PAUSED, 0)} paused, {counts.get(FAILED, 0)} failed"
+                                      f"{' (queue paused)' if manager.paused else ''}; limit "
+                                      f"{self.format_size(rate) + '/s' if rate else 'none'}")
+            pause_all_button.config(text="Resume All" if manager.paused else "Pause All")
+            if reschedule:
+                window.after(500, refresh)
+        
+        job_frame = ttk.Frame(window, padding=(10, 5, 10, 0))
+        job_frame.pack(fill=tk.X)
+        ttk.Button(job_frame, text="Pause", command=lambda: apply(manager.pause)).pack(side=tk.LEFT)
+        ttk.Button(job_frame, text="Resume", command=lambda: apply(manager.resume)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(job_frame, text="Cancel", command=cancel).pack(side=tk.LEFT)
+        ttk.Button(job_frame, text="Move Up", command=lambda: move(-1)).pack(side=tk.LEFT, padx=(15, 5))
+        ttk.Button(job_frame, text="Move Down", command=lambda: move(1)).pack(side=tk.LEFT)
+        ttk.Label(job_frame, text="Priority:").pack(side=tk.LEFT, padx=(15, 5))
+        priority_var = tk.StringVar(value='Normal')
+        priority_box = ttk.Combobox(job_frame, textvariable=priority_var, values=list(priorities),
+                                    state='readonly', width=8)
+        priority_box.pack(side=tk.LEFT)
+        priority_box.bind('<<ComboboxSelected>>',
+                          lambda e: apply(manager.set_priority, priorities[priority_var.get()]))
+        ttk.Button(job_frame, text="Clear Finished",
+                   command=lambda: (manager.clear_finished(), refresh(reschedule=False))).pack(side=tk.RIGHT)
+        
+        queue_frame = ttk.Frame(window, padding=10)
+        queue_frame.pack(fill=tk.X)
+        pause_all_button = ttk.Button(queue_frame, text="Pause All", command=toggle_pause_all)
+        pause_all_button.pack(side=tk.LEFT)
+        ttk.Label(queue_frame, text="Limit (MB/s, 0 = none):").pack(side=tk.LEFT, padx=(15, 5))
+        bandwidth_var = tk.StringVar(value=f"{manager.bandwidth.rate / (1024 * 1024):g}")
+        ttk.Entry(queue_frame, textvariable=bandwidth_var, width=8).pack(side=tk.LEFT)
+        ttk.Label(queue_frame, text="At once:").pack(side=tk.LEFT, padx=(15, 5))
+        max_active_var = tk.StringVar(value=str(manager.max_active))
+        ttk.Spinbox(queue_frame, textvariable=max_active_var, from_=1, to=16, width=4).pack(side=tk.LEFT)
+        ttk.Button(queue_frame, text="Apply", command=apply_limits).pack(side=tk.LEFT, padx=5)
+        refresh()
+    
+    def poll_transfers(self):
+        """Apply queue jobs that finished since the last poll, then reschedule"""
+        refresh = False
+        while True:
+            try:
+                job = self.finished_transfers.get_nowait()
+            except queue.Empty:
+                break
+            logger.info(f"Transfer finished: {job.name}")
+            if job.kind == UPLOAD:
+                self.listing_cache.invalidate_key(job.bucket, job.key)
+                folder = job.key[:job.key.rfind('/') + 1]
+                if job.bucket == self.current_bucket and folder == normalize_prefix(self.current_prefix):
+                    refresh = True
+        if refresh:
+            self.load_objects()
+        
+        counts = self.engine.transfers.counts()
+        pending = counts.get(QUEUED, 0) + counts.get(RUNNING, 0)
+        self.transfers_button.config(text=f"Transfers ({pending})" if pending else "Transfers")
+        self.root.after(500, self.poll_transfers)
     
     def go_up_folder(self):
         """Navigate up one folder level"""
@@ -459,11 +1907,68 @@ class S3ClientGUI:
         self.bucket_path_var.set(new_path)
         self.load_bucket_path()
     
+    def go_back(self):
+        """Return to the previously browsed bucket/path"""
+        if not self.history_back:
+            return
+        
+        self.history_forward.append((self.current_bucket, self.current_prefix))
+        self.show_location(*self.history_back.pop())
+    
+    def go_forward(self):
+        """Undo the last Back"""
+        if not self.history_forward:
+            return
+        
+        self.history_back.append((self.current_bucket, self.current_prefix))
+        self.show_location(*self.history_forward.pop())
+    
+    def show_location(self, bucket, prefix):
+        """Browse bucket/prefix without recording it in the history"""
+        self.bucket_path_var.set(f"{bucket}/{prefix}" if prefix else bucket)
+        self.load_bucket_path(record_history=False)
+    
     def refresh_objects(self):
         if self.current_bucket:
-            self.load_objects()
+            # Refresh always goes back to S3
+            self.load_objects(use_cache=False)
         else:
             messagebox.showwarning("Warning", "Please load a bucket/path first")
+    
+    def refresh_operations(self):
+        """Redraw the operations panel from the runner's active tasks"""
+        selected = set(self.ops_tree.selection())
+        self.ops_tree.delete(*self.ops_tree.get_children())
+        self.ops_by_iid = {}
+        for task in self.runner.active_tasks():
+            iid = str(id(task))
+            self.ops_by_iid[iid] = task
+            self.ops_tree.insert('', tk.END, iid=iid, text=task.name, values=(task.status, task.progress))
+            if iid in selected:
+                self.ops_tree.selection_add(iid)
+    
+    def cancel_operation(self):
+        selection = self.ops_tree.selection()
+        if not selection:
+            messagebox.showwarning("Warning", "Please select an operation")
+            return
+        
+        for iid in selection:
+            task = self.ops_by_iid.get(iid)
+            if task:
+                task.cancel()
+                if task is self.listing_task:
+                    self.listing_task = None
+    
+    def on_close(self):
+        """Cancel background work before closing the window"""
+        self.cancel_listing()
+        if self.prefetcher:
+            self.prefetcher.shutdown()
+        self.runner.shutdown()
+        if self.engine:
+            self.engine.transfers.shutdown()
+        self.root.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
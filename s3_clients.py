@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from s3_tasks import find_cancellation
+
+logger = logging.getLogger(__name__)
+
+# Seconds to keep using the default region for a bucket whose HeadBucket failed without naming one
+UNREPORTED_REGION_TTL = 60
+
+# Operations whose bucket is a positional argument rather than Bucket=
+POSITIONAL_BUCKET = {'upload_file': 1, 'upload_fileobj': 1, 'download_file': 0, 'download_fileobj': 0}
+
+
+def env_flag(name, default):
+    return os.getenv(name, default).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def client_config_from_env(pool_size=10):
+    """Build a botocore Config from the pool, retry, timeout and keepalive settings
+
+    S3_MAX_POOL_CONNECTIONS overrides pool_size, which callers size to the
+    number of requests they may have in flight at once. S3_MAX_ATTEMPTS
+    counts the first try, like AWS_MAX_ATTEMPTS.
+    """
+    from botocore.config import Config
+    return Config(
+        max_pool_connections=int(os.getenv('S3_MAX_POOL_CONNECTIONS', '0')) or pool_size,
+        retries={
+            'mode': os.getenv('S3_RETRY_MODE', 'adaptive'),
+            'total_max_attempts': int(os.getenv('S3_MAX_ATTEMPTS', '5')),
+        },
+        connect_timeout=float(os.getenv('S3_CONNECT_TIMEOUT', '10')),
+        read_timeout=float(os.getenv('S3_READ_TIMEOUT', '60')),
+        tcp_keepalive=env_flag('S3_TCP_KEEPALIVE', 'true'),
+    )
+
+
+def raise_cancellation(caught_exception=None, **kwargs):
+    """needs-retry handler ending a request at once when it failed because it was cancelled
+
+    A cancel raised while the body is sent reaches botocore wrapped in an
+    HTTPClientError, which the retry modes would retry with backoff.
+    """
+    cancelled = find_cancellation(caught_exception)
+    if cancelled is not None:
+        raise cancelled
+
+
+def stop_retries_on_cancel(client):
+    """Make client give up on a cancelled request instead of retrying it (safe to call twice)"""
+    client.meta.events.register_first('needs-retry.s3', raise_cancellation, unique_id='s3-cancel-no-retry')
+
+
+class ClientRegistry:
+    """One configured S3 client per region, and the region of each bucket
+
+    A bucket's region is resolved once with HeadBucket (which reports it
+    even when the request itself is redirected or denied) and remembered,
+    so later calls go straight to the right regional endpoint instead of
+    being redirected. Endpoints that answer without a region get the
+    default region for good. When HeadBucket fails without naming one,
+    e.g. NoSuchBucket, the default is only kept for UNREPORTED_REGION_TTL
+    seconds, and transient errors (5xx, throttling) are not remembered at
+    all. Clients are created on first use and shared by every thread, and
+    each is instrumented with metrics when given.
+    """
+
+    def __init__(self, config, default_region=None, metrics=None):
+        # Imported here so that importing this module stays cheap
+        import boto3
+        # Sessions are not thread-safe; clients are, so only creation is locked
+        self.session = boto3.session.Session()
+        self.config = config
+        self.metrics = metrics
+        self.default_region = default_region or self.session.region_name or 'us-east-1'
+        self.clients = {}  # region -> client
+        self.regions = {}  # bucket -> (region, monotonic expiry or None for good)
+        self.resolving = {}  # bucket -> lock held while its HeadBucket is in flight
+        self.lock = threading.Lock()
+        self.default_client = self.client_for_region(self.default_region)
+
+    def client_for_region(self, region):
+        with self.lock:
+            client = self.clients.get(region)
+            if client is None:
+                logger.info(f"Creating S3 client for {region} "
+                            f"(pool {self.config.max_pool_connections}, retries {self.config.retries})")
+                client = self.session.client('s3', region_name=region, config=self.config)
+                stop_retries_on_cancel(client)
+                if self.metrics is not None:
+                    self.metrics.instrument(client)
+                self.clients[region] = client
+            return client
+
+    def region_for(self, bucket):
+        region = self.cached_region(bucket)
+        if region is not None:
+            return region
+        with self.lock:
+            resolving = self.resolving.setdefault(bucket, threading.Lock())
+        # One HeadBucket per bucket; workers asking at the same time wait for its answer
+        with resolving:
+            region = self.cached_region(bucket)
+            if region is not None:
+                return region
+            region, ttl = self.resolve_region(bucket)
+            if ttl != 0:
+                with self.lock:
+                    self.regions[bucket] = (region, None if ttl is None else time.monotonic() + ttl)
+        return region
+
+    def cached_region(self, bucket):
+        with self.lock:
+            cached = self.regions.get(bucket)
+        if cached is None or (cached[1] is not None and cached[1] < time.monotonic()):
+            return None
+        return cached[0]
+
+    def resolve_region(self, bucket):
+        """Return (region, seconds to remember it: None for good, 0 not at all) from HeadBucket"""
+        try:
+            response = self.default_client.head_bucket(Bucket=bucket)
+        except ClientError as e:
+            # 301/403 responses still carry the bucket's region
+            response = e.response
+        metadata = response.get('ResponseMetadata', {})
+        region = metadata.get('HTTPHeaders', {}).get('x-amz-bucket-region')
+        if region:
+            logger.info(f"Bucket {bucket} is in {region}")
+            return region, None
+        status = metadata.get('HTTPStatusCode', 0)
+        if status == 200:
+            # S3-compatible endpoints without regions answer without the header
+            logger.debug(f"Endpoint reports no region for bucket {bucket}, using {self.default_region}")
+            return self.default_region, None
+        if status >= 500 or status == 429 or response.get('Error', {}).get('Code') in ('SlowDown', 'Throttling'):
+            logger.debug(f"Region of bucket {bucket} unknown after a transient error, using {self.default_region}")
+            return self.default_region, 0
+        logger.debug(f"Region of bucket {bucket} unknown, using {self.default_region} "
+                     f"for {UNREPORTED_REGION_TTL}s")
+        return self.default_region, UNREPORTED_REGION_TTL
+
+    def client_for(self, bucket):
+        """Return the client for the region bucket lives in"""
+        if not bucket:
+            return self.default_client
+        return self.client_for_region(self.region_for(bucket))
+
+
+class BucketRoutingClient:
+    """Looks like one S3 client but sends each call to the bucket's regional client
+
+    The bucket is taken from Bucket= (or the positional argument of the
+    managed transfer methods); calls without one use the default region.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.meta = registry.default_client.meta
+
+    def __getattr__(self, name):
+        position = POSITIONAL_BUCKET.get(name)
+
+        def call(*args, **kwargs):
+            bucket = kwargs.get('Bucket')
+            if bucket is None and position is not None and len(args) > position:
+                bucket = args[position]
+            return getattr(self.registry.client_for(bucket), name)(*args, **kwargs)
+        return call
+
+    def get_paginator(self, operation_name):
+        return RoutingPaginator(self.registry, operation_name)
+
+
+class RoutingPaginator:
+    def __init__(self, registry, operation_name):
+        self.registry = registry
+        self.operation_name = operation_name
+
+    def paginate(self, **kwargs):
+        client = self.registry.client_for(kwargs.get('Bucket'))
+        return client.get_paginator(self.operation_name).paginate(**kwargs)
@@ -0,0 +1,441 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ConnectionError, HTTPClientError
+
+from s3_bulk import (MB, BatchDeleter, BulkCopier, BulkDownloader, BulkUploader, TransferProgress, iter_local_files,
+                     transfer_config_from_env)
+from s3_clients import BucketRoutingClient, ClientRegistry, client_config_from_env, stop_retries_on_cancel
+from s3_index import IndexBuilder, MetadataIndex, parse_query
+from s3_listing import ListingResult, iter_listing_pages, iter_prefix_objects, normalize_prefix
+from s3_metrics import Metrics
+from s3_preview import ChunkCache, RangeReader
+from s3_queue import TransferManager
+from s3_sync import UPLOAD, SyncEngine
+from s3_usage import PrefixSizer, UsageCache
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning S3 could not be reached at all, as opposed to S3 refusing a request
+OFFLINE_ERRORS = (ConnectionError, HTTPClientError)
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.s3_client_index.sqlite3')
+DEFAULT_QUEUE_PATH = os.path.join(os.path.expanduser('~'), '.s3_client_queue.json')
+
+
+def format_size(size):
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} PB"
+
+
+class S3Engine:
+    """S3 operations with no GUI dependency, shared by the GUI and the CLI
+
+    Everything that talks to S3 goes through here: folder listings, single
+    and bulk transfers, the transfer queue, batched deletes and sync.
+    Worker and transfer settings are read from the environment (.env).
+    Every API call and bulk operation is counted in self.metrics.
+    """
+
+    def __init__(self, s3_client=None):
+        self.transfer_config = transfer_config_from_env()
+        upload_workers = int(os.getenv('S3_UPLOAD_WORKERS', '8'))
+        download_workers = int(os.getenv('S3_DOWNLOAD_WORKERS', '16'))
+        delete_workers = int(os.getenv('S3_DELETE_WORKERS', '8'))
+        du_workers = int(os.getenv('S3_DU_WORKERS', '10'))
+        copy_workers = int(os.getenv('S3_COPY_WORKERS', '16'))
+        queue_jobs = int(os.getenv('S3_QUEUE_CONCURRENCY', '2'))
+        # Enough connections for the busiest bulk operation, the queue's parts in flight alongside it,
+        # and the GUI's listings and prefetching
+        pool_size = (max(upload_workers * self.transfer_config.max_concurrency, download_workers,
+                         delete_workers, du_workers, copy_workers)
+                     + queue_jobs * self.transfer_config.max_concurrency
+                     + int(os.getenv('S3_WORKER_THREADS', '4')) + int(os.getenv('S3_PREFETCH_THREADS', '2')))
+
+        self.metrics = Metrics(trace_sample=float(os.getenv('S3_TRACE_SAMPLE', '0')))
+        self.clients = None
+        if s3_client is None:
+            self.clients = self.create_registry(pool_size, self.metrics)
+            s3_client = BucketRoutingClient(self.clients)
+        else:
+            stop_retries_on_cancel(s3_client)
+            self.metrics.instrument(s3_client)
+        self.s3_client = s3_client
+
+        # Queued single-file transfers; only the GUI calls start(), so the CLI never resumes them.
+        # Their bandwidth limit also holds back the bulk uploads and downloads below
+        self.transfers = TransferManager(
+            self.s3_client, os.path.expanduser(os.getenv('S3_QUEUE_PATH', DEFAULT_QUEUE_PATH)),
+            max_active=queue_jobs,
+            bandwidth=int(float(os.getenv('S3_BANDWIDTH_LIMIT_MB', '0')) * MB),
+            part_size=self.transfer_config.multipart_chunksize,
+            multipart_threshold=self.transfer_config.multipart_threshold,
+            part_workers=self.transfer_config.max_concurrency)
+        self.transfers.on_finished = self.transfer_finished
+        self.on_transfer_finished = None
+        self.uploader = BulkUploader(self.s3_client, self.transfer_config, max_workers=upload_workers,
+                                     bandwidth=self.transfers.bandwidth)
+        self.downloader = BulkDownloader(
+            self.s3_client,
+            max_workers=download_workers,
+            part_size=int(float(os.getenv('S3_DOWNLOAD_PART_MB', '16')) * MB),
+            range_threshold=int(float(os.getenv('S3_DOWNLOAD_RANGE_THRESHOLD_MB', '16')) * MB),
+            bandwidth=self.transfers.bandwidth)
+        self.deleter = BatchDeleter(self.s3_client, max_workers=delete_workers)
+        self.copier = BulkCopier(
+            self.s3_client,
+            max_workers=copy_workers,
+            part_size=int(float(os.getenv('S3_COPY_PART_MB', '512')) * MB),
+            multipart_threshold=int(float(os.getenv('S3_COPY_MULTIPART_THRESHOLD_MB', '5120')) * MB))
+        self.sync_engine = SyncEngine(self.s3_client, self.uploader, self.downloader, self.deleter)
+        # Folder sizes are cached here and dropped by the writes below
+        self.usage_cache = UsageCache(ttl=int(os.getenv('S3_DU_CACHE_TTL', '3600')))
+        self.sizer = PrefixSizer(
+            self.s3_client, self.usage_cache,
+            max_workers=du_workers,
+            shard_depth=int(os.getenv('S3_DU_SHARD_DEPTH', '3')))
+        # Ranged reads for previews; fetched chunks are kept in a bounded LRU cache
+        self.chunk_cache = ChunkCache(max_bytes=int(float(os.getenv('S3_PREVIEW_CACHE_MB', '32')) * MB))
+        self.reader = RangeReader(self.s3_client, self.chunk_cache)
+        self.index = self.open_index(os.getenv('S3_INDEX_PATH', DEFAULT_INDEX_PATH))
+        self.index_builder = None
+        if self.index is not None:
+            self.index_builder = IndexBuilder(
+                self.s3_client, self.index,
+                max_workers=du_workers,
+                shard_depth=int(os.getenv('S3_DU_SHARD_DEPTH', '3')))
+
+    @staticmethod
+    def create_registry(pool_size, metrics=None):
+        """Create the per-region client registry, with pool/retry/timeout settings from .env"""
+        logger.info("Initializing S3 clients...")
+        return ClientRegistry(client_config_from_env(pool_size), os.getenv('AWS_DEFAULT_REGION'), metrics)
+
+    @staticmethod
+    def open_index(path):
+        """Open the metadata index at path; an empty path or an unusable file disables it"""
+        if not path:
+            return None
+        try:
+            return MetadataIndex(path)
+        except Exception as e:
+            logger.warning(f"Metadata index {path} unavailable: {e}")
+            return None
+
+    @staticmethod
+    def parse_bucket_path(bucket_path):
+        """Parse bucket/path string into bucket and prefix"""
+        if not bucket_path:
+            return None, None
+
+        parts = bucket_path.split('/', 1)
+        bucket = parts[0]
+        prefix = parts[1] if len(parts) > 1 else None
+
+        return bucket, prefix
+
+    @staticmethod
+    def parse_s3_url(url):
+        """Parse 's3://bucket/path' (or plain 'bucket/path') into bucket and prefix"""
+        if url.startswith('s3://'):
+            url = url[len('s3://'):]
+        return S3Engine.parse_bucket_path(url)
+
+    def list_folder(self, bucket, prefix, cancel_event=None, start_token=None):
+        """Yield ListingPage objects for one folder level"""
+        pages = iter_listing_pages(self.s3_client, bucket, prefix, cancel_event, start_token=start_token)
+        if self.index is None or start_token or self.index.covers(bucket, prefix) is None:
+            return pages
+        return self.reconciling(bucket, prefix, pages, cancel_event)
+
+    def reconciling(self, bucket, prefix, pages, cancel_event=None):
+        """Pass pages through, then update the indexed folder level from the complete listing"""
+        listing = ListingResult()
+        for page in pages:
+            listing.add_page(page)
+            yield page
+        if listing.complete and not (cancel_event is not None and cancel_event.is_set()):
+            self.index.apply_listing(bucket, prefix, listing)
+
+    def browse_index(self, bucket, prefix):
+        """Return (ListingResult, indexed_at) for an indexed folder level, or (None, None)"""
+        indexed_at = self.index.covers(bucket, prefix) if self.index is not None else None
+        if indexed_at is None:
+            return None, None
+        return self.index.browse(bucket, prefix), indexed_at
+
+    def iter_objects(self, bucket, prefix, cancel_event=None):
+        """Yield object dicts for every key under prefix, recursively"""
+        return iter_prefix_objects(self.s3_client, bucket, prefix, cancel_event)
+
+    def transfer_finished(self, job):
+        """Bookkeeping for a finished queue job; runs on the job's worker thread"""
+        self.metrics.record_transfer(job.kind, 1, job.bytes_done - job.bytes_at_start, job.elapsed)
+        if job.kind == UPLOAD:
+            self.usage_cache.invalidate_key(job.bucket, job.key)
+            self.index_put(job.bucket, [(job.key, job.size, time.time(), None)])
+        if self.on_transfer_finished:
+            self.on_transfer_finished(job)
+
+    def open_object(self, bucket, key):
+        """HEAD an object and return an ObjectHandle for read_object"""
+        return self.reader.open(bucket, key)
+
+    def read_object(self, handle, start, length, cancel_event=None):
+        """Return up to length bytes of an opened object from offset start (ranged GETs, cached)"""
+        return self.reader.read(handle, start, length, cancel_event)
+
+    def iter_upload_items(self, paths, prefix):
+        """Yield (local_path, key, size) for files and directory trees uploaded into prefix
+
+        A directory 'dir' lands under prefix + 'dir/', mirroring its layout.
+        """
+        prefix = normalize_prefix(prefix)
+        for path in paths:
+            name = os.path.basename(os.path.normpath(path))
+            if os.path.isdir(path):
+                base = prefix + name + '/'
+                for f in iter_local_files(path):
+                    yield f.path, base + f.relpath, f.size
+            else:
+                yield path, prefix + name, os.path.getsize(path)
+
+    def upload(self, files, bucket, progress, cancel_event=None):
+        sent = []
+        try:
+            with self.measuring('upload', progress):
+                self.uploader.upload(self.tracking(bucket, files, lambda item: item[1], sent),
+                                     bucket, progress, cancel_event)
+        except BaseException:
+            self.index_stale(bucket, [key for local_path, key, size in sent])
+            raise
+        failed = {name for name, error in progress.failures}
+        now = time.time()
+        self.index_put(bucket, [(key, size, now, None) for local_path, key, size in sent if key not in failed])
+        return progress
+
+    def download_file(self, bucket, key, local_path, progress, cancel_event=None):
+        """Download one object to local_path like a bulk download: ranged GETs, resumable if interrupted"""
+        head = self.s3_client.head_object(Bucket=bucket, Key=key)
+        directory = os.path.dirname(os.path.abspath(local_path))
+        return self.download([(key, os.path.abspath(local_path), head['ContentLength'], head['ETag'])],
+                             bucket, directory, progress, cancel_event)
+
+    def iter_download_items(self, bucket, prefix, names, directory, cancel_event=None):
+        """Yield (key, local_path, size, etag) for names in prefix, expanding folders ('name/')"""
+        prefix = normalize_prefix(prefix)
+        root = os.path.abspath(directory)
+        for name in names:
+            if name.endswith('/'):
+                objects = self.iter_objects(bucket, prefix + name, cancel_event)
+            else:
+                head = self.s3_client.head_object(Bucket=bucket, Key=prefix + name)
+                objects = [{'Key': prefix + name, 'Size': head['ContentLength'], 'ETag': head['ETag']}]
+
+            for obj in objects:
+                relative = obj['Key'][len(prefix):]
+                local_path = os.path.abspath(os.path.join(root, *relative.split('/')))
+                if relative.endswith('/'):
+                    # Folder placeholder objects become empty directories
+                    os.makedirs(local_path, exist_ok=True)
+                    continue
+                if not local_path.startswith(root + os.sep):
+                    logger.warning(f"Skipping key that would escape the download folder: {obj['Key']}")
+                    continue
+                yield obj['Key'], local_path, obj['Size'], obj['ETag']
+
+    def download(self, objects, bucket, directory, progress, cancel_event=None):
+        with self.measuring('download', progress):
+            return self.downloader.download(objects, bucket, directory, progress, cancel_event)
+
+    def delete_object(self, bucket, key):
+        self.usage_cache.invalidate_key(bucket, key)
+        self.s3_client.delete_object(Bucket=bucket, Key=key)
+        if self.index is not None:
+            self.index.remove_keys(bucket, [key])
+
+    def iter_delete_keys(self, bucket, prefix, names, cancel_event=None):
+        """Yield the keys for names in prefix, expanding folders ('name/') recursively"""
+        prefix = normalize_prefix(prefix)
+        for name in names:
+            if name.endswith('/'):
+                for obj in self.iter_objects(bucket, prefix + name, cancel_event):
+                    yield obj['Key']
+            else:
+                yield prefix + name
+
+    def delete(self, keys, bucket, progress, cancel_event=None):
+        sent = []
+        try:
+            with self.measuring('delete', progress):
+                self.deleter.delete(self.tracking(bucket, keys, lambda key: key, sent), bucket, progress, cancel_event)
+        except BaseException:
+            self.index_stale(bucket, sent)
+            raise
+        if self.index is not None:
+            failed = {name for name, error in progress.failures}
+            self.index.remove_keys(bucket, [key for key in sent if key not in failed])
+        return progress
+
+    def iter_copy_items(self, bucket, prefix, names, dest_bucket, dest_prefix, new_name=None, cancel_event=None):
+        """Yield (source_key, dest_key, size, etag) for names in prefix copied into dest_prefix
+
+        Folders ('name/') bring every key under them. new_name renames a
+        single name on the way; a folder's new name ends in '/' too.
+        """
+        prefix = normalize_prefix(prefix)
+        dest_prefix = normalize_prefix(dest_prefix)
+        for name in names:
+            source = prefix + name
+            target = dest_prefix + (new_name or name)
+            if name.endswith('/'):
+                for obj in self.iter_objects(bucket, source, cancel_event):
+                    yield obj['Key'], target + obj['Key'][len(source):], obj['Size'], obj['ETag']
+            else:
+                head = self.s3_client.head_object(Bucket=bucket, Key=source)
+                yield source, target, head['ContentLength'], head['ETag']
+
+    @staticmethod
+    def check_copy(bucket, prefix, names, dest_bucket, dest_prefix, new_name=None):
+        """Raise ValueError if copying names would copy something onto or into itself"""
+        prefix = normalize_prefix(prefix)
+        dest_prefix = normalize_prefix(dest_prefix)
+        if bucket != dest_bucket:
+            return
+        for name in names:
+            source = prefix + name
+            target = dest_prefix + (new_name or name)
+            if target == source:
+                raise ValueError(f"s3://{bucket}/{source} would be copied onto itself")
+            # A folder copied under itself would keep listing its own copies
+            if name.endswith('/') and target.startswith(source):
+                raise ValueError(f"s3://{bucket}/{source} cannot be copied into itself")
+
+    def copy(self, items, bucket, dest_bucket, progress, cancel_event=None, copied=None):
+        """Copy (source_key, dest_key, size, etag) items inside S3; copied items are appended to copied"""
+        copied = [] if copied is None else copied
+        sent = []
+        try:
+            with self.measuring('copy', progress):
+                self.copier.copy(self.tracking(dest_bucket, items, lambda item: item[1], sent),
+                                 bucket, dest_bucket, progress, cancel_event, on_copied=copied.append)
+        except BaseException:
+            self.index_stale(dest_bucket, [item[1] for item in sent])
+            raise
+        now = time.time()
+        self.index_put(dest_bucket, [(key, size, now, None) for source_key, key, size, etag in copied])
+        return progress
+
+    def move(self, items, bucket, dest_bucket, progress, cancel_event=None):
+        """Copy items inside S3, then delete the sources of every object that was copied
+
+        The sources are deleted in DeleteObjects batches even when the copy
+        is cancelled or fails part way, so no object is left in both places.
+        """
+        copied = []
+        try:
+            self.copy(items, bucket, dest_bucket, progress, cancel_event, copied)
+        finally:
+            if copied:
+                deleted = TransferProgress()
+                self.delete((item[0] for item in copied), bucket, deleted)
+                for key, error in deleted.failures:
+                    progress.file_failed(key, f"Copied but not deleted: {error}")
+        return progress
+
+    def sync_plan(self, direction, local_root, bucket, prefix, delete=False, cancel_event=None):
+        return self.sync_engine.plan(direction, local_root, bucket, prefix, delete, cancel_event)
+
+    def sync_execute(self, plan, progress, cancel_event=None):
+        if plan.direction != UPLOAD:
+            with self.measuring('sync', progress):
+                return self.sync_engine.execute(plan, progress, cancel_event)
+
+        self.usage_cache.invalidate_tree(plan.bucket, plan.prefix)
+        try:
+            with self.measuring('sync', progress):
+                self.sync_engine.execute(plan, progress, cancel_event)
+        except BaseException:
+            self.index_stale(plan.bucket, [plan.prefix])
+            raise
+        if self.index is not None:
+            failed = {name for name, error in progress.failures}
+            now = time.time()
+            self.index_put(plan.bucket, [(plan.prefix + relpath, size, now, None)
+                                         for relpath, size, etag in plan.transfers
+                                         if plan.prefix + relpath not in failed])
+            self.index.remove_keys(plan.bucket, [plan.prefix + relpath for relpath in plan.deletes
+                                                 if plan.prefix + relpath not in failed])
+        return progress
+
+    @contextmanager
+    def measuring(self, kind, progress):
+        """Add progress to the transfer metrics under kind when the block ends, even if it failed"""
+        try:
+            yield progress
+        finally:
+            self.metrics.record_progress(kind, progress)
+
+    def tracking(self, bucket, items, key_of, sent):
+        """Pass items through, recording them in sent and dropping cached sizes for each key about to change"""
+        for item in items:
+            self.usage_cache.invalidate_key(bucket, key_of(item))
+            sent.append(item)
+            yield item
+
+    def index_put(self, bucket, rows):
+        """Record (key, size, mtime, etag) rows in the index, keeping only keys under an indexed prefix"""
+        if self.index is None:
+            return
+        prefixes = self.index.indexed_prefixes(bucket)
+        rows = [row for row in rows if any(row[0].startswith(prefix) for prefix in prefixes)]
+        if rows:
+            self.index.put_objects(bucket, rows)
+
+    def index_stale(self, bucket, keys):
+        """Mark the deepest prefix shared by keys stale after an interrupted bulk change
+
+        When that prefix is not indexed itself, the indexed prefixes inside it are marked instead.
+        """
+        if self.index is None or not keys:
+            return
+        common = os.path.commonprefix(keys)
+        common = common[:common.rfind('/') + 1]
+        prefixes = self.index.indexed_prefixes(bucket)
+        if any(common.startswith(prefix) for prefix in prefixes):
+            self.index.mark_stale(bucket, common)
+            return
+        for prefix in prefixes:
+            if prefix.startswith(common):
+                self.index.mark_stale(bucket, prefix)
+
+    def build_index(self, bucket, prefix, cancel_event=None, on_progress=None):
+        """Index everything under bucket/prefix with a parallel listing; return the number of keys"""
+        return self.index_builder.build(bucket, prefix, cancel_event, on_progress)
+
+    def refresh_index(self, bucket, cancel_event=None, on_progress=None):
+        """Re-list only the prefixes of bucket marked stale; return how many there were"""
+        return self.index_builder.refresh(bucket, cancel_event, on_progress)
+
+    def search_index(self, bucket, query, prefix=None, limit=1000):
+        """Return (key, size, mtime) rows of bucket matching a search box query (see parse_query)"""
+        return self.index.search(bucket, prefix=prefix, limit=limit, **parse_query(query))
+
+    def du(self, bucket, prefix, folders=None, cancel_event=None, on_update=None, use_cache=True):
+        """Return (total, {folder_name: PrefixUsage}) for prefix or just the given sub-folders"""
+        return self.sizer.du(bucket, prefix, folders, cancel_event, on_update, use_cache)
+
+    def cached_folder_usage(self, bucket, prefix, folders):
+        """Return {folder_name: PrefixUsage} for the folders whose size is already known"""
+        prefix = normalize_prefix(prefix)
+        sizes = {}
+        for name in folders:
+            usage = self.usage_cache.get(bucket, prefix + name)
+            if usage is not None:
+                sizes[name] = usage
+        return sizes
@@ -0,0 +1,343 @@
+"""Minimal in-process S3-compatible HTTP server for benchmarks
+
+Implements just the calls this client makes: HeadBucket, CreateBucket,
+ListObjectsV2 (prefix, delimiter, continuation), Put/Get/Head/DeleteObject
+with ranged and If-Match GETs, DeleteObjects and multipart uploads. Keys
+are kept in a sorted list, so listing a page costs the same with a
+million keys as with a thousand. Requests are not authenticated.
+
+    server = FakeS3Server().start()
+    server.seed('bucket', ('data/%08d' % i for i in range(100000)))
+    # point boto3 at server.url (e.g. AWS_ENDPOINT_URL)
+    server.stop()
+"""
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+def upper_bound(prefix):
+    """Return the smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class FakeObject:
+    __slots__ = ('size', 'etag', 'mtime', 'body')
+
+    def __init__(self, size, body=None, mtime=None, etag=None):
+        self.size = size
+        self.body = body  # None serves size zero bytes (seeded objects)
+        self.etag = etag or f'"{uuid.uuid4().hex}"'
+        self.mtime = time.time() if mtime is None else mtime
+
+
+class FakeBucket:
+    """Objects of one bucket plus a sorted key list for listings
+
+    Deleted keys stay in the list until more than half of it is stale,
+    so a delete that runs alongside its own listing stays cheap.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.keys = []
+        self.stale = 0
+        self.uploads = {}  # upload id -> (key, {part number: bytes})
+
+    def put(self, key, obj):
+        if key not in self.objects:
+            insort(self.keys, key)
+        self.objects[key] = obj
+
+    def delete(self, key):
+        if self.objects.pop(key, None) is not None:
+            self.stale += 1
+            if self.stale > len(self.keys) // 2:
+                self.keys = [k for k in self.keys if k in self.objects]
+                self.stale = 0
+
+    def list(self, prefix, delimiter, max_keys, after):
+        """Return (objects, common_prefixes, next_token) for one ListObjectsV2 page"""
+        keys = self.keys
+        start = bisect_left(keys, prefix)
+        if after:
+            if delimiter and after.startswith(prefix) and after.find(delimiter, len(prefix)) >= 0:
+                # The token is a common prefix: resume after everything beneath it
+                start = max(start, bisect_left(keys, upper_bound(after)))
+            else:
+                start = max(start, bisect_right(keys, after))
+        end = bisect_left(keys, upper_bound(prefix)) if prefix else len(keys)
+
+        contents, prefixes, last = [], [], None
+        i = start
+        while i < end:
+            if len(contents) + len(prefixes) >= max_keys:
+                return contents, prefixes, last
+            key = keys[i]
+            obj = self.objects.get(key)
+            if obj is None:
+                i += 1
+                continue
+            cut = key.find(delimiter, len(prefix)) if delimiter else -1
+            if cut >= 0:
+                common = key[:cut + len(delimiter)]
+                prefixes.append(common)
+                last = common
+                i = bisect_left(keys, upper_bound(common), i)
+                continue
+            contents.append((key, obj))
+            last = key
+            i += 1
+        return contents, prefixes, None
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so connection pooling is exercised
+    # Headers and body are separate writes; with Nagle on, small responses wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    # --- request dispatch ---
+
+    def parse(self):
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        query = {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        return bucket, key, query
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_HEAD(self):
+        bucket, key, query = self.parse()
+        store = self.server.buckets.get(bucket)
+        if store is None:
+            return self.send_error_xml(404, 'NoSuchBucket', body=False)
+        if not key:
+            return self.send_bytes(200, b'', headers={'x-amz-bucket-region': 'us-east-1'})
+        obj = store.objects.get(key)
+        if obj is None:
+            return self.send_error_xml(404, 'NoSuchKey', body=False)
+        self.send_object(obj, head=True)
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+        store = self.server.buckets.get(bucket)
+        if store is None:
+            return self.send_error_xml(404, 'NoSuchBucket')
+        if not key:
+            return self.list_objects(bucket, store, query)
+        obj = store.objects.get(key)
+        if obj is None:
+            return self.send_error_xml(404, 'NoSuchKey')
+        if_match = self.headers.get('If-Match')
+        if if_match and if_match != obj.etag:
+            return self.send_error_xml(412, 'PreconditionFailed')
+        self.send_object(obj)
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        if not key:
+            self.server.create_bucket(bucket)
+            return self.send_bytes(200, b'')
+        store = self.server.buckets.get(bucket)
+        if store is None:
+            return self.send_error_xml(404, 'NoSuchBucket')
+        if 'uploadId' in query:
+            upload = store.uploads.get(query['uploadId'])
+            if upload is None:
+                return self.send_error_xml(404, 'NoSuchUpload')
+            upload[1][int(query['partNumber'])] = body
+            return self.send_bytes(200, b'', headers={'ETag': f'"{uuid.uuid4().hex}"'})
+        obj = FakeObject(len(body), body)
+        with self.server.lock:
+            store.put(key, obj)
+        self.send_bytes(200, b'', headers={'ETag': obj.etag})
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+        body = self.read_body()
+        store = self.server.buckets.get(bucket)
+        if store is None:
+            return self.send_error_xml(404, 'NoSuchBucket')
+        if 'delete' in query:
+            return self.delete_objects(store, body)
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            store.uploads[upload_id] = (key, {})
+            return self.send_xml('InitiateMultipartUploadResult',
+                                 f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+                                 f'<UploadId>{upload_id}</UploadId>')
+        if 'uploadId' in query:
+            upload = store.uploads.pop(query['uploadId'], None)
+            if upload is None:
+                return self.send_error_xml(404, 'NoSuchUpload')
+            numbers = [int(e.text) for e in ElementTree.fromstring(body).iter(f'{{{XMLNS}}}PartNumber')]
+            data = b''.join(upload[1][n] for n in numbers)
+            obj = FakeObject(len(data), data)
+            with self.server.lock:
+                store.put(key, obj)
+            return self.send_xml('CompleteMultipartUploadResult',
+                                 f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+                                 f'<ETag>{escape(obj.etag)}</ETag>')
+        self.send_error_xml(400, 'InvalidRequest')
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+        store = self.server.buckets.get(bucket)
+        if store is None:
+            return self.send_error_xml(404, 'NoSuchBucket')
+        if 'uploadId' in query:
+            store.uploads.pop(query['uploadId'], None)
+        else:
+            with self.server.lock:
+                store.delete(key)
+        self.send_bytes(204, b'')
+
+    # --- operations ---
+
+    def list_objects(self, bucket, store, query):
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter', '')
+        max_keys = min(int(query.get('max-keys', '1000')), 1000)
+        token = query.get('continuation-token', '')
+        with self.server.lock:
+            contents, prefixes, next_token = store.list(prefix, delimiter, max_keys,
+                                                        token or query.get('start-after', ''))
+        parts = [f'<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>'
+                 f'<KeyCount>{len(contents) + len(prefixes)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>']
+        if delimiter:
+            parts.append(f'<Delimiter>{escape(delimiter)}</Delimiter>')
+        parts.append(f'<IsTruncated>{"true" if next_token else "false"}</IsTruncated>')
+        if token:
+            parts.append(f'<ContinuationToken>{escape(token)}</ContinuationToken>')
+        if next_token:
+            parts.append(f'<NextContinuationToken>{escape(next_token)}</NextContinuationToken>')
+        for key, obj in contents:
+            modified = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(obj.mtime))
+            parts.append(f'<Contents><Key>{escape(key)}</Key><LastModified>{modified}</LastModified>'
+                         f'<ETag>{escape(obj.etag)}</ETag><Size>{obj.size}</Size>'
+                         f'<StorageClass>STANDARD</StorageClass></Contents>')
+        for common in prefixes:
+            parts.append(f'<CommonPrefixes><Prefix>{escape(common)}</Prefix></CommonPrefixes>')
+        self.send_xml('ListBucketResult', ''.join(parts))
+
+    def delete_objects(self, store, body):
+        request = ElementTree.fromstring(body)
+        keys = [e.text or '' for e in request.iter(f'{{{XMLNS}}}Key')]
+        quiet = (request.findtext(f'{{{XMLNS}}}Quiet') or '').lower() == 'true'
+        with self.server.lock:
+            for key in keys:
+                store.delete(key)
+        deleted = '' if quiet else ''.join(f'<Deleted><Key>{escape(key)}</Key></Deleted>' for key in keys)
+        self.send_xml('DeleteResult', deleted)
+
+    # --- responses ---
+
+    def send_object(self, obj, head=False):
+        start, end = 0, obj.size - 1
+        status = 200
+        headers = {'ETag': obj.etag, 'Last-Modified': formatdate(obj.mtime, usegmt=True),
+                   'Accept-Ranges': 'bytes', 'Content-Type': 'binary/octet-stream'}
+        requested = self.headers.get('Range')
+        if requested and requested.startswith('bytes=') and obj.size:
+            first, _, last = requested[len('bytes='):].partition('-')
+            start = int(first)
+            end = min(int(last), obj.size - 1) if last else obj.size - 1
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{obj.size}'
+        length = max(end - start + 1, 0)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if head:
+            return
+        if obj.body is not None:
+            self.wfile.write(memoryview(obj.body)[start:start + length])
+        else:
+            self.wfile.write(bytes(length))
+
+    def send_bytes(self, status, body, content_type=None, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_xml(self, root, inner):
+        body = f'<?xml version="1.0" encoding="UTF-8"?><{root} xmlns="{XMLNS}">{inner}</{root}>'
+        self.send_bytes(200, body.encode('utf-8'), 'application/xml')
+
+    def send_error_xml(self, status, code, body=True):
+        text = b''
+        if body:
+            text = (f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code>'
+                    f'<Message>{code}</Message></Error>').encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    """Threaded fake S3 endpoint; buckets live in memory for the life of the server"""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeS3Handler)
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-s3', daemon=True)
+        self.thread.start()
+        logger.info(f"Fake S3 server listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def create_bucket(self, bucket):
+        with self.lock:
+            return self.buckets.setdefault(bucket, FakeBucket())
+
+    def seed(self, bucket, keys, size=0):
+        """Add objects of size zero-filled bytes under keys without going through HTTP"""
+        store = self.create_bucket(bucket)
+        now = time.time()
+        etag = f'"{uuid.uuid4().hex}"'
+        with self.lock:
+            for key in keys:
+                store.objects[key] = FakeObject(size, mtime=now, etag=etag)
+            store.keys = sorted(store.objects)
+            store.stale = 0
+        return len(store.objects)
@@ -0,0 +1,328 @@
+import calendar
+import logging
+import os
+import shlex
+import sqlite3
+import threading
+import time
+
+from s3_listing import ListingResult, ShardedLister, normalize_prefix
+
+logger = logging.getLogger(__name__)
+
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    etag TEXT,
+    run INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS indexed (
+    bucket TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (bucket, prefix)
+);
+CREATE TABLE IF NOT EXISTS stale (
+    bucket TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    PRIMARY KEY (bucket, prefix)
+);
+"""
+
+
+def prefix_upper_bound(prefix):
+    """Return the smallest string greater than every key under prefix ('name/' -> 'name0')"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def parse_size(text):
+    """Parse '10MB', '1.5 GB' or '512' (bytes) into a byte count"""
+    text = text.strip().upper()
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(text)
+
+
+def parse_query(query):
+    """Turn a search box query into MetadataIndex.search keyword arguments
+
+    Words are matched as a case-insensitive substring of the key; a word
+    with *, ? or [ is a glob matched against the whole key or its file
+    name. Filters: size>10MB, size<=1GB, after:2024-01-31, before:2024-02-01
+    (UTC dates). Raises ValueError for a malformed filter.
+    """
+    filters = {}
+    words = []
+    for token in shlex.split(query):
+        lowered = token.lower()
+        if lowered.startswith('size'):
+            for op in ('>=', '<=', '>', '<'):
+                if lowered.startswith('size' + op):
+                    try:
+                        size = parse_size(token[4 + len(op):])
+                    except ValueError:
+                        raise ValueError(f"Expected a size like 10MB in '{token}'")
+                    if op == '>':
+                        filters['min_size'] = size + 1
+                    elif op == '>=':
+                        filters['min_size'] = size
+                    elif op == '<':
+                        filters['max_size'] = size - 1
+                    else:
+                        filters['max_size'] = size
+                    break
+            else:
+                raise ValueError(f"Expected size>N, size>=N, size<N or size<=N, got '{token}'")
+        elif lowered.startswith(('after:', 'before:')):
+            name, _, value = token.partition(':')
+            try:
+                filters[name.lower()] = calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+            except ValueError:
+                raise ValueError(f"Expected a YYYY-MM-DD date in '{token}'")
+        elif any(c in token for c in '*?['):
+            if 'pattern' in filters:
+                raise ValueError("Only one glob pattern is supported")
+            filters['pattern'] = token
+        else:
+            words.append(token)
+    if words:
+        filters['text'] = ' '.join(words)
+    return filters
+
+
+class MetadataIndex:
+    """On-disk SQLite index of object keys, sizes, mtimes and ETags
+
+    Rows are kept per bucket in key order, so a folder level is read back
+    with a skip scan that jumps over each sub-folder, and searches are
+    local queries. The indexed table records which prefixes have been fully
+    listed (and may be browsed offline); the stale table records prefixes
+    that changed in ways we could not apply directly and need re-listing.
+    Safe to use from worker threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def range_clause(self, prefix, start=None):
+        """Return SQL and parameters selecting the keys under prefix (from start on)"""
+        clause = "bucket = ? AND key >= ?"
+        params = [start if start is not None else prefix]
+        if prefix:
+            clause += " AND key < ?"
+            params.append(prefix_upper_bound(prefix))
+        return clause, params
+
+    def covers(self, bucket, prefix):
+        """Return when the index of a prefix containing bucket/prefix was built, or None"""
+        prefix = normalize_prefix(prefix)
+        with self.lock:
+            rows = self.conn.execute("SELECT prefix, indexed_at FROM indexed WHERE bucket = ?", (bucket,)).fetchall()
+        times = [indexed_at for indexed, indexed_at in rows if prefix.startswith(indexed)]
+        return min(times) if times else None
+
+    def indexed_prefixes(self, bucket):
+        """Return every prefix of bucket that has been indexed"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT prefix FROM indexed WHERE bucket = ?", (bucket,))]
+
+    def put_objects(self, bucket, rows, run=0):
+        """Insert or replace (key, size, mtime, etag) rows"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO objects (bucket, key, size, mtime, etag, run) VALUES (?, ?, ?, ?, ?, ?)",
+                ((bucket, key, size, mtime, etag, run) for key, size, mtime, etag in rows))
+
+    def remove_keys(self, bucket, keys):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM objects WHERE bucket = ? AND key = ?", ((bucket, key) for key in keys))
+
+    def remove_tree(self, bucket, prefix):
+        clause, params = self.range_clause(normalize_prefix(prefix))
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM objects WHERE {clause}", [bucket] + params)
+
+    def finish_build(self, bucket, prefix, run):
+        """Drop rows a completed build of prefix did not see and mark it indexed"""
+        prefix = normalize_prefix(prefix)
+        clause, params = self.range_clause(prefix)
+        with self.lock, self.conn:
+            removed = self.conn.execute(f"DELETE FROM objects WHERE {clause} AND run != ?",
+                                        [bucket] + params + [run]).rowcount
+            for table in ('indexed', 'stale'):
+                self.conn.execute(f"DELETE FROM {table} WHERE bucket = ? AND substr(prefix, 1, ?) = ?",
+                                  (bucket, len(prefix), prefix))
+            self.conn.execute("INSERT INTO indexed (bucket, prefix, indexed_at) VALUES (?, ?, ?)",
+                              (bucket, prefix, time.time()))
+        return removed
+
+    def mark_stale(self, bucket, prefix):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO stale (bucket, prefix) VALUES (?, ?)",
+                              (bucket, normalize_prefix(prefix)))
+
+    def stale_prefixes(self, bucket):
+        """Return the stale prefixes of bucket, leaving out those inside another one"""
+        with self.lock:
+            prefixes = sorted(row[0] for row in self.conn.execute(
+                "SELECT prefix FROM stale WHERE bucket = ?", (bucket,)))
+        collapsed = []
+        for prefix in prefixes:
+            if not collapsed or not prefix.startswith(collapsed[-1]):
+                collapsed.append(prefix)
+        return collapsed
+
+    def browse(self, bucket, prefix):
+        """Return one folder level of bucket/prefix from the index as a ListingResult"""
+        prefix = normalize_prefix(prefix)
+        result = ListingResult()
+        start = prefix
+        with self.lock:
+            while start is not None:
+                clause, params = self.range_clause(prefix, start)
+                start = None
+                for key, size, mtime in self.conn.execute(
+                        f"SELECT key, size, mtime FROM objects WHERE {clause} ORDER BY key", [bucket] + params):
+                    name = key[len(prefix):]
+                    slash = name.find('/')
+                    if slash < 0:
+                        if not name:
+                            continue  # The folder's own placeholder key
+                        result.names.append(name)
+                        result.sizes.append(size)
+                        result.mtimes.append(mtime)
+                    elif slash > 0:
+                        # Record the sub-folder and continue after everything in it
+                        folder = name[:slash + 1]
+                        result.folders.append(folder)
+                        start = prefix_upper_bound(prefix + folder)
+                        break
+        return result
+
+    def apply_listing(self, bucket, prefix, listing):
+        """Bring one indexed folder level in line with a complete S3 listing of it
+
+        Changed and new files are updated in place and vanished files and
+        folders are removed. Sub-folders the index has never seen are marked
+        stale, since their contents are unknown.
+        """
+        prefix = normalize_prefix(prefix)
+        indexed = self.browse(bucket, prefix)
+        old_files = {name: (size, mtime) for name, size, mtime in zip(indexed.names, indexed.sizes, indexed.mtimes)}
+        new_files = {name: (size, mtime) for name, size, mtime in zip(listing.names, listing.sizes, listing.mtimes)}
+        changed = [(prefix + name, size, mtime, None) for name, (size, mtime) in new_files.items()
+                   if old_files.get(name) != (size, mtime)]
+        removed = [prefix + name for name in old_files if name not in new_files]
+        listed_folders = set(listing.folders)
+        gone_folders = [folder for folder in indexed.folders if folder not in listed_folders]
+        new_folders = listed_folders.difference(indexed.folders)
+
+        if changed:
+            self.put_objects(bucket, changed)
+        if removed:
+            self.remove_keys(bucket, removed)
+        for folder in gone_folders:
+            self.remove_tree(bucket, prefix + folder)
+        for folder in new_folders:
+            self.mark_stale(bucket, prefix + folder)
+        if changed or removed or gone_folders or new_folders:
+            logger.info(f"Index of s3://{bucket}/{prefix} updated: {len(changed)} changed, {len(removed)} removed, "
+                        f"{len(gone_folders)} folders gone, {len(new_folders)} new folders")
+
+    def search(self, bucket, text=None, pattern=None, min_size=None, max_size=None, after=None, before=None,
+               prefix=None, limit=1000):
+        """Return up to limit (key, size, mtime) rows under prefix matching every given filter"""
+        clause, params = self.range_clause(normalize_prefix(prefix))
+        clauses = [clause, "substr(key, -1) != '/'"]
+        params = [bucket] + params
+        if text:
+            clauses.append("instr(lower(key), ?) > 0")
+            params.append(text.lower())
+        if pattern:
+            clauses.append("(key GLOB ? OR key GLOB ?)")
+            params += [pattern, '*/' + pattern]
+        for column, op, value in (('size', '>=', min_size), ('size', '<=', max_size),
+                                  ('mtime', '>=', after), ('mtime', '<', before)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        params.append(limit)
+        sql = f"SELECT key, size, mtime FROM objects WHERE {' AND '.join(clauses)} ORDER BY key LIMIT ?"
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def stats(self, bucket):
+        """Return (object_count, total_bytes) indexed for bucket"""
+        with self.lock:
+            count, total = self.conn.execute(
+                "SELECT count(*), coalesce(sum(size), 0) FROM objects WHERE bucket = ?", (bucket,)).fetchone()
+        return count, total
+
+
+class IndexBuilder:
+    """Fills a MetadataIndex from parallel ShardedLister walks"""
+
+    def __init__(self, s3_client, index, max_workers=10, shard_depth=3, update_interval=0.5):
+        self.lister = ShardedLister(s3_client, max_workers, shard_depth)
+        self.index = index
+        self.update_interval = update_interval
+
+    def build(self, bucket, prefix, cancel_event=None, on_progress=None):
+        """(Re)index everything under bucket/prefix and return the number of keys listed
+
+        on_progress(count) is called from worker threads at most once every
+        update_interval seconds. A cancelled or failed build keeps the rows
+        it wrote but does not mark the prefix as indexed.
+        """
+        prefix = normalize_prefix(prefix)
+        run = time.time_ns()
+        lock = threading.Lock()
+        counter = [0, 0.0]  # keys listed, last progress update
+
+        def on_objects(shard, objects):
+            rows = [(obj['Key'], obj['Size'], obj['LastModified'].timestamp(), obj['ETag']) for obj in objects]
+            self.index.put_objects(bucket, rows, run)
+            with lock:
+                counter[0] += len(rows)
+                count = counter[0]
+                now = time.monotonic()
+                report = now - counter[1] >= self.update_interval
+                if report:
+                    counter[1] = now
+            if on_progress is not None and report:
+                on_progress(count)
+
+        logger.info(f"Indexing s3://{bucket}/{prefix}")
+        started = time.monotonic()
+        self.lister.walk(bucket, prefix, on_objects, cancel_event=cancel_event)
+        removed = self.index.finish_build(bucket, prefix, run)
+        logger.info(f"Indexed {counter[0]} keys of s3://{bucket}/{prefix} in {time.monotonic() - started:.1f}s "
+                    f"({removed} stale rows removed)")
+        return counter[0]
+
+    def refresh(self, bucket, cancel_event=None, on_progress=None):
+        """Re-list only the stale prefixes of bucket; return how many were refreshed"""
+        prefixes = self.index.stale_prefixes(bucket)
+        for prefix in prefixes:
+            self.build(bucket, prefix, cancel_event, on_progress)
+        return len(prefixes)
@@ -0,0 +1,429 @@
+import logging
+from array import array
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from s3_tasks import OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+# S3 never returns more than 1000 keys per list_objects_v2 call
+LIST_PAGE_SIZE = 1000
+
+
+def normalize_prefix(prefix):
+    """Return prefix with a trailing slash, or '' for the bucket root"""
+    if not prefix:
+        return ''
+    return prefix if prefix.endswith('/') else prefix + '/'
+
+
+class ListingPage:
+    """One page of a delimiter listing, relative to the listed prefix
+
+    Files are held column-wise (names, sizes, mtimes as POSIX timestamps)
+    rather than as the boto3 response dicts.
+    """
+    __slots__ = ('folders', 'names', 'sizes', 'mtimes', 'next_token')
+
+    def __init__(self, folders, names, sizes, mtimes, next_token=None):
+        self.folders = folders        # ['name/', ...]
+        self.names = names
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.next_token = next_token  # None on the last page
+
+
+def iter_listing_pages(s3_client, bucket, prefix, cancel_event=None, page_size=LIST_PAGE_SIZE,
+                       start_token=None):
+    """Yield ListingPage objects for one folder level of bucket/prefix
+
+    Uses a list_objects_v2 paginator with Delimiter='/', so sub-folders come
+    back as CommonPrefixes instead of every key in the subtree. Iteration
+    stops before the next request once cancel_event is set. Pass the
+    next_token of an earlier page as start_token to continue from there.
+    """
+    prefix = normalize_prefix(prefix)
+    kwargs = {
+        'Bucket': bucket,
+        'Delimiter': '/',
+        'PaginationConfig': {'PageSize': page_size},
+    }
+    if prefix:
+        kwargs['Prefix'] = prefix
+    if start_token:
+        kwargs['PaginationConfig']['StartingToken'] = start_token
+
+    logger.info(f"Paginating list_objects_v2 for s3://{bucket}/{prefix}")
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**kwargs):
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info(f"Listing of s3://{bucket}/{prefix} cancelled")
+            return
+
+        folders = [p['Prefix'][len(prefix):] for p in page.get('CommonPrefixes', ())]
+        names = []
+        sizes = array('q')
+        mtimes = array('d')
+        for obj in page.get('Contents', ()):
+            name = obj['Key'][len(prefix):]
+            if name:  # Skip the folder placeholder object itself
+                names.append(name)
+                sizes.append(obj['Size'])
+                mtimes.append(obj['LastModified'].timestamp())
+
+        yield ListingPage(folders, names, sizes, mtimes, page.get('NextContinuationToken'))
+
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info(f"Listing of s3://{bucket}/{prefix} cancelled")
+            return
+
+
+def iter_prefix_objects(s3_client, bucket, prefix, cancel_event=None, page_size=LIST_PAGE_SIZE):
+    """Yield the object dicts of every key under bucket/prefix, recursively
+
+    No delimiter is used, so this walks the whole subtree in key order one
+    page at a time; callers can start working on the first keys while later
+    pages are still being fetched.
+    """
+    kwargs = {'Bucket': bucket, 'PaginationConfig': {'PageSize': page_size}}
+    if prefix:
+        kwargs['Prefix'] = prefix
+
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**kwargs):
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info(f"Recursive listing of s3://{bucket}/{prefix} cancelled")
+            return
+        yield from page.get('Contents', ())
+
+
+class ListingResult:
+    """Accumulated pages of one folder listing, stored column-wise
+
+    Sizes and mtimes live in typed arrays, so a file costs its name plus
+    16 bytes instead of a response dict per object.
+    """
+    __slots__ = ('folders', 'names', 'sizes', 'mtimes', 'next_token')
+
+    def __init__(self):
+        self.folders = []
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes = array('d')
+        self.next_token = None
+
+    @property
+    def complete(self):
+        return self.next_token is None
+
+    def __len__(self):
+        return len(self.folders) + len(self.names)
+
+    def add_page(self, page):
+        self.folders.extend(page.folders)
+        self.names.extend(page.names)
+        self.sizes.extend(page.sizes)
+        self.mtimes.extend(page.mtimes)
+        self.next_token = page.next_token
+
+    def as_page(self):
+        """Return the whole result as a single ListingPage"""
+        return ListingPage(self.folders, self.names, self.sizes, self.mtimes, self.next_token)
+
+
+class ListingCache:
+    """In-memory cache of folder listings keyed by (bucket, prefix)
+
+    Entries expire after ttl seconds. Once the cached listings hold more
+    than max_rows folders and files in total, the least recently used
+    listings are evicted. Safe to use from worker threads.
+    """
+
+    def __init__(self, ttl=300, max_rows=200000):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.entries = OrderedDict()  # (bucket, prefix) -> (stored_at, ListingResult)
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, bucket, prefix):
+        """Return the cached ListingResult for bucket/prefix, or None"""
+        key = (bucket, normalize_prefix(prefix))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, bucket, prefix, result):
+        key = (bucket, normalize_prefix(prefix))
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic(), result)
+            self.rows += len(result)
+            while self.rows > self.max_rows and len(self.entries) > 1:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def contains(self, bucket, prefix):
+        """Return True if bucket/prefix is cached, without touching the counters"""
+        key = (bucket, normalize_prefix(prefix))
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl
+
+    def invalidate(self, bucket, prefix):
+        """Forget the listing of one folder"""
+        key = (bucket, normalize_prefix(prefix))
+        with self.lock:
+            if key in self.entries:
+                logger.debug(f"Invalidating cached listing of s3://{bucket}/{key[1]}")
+                self._drop(key)
+
+    def invalidate_key(self, bucket, object_key, removed=False):
+        """Forget listings made stale by writing or deleting object_key
+
+        The parent folder always changes. A parent listing that already
+        shows the child folder stays valid after an upload, but a delete may
+        empty a folder, so every ancestor is dropped in that case.
+        """
+        parts = object_key.split('/')[:-1]
+        self.invalidate(bucket, '/'.join(parts))
+        with self.lock:
+            for depth in range(len(parts) - 1, -1, -1):
+                key = (bucket, normalize_prefix('/'.join(parts[:depth])))
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if removed or parts[depth] + '/' not in entry[1].folders:
+                    logger.debug(f"Invalidating cached listing of s3://{bucket}/{key[1]}")
+                    self._drop(key)
+
+    def invalidate_tree(self, bucket, prefix):
+        """Forget a folder, everything cached beneath it, and stale ancestors"""
+        prefix = normalize_prefix(prefix)
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == bucket and k[1].startswith(prefix)]:
+                self._drop(key)
+        if prefix:
+            self.invalidate_key(bucket, prefix)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.rows = 0
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'listings': len(self.entries),
+                'rows': self.rows,
+            }
+
+    def _drop(self, key):
+        stored_at, result = self.entries.pop(key)
+        self.rows -= len(result)
+
+
+class ListingPrefetcher:
+    """Warms a ListingCache with the first page of child folder listings
+
+    Runs on its own small pool so it never takes a foreground worker, and
+    waits while is_busy() reports foreground work so it does not compete
+    with it for connections. Each prefetch() call supersedes the previous
+    batch.
+    """
+
+    def __init__(self, s3_client, cache, max_workers=2, max_folders=20, is_busy=None, backoff=0.25):
+        self.s3_client = s3_client
+        self.cache = cache
+        self.max_folders = max_folders
+        self.is_busy = is_busy or (lambda: False)
+        self.backoff = backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-prefetch')
+        self.generation = 0
+        self.fetched = 0
+
+    def prefetch(self, bucket, prefix, folders):
+        """Queue first-page listings for up to max_folders of the child folders"""
+        self.generation += 1
+        generation = self.generation
+        prefix = normalize_prefix(prefix)
+        for folder in folders[:self.max_folders]:
+            self.executor.submit(self.fetch, generation, bucket, prefix + folder)
+
+    def cancel(self):
+        """Drop every queued prefetch"""
+        self.generation += 1
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
+
+    def fetch(self, generation, bucket, prefix):
+        # Back off while foreground operations or transfers are running
+        while self.is_busy():
+            if generation != self.generation:
+                return
+            time.sleep(self.backoff)
+        if generation != self.generation or self.cache.contains(bucket, prefix):
+            return
+
+        try:
+            page = next(iter_listing_pages(self.s3_client, bucket, prefix), None)
+        except Exception as e:
+            # Prefetching is best effort; the foreground listing reports errors
+            logger.debug(f"Prefetch of s3://{bucket}/{prefix} failed: {e}")
+            return
+
+        if page is not None and generation == self.generation:
+            result = ListingResult()
+            result.add_page(page)
+            self.cache.put(bucket, prefix, result)
+            self.fetched += 1
+            logger.debug(f"Prefetched {len(result)} entries of s3://{bucket}/{prefix}")
+
+
+class ListingShard:
+    """One prefix of a ShardedLister walk
+
+    pending counts its own listing plus unfinished child shards; data is
+    whatever the caller's make_data returned for it.
+    """
+    __slots__ = ('prefix', 'parent', 'depth', 'pending', 'data')
+
+    def __init__(self, prefix, parent, depth):
+        self.prefix = prefix
+        self.parent = parent
+        self.depth = depth
+        self.pending = 1
+        self.data = None
+
+
+class ShardedLister:
+    """Lists everything under a prefix with many list_objects_v2 calls in flight
+
+    Sub-folders are discovered with delimiter listings down to shard_depth
+    levels below the starting prefix, and every folder found becomes a
+    shard listed on the worker pool. A shard at shard_depth lists its whole
+    subtree without a delimiter.
+    """
+
+    def __init__(self, s3_client, max_workers=10, shard_depth=3):
+        self.s3_client = s3_client
+        self.max_workers = max_workers
+        self.shard_depth = shard_depth
+
+    def walk(self, bucket, prefix, on_objects, on_done=None, skip=None, make_data=None, folders=None,
+             cancel_event=None):
+        """List bucket/prefix in parallel shards and return the root ListingShard
+
+        on_objects(shard, objects) receives the object dicts of each page as
+        it arrives, on worker threads. on_done(shard) is called once a shard
+        and all of its sub-shards are finished, children before parents.
+        skip(shard) may return True to leave a shard (and its subtree)
+        unlisted. With folders (names like 'photos/') only those sub-folders
+        of prefix are walked. Raises OperationCancelled if cancel_event was
+        set, or the first listing error.
+        """
+        prefix = normalize_prefix(prefix)
+        lock = threading.Lock()
+        stop = threading.Event()
+        done = threading.Event()
+        errors = []
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='s3-walk')
+
+        def new_shard(shard_prefix, parent):
+            shard = ListingShard(shard_prefix, parent, parent.depth + 1 if parent else 0)
+            if make_data is not None:
+                shard.data = make_data(shard)
+            return shard
+
+        def finish(shard):
+            finished = []
+            with lock:
+                while shard is not None:
+                    shard.pending -= 1
+                    if shard.pending:
+                        break
+                    finished.append(shard)
+                    shard = shard.parent
+            if on_done is not None:
+                for shard in finished:
+                    on_done(shard)
+            if finished and finished[-1] is root:
+                done.set()
+
+        def spawn(parent, name):
+            shard = new_shard(parent.prefix + name, parent)
+            with lock:
+                parent.pending += 1
+            executor.submit(visit, shard)
+
+        def pages(shard, delimiter):
+            kwargs = {'Bucket': bucket, 'PaginationConfig': {'PageSize': LIST_PAGE_SIZE}}
+            if shard.prefix:
+                kwargs['Prefix'] = shard.prefix
+            if delimiter:
+                kwargs['Delimiter'] = '/'
+            for page in self.s3_client.get_paginator('list_objects_v2').paginate(**kwargs):
+                if stop.is_set():
+                    return
+                yield page
+
+        def visit(shard):
+            try:
+                if stop.is_set():
+                    return
+                if shard is root or skip is None or not skip(shard):
+                    delimiter = shard.depth < self.shard_depth
+                    for page in pages(shard, delimiter):
+                        on_objects(shard, page.get('Contents', ()))
+                        if delimiter:
+                            for common in page.get('CommonPrefixes', ()):
+                                spawn(shard, common['Prefix'][len(shard.prefix):])
+                if not stop.is_set():
+                    finish(shard)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+                done.set()
+
+        root = new_shard(prefix, None)
+        try:
+            if folders is None:
+                executor.submit(visit, root)
+            else:
+                for name in folders:
+                    spawn(root, normalize_prefix(name))
+                finish(root)
+            while not done.wait(0.1):
+                if cancel_event is not None and cancel_event.is_set():
+                    stop.set()
+                    break
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if errors:
+            raise errors[0]
+        if cancel_event is not None and cancel_event.is_set():
+            raise OperationCancelled(f"listing of s3://{bucket}/{prefix}")
+        return root
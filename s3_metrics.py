@@ -0,0 +1,257 @@
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from s3_tasks import find_cancellation
+
+logger = logging.getLogger(__name__)
+# Per-call trace lines; only written for the sampled fraction of calls
+trace_logger = logging.getLogger('s3.trace')
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Error codes S3 uses to ask clients to slow down
+THROTTLE_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests',
+                  'RequestThrottled', 'ServiceUnavailable', '503')
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, cheap enough to update on every call"""
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # The last bucket is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding quantile q (None when empty)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class OperationStats:
+    __slots__ = ('calls', 'errors', 'retries', 'throttles', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = {}  # error code -> count
+        self.retries = 0
+        self.throttles = 0
+        self.latency = LatencyHistogram()
+
+
+class TransferStats:
+    __slots__ = ('runs', 'files', 'bytes', 'seconds', 'failures')
+
+    def __init__(self):
+        self.runs = 0
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.failures = 0
+
+
+class Metrics:
+    """Counters for every S3 API call and bulk transfer made by this process
+
+    instrument() hooks a client's botocore events, so each call is timed
+    and counted per operation without touching the code that makes it.
+    Retries come from the response metadata and throttling from the retry
+    checks. With trace_sample > 0 that fraction of calls is also logged to
+    the 's3.trace' logger with its key, status and latency.
+    """
+
+    def __init__(self, trace_sample=0.0):
+        self.trace_sample = trace_sample
+        if trace_sample:
+            trace_logger.setLevel(logging.DEBUG)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}  # operation name -> OperationStats
+            self.transfers = {}   # 'upload' / 'download' / 'delete' ... -> TransferStats
+            self.started = time.time()
+
+    def instrument(self, client):
+        """Record the calls made through a boto3 client (safe to call twice)"""
+        events = client.meta.events
+        events.register('before-parameter-build.s3', self.before_call, unique_id='s3-metrics-before')
+        events.register('after-call.s3', self.after_call, unique_id='s3-metrics-after')
+        events.register('after-call-error.s3', self.after_call_error, unique_id='s3-metrics-error')
+        events.register('needs-retry.s3', self.on_needs_retry, unique_id='s3-metrics-retry')
+
+    def stats_for(self, operation):
+        stats = self.operations.get(operation)
+        if stats is None:
+            stats = self.operations[operation] = OperationStats()
+        return stats
+
+    def before_call(self, params, model, context, **kwargs):
+        context['metrics_started'] = time.monotonic()
+        context['metrics_operation'] = model.name
+        if self.trace_sample:
+            context['metrics_key'] = params.get('Key') or params.get('Prefix')
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        started = context.get('metrics_started')
+        if started is None:
+            return
+        seconds = time.monotonic() - started
+        error = parsed.get('Error', {}).get('Code')
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        self.record_call(model.name, seconds, retries, error)
+        if self.trace_sample and (self.trace_sample >= 1 or random.random() < self.trace_sample):
+            trace_logger.debug(f"{model.name} {context.get('metrics_key') or ''} "
+                               f"-> {http_response.status_code} in {seconds * 1000:.1f} ms ({retries} retries)")
+
+    def after_call_error(self, exception, context, **kwargs):
+        # Raised before any response, e.g. connection errors; the operation name is not passed here
+        started = context.get('metrics_started')
+        if started is not None:
+            # A paused or cancelled transfer stopping its own request is not an error
+            error = None if find_cancellation(exception) is not None else type(exception).__name__
+            self.record_call(context.get('metrics_operation', 'Unknown'), time.monotonic() - started, 0, error)
+
+    def on_needs_retry(self, response=None, operation=None, **kwargs):
+        # Observes every attempt; returning None leaves the retry decision to botocore
+        if response is None or operation is None:
+            return None
+        http_response, parsed = response
+        code = parsed.get('Error', {}).get('Code')
+        if http_response.status_code in (429, 503) or code in THROTTLE_CODES:
+            with self.lock:
+                self.stats_for(operation.name).throttles += 1
+        return None
+
+    def record_call(self, operation, seconds, retries=0, error=None):
+        with self.lock:
+            stats = self.stats_for(operation)
+            stats.calls += 1
+            stats.retries += retries
+            stats.latency.observe(seconds)
+            if error:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+
+    def record_transfer(self, kind, files, bytes, seconds, failures=0):
+        with self.lock:
+            stats = self.transfers.get(kind)
+            if stats is None:
+                stats = self.transfers[kind] = TransferStats()
+            stats.runs += 1
+            stats.files += files
+            stats.bytes += bytes
+            stats.seconds += seconds
+            stats.failures += failures
+
+    def record_progress(self, kind, progress):
+        """Record a finished (or stopped) bulk operation from its TransferProgress"""
+        self.record_transfer(kind, progress.files_done, progress.bytes_done, progress.elapsed, len(progress.failures))
+
+    def snapshot(self):
+        """Return every counter as plain data (what to_json writes)"""
+        with self.lock:
+            operations = {}
+            for name, stats in sorted(self.operations.items()):
+                latency = stats.latency
+                operations[name] = {
+                    'calls': stats.calls,
+                    'errors': dict(stats.errors),
+                    'retries': stats.retries,
+                    'throttles': stats.throttles,
+                    'latency_seconds': {
+                        'sum': latency.total,
+                        'p50': latency.quantile(0.5),
+                        'p90': latency.quantile(0.9),
+                        'p99': latency.quantile(0.99),
+                        'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], latency.counts)),
+                    },
+                }
+            transfers = {
+                kind: {
+                    'runs': stats.runs,
+                    'files': stats.files,
+                    'bytes': stats.bytes,
+                    'seconds': stats.seconds,
+                    'failures': stats.failures,
+                    'bytes_per_second': stats.bytes / stats.seconds if stats.seconds else 0.0,
+                }
+                for kind, stats in sorted(self.transfers.items())
+            }
+            return {
+                'started': self.started,
+                'uptime_seconds': time.time() - self.started,
+                'operations': operations,
+                'transfers': transfers,
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Return the counters in the Prometheus text exposition format"""
+        data = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        operations = data['operations']
+        metric('s3_client_requests_total', 'counter', "S3 API calls by operation",
+               [({'operation': op}, s['calls']) for op, s in operations.items()])
+        metric('s3_client_request_errors_total', 'counter', "S3 API calls that failed, by error code",
+               [({'operation': op, 'code': code}, n) for op, s in operations.items() for code, n in s['errors'].items()])
+        metric('s3_client_retries_total', 'counter', "Retried attempts by operation",
+               [({'operation': op}, s['retries']) for op, s in operations.items()])
+        metric('s3_client_throttles_total', 'counter', "Attempts throttled by S3 (SlowDown, 503)",
+               [({'operation': op}, s['throttles']) for op, s in operations.items()])
+
+        lines.append("# HELP s3_client_request_duration_seconds S3 API call latency")
+        lines.append("# TYPE s3_client_request_duration_seconds histogram")
+        for op, s in operations.items():
+            cumulative = 0
+            for bound, count in s['latency_seconds']['buckets'].items():
+                cumulative += count
+                lines.append(f's3_client_request_duration_seconds_bucket{{operation="{op}",le="{bound}"}} {cumulative}')
+        lines += [f's3_client_request_duration_seconds_sum{{operation="{op}"}} {s["latency_seconds"]["sum"]}'
+                  for op, s in operations.items()]
+        lines += [f's3_client_request_duration_seconds_count{{operation="{op}"}} {s["calls"]}'
+                  for op, s in operations.items()]
+
+        transfers = data['transfers']
+        for field, help_text in (('bytes', "Bytes moved by bulk operations"),
+                                 ('files', "Files or keys handled by bulk operations"),
+                                 ('seconds', "Time spent in bulk operations"),
+                                 ('failures', "Files or keys that failed in bulk operations")):
+            metric(f's3_client_transfer_{field}_total', 'counter', help_text,
+                   [({'kind': kind}, t[field]) for kind, t in transfers.items()])
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        """Write the counters to path: Prometheus text for .prom/.txt, JSON otherwise"""
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        logger.info(f"Metrics written to {path}")
@@ -0,0 +1,176 @@
+import codecs
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from s3_tasks import OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+KB = 1024
+
+# Rendered by Tk itself; anything else in IMAGE_EXTENSIONS needs Pillow
+TK_IMAGE_EXTENSIONS = ('.png', '.gif', '.ppm', '.pgm')
+IMAGE_EXTENSIONS = TK_IMAGE_EXTENSIONS + ('.jpg', '.jpeg', '.bmp', '.webp', '.tif', '.tiff')
+
+HEX_WIDTH = 16
+
+
+class ObjectHandle:
+    """What a HeadObject returned for an object being previewed
+
+    Ranged reads send IfMatch with the ETag, so a preview never mixes bytes
+    of two versions of the object; the ETag is also part of the cache key.
+    """
+    __slots__ = ('bucket', 'key', 'size', 'etag', 'content_type')
+
+    def __init__(self, bucket, key, size, etag, content_type=''):
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.content_type = content_type or ''
+
+    @property
+    def is_image(self):
+        return (self.content_type.startswith('image/')
+                or os.path.splitext(self.key)[1].lower() in IMAGE_EXTENSIONS)
+
+
+class ChunkCache:
+    """LRU cache of fixed-size object chunks, bounded by total bytes
+
+    Keys are (bucket, key, etag, chunk_index). Safe to use from worker
+    threads.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * KB):
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.chunks.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.chunks.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.chunks.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self.chunks[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                evicted_key, evicted = self.chunks.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'bytes': self.bytes, 'chunks': len(self.chunks)}
+
+
+class RangeReader:
+    """Reads byte ranges of objects with ranged GETs, through a ChunkCache
+
+    Ranges are split into chunk_size chunks. Chunks already cached are not
+    fetched again, and each run of consecutive missing chunks is fetched
+    with a single request.
+    """
+
+    def __init__(self, s3_client, cache, chunk_size=64 * KB):
+        self.s3_client = s3_client
+        self.cache = cache
+        self.chunk_size = chunk_size
+
+    def open(self, bucket, key):
+        head = self.s3_client.head_object(Bucket=bucket, Key=key)
+        return ObjectHandle(bucket, key, head['ContentLength'], head['ETag'], head.get('ContentType'))
+
+    def read(self, handle, start, length, cancel_event=None):
+        """Return up to length bytes of the object from offset start"""
+        end = min(start + length, handle.size)
+        if start >= end:
+            return b''
+        size = self.chunk_size
+        first, last = start // size, (end - 1) // size
+
+        chunks = {}
+        missing = []
+        for index in range(first, last + 1):
+            data = self.cache.get((handle.bucket, handle.key, handle.etag, index))
+            if data is None:
+                missing.append(index)
+            else:
+                chunks[index] = data
+
+        for run_first, run_last in self.runs(missing):
+            if cancel_event is not None and cancel_event.is_set():
+                raise OperationCancelled(f"preview of s3://{handle.bucket}/{handle.key}")
+            range_start = run_first * size
+            range_end = min((run_last + 1) * size, handle.size) - 1
+            logger.debug(f"GET s3://{handle.bucket}/{handle.key} bytes {range_start}-{range_end}")
+            body = self.s3_client.get_object(Bucket=handle.bucket, Key=handle.key, IfMatch=handle.etag,
+                                             Range=f'bytes={range_start}-{range_end}')['Body'].read()
+            for index in range(run_first, run_last + 1):
+                data = body[(index - run_first) * size:(index - run_first + 1) * size]
+                self.cache.put((handle.bucket, handle.key, handle.etag, index), data)
+                chunks[index] = data
+
+        data = b''.join(chunks[index] for index in range(first, last + 1))
+        offset = start - first * size
+        return data[offset:offset + end - start]
+
+    @staticmethod
+    def runs(indexes):
+        """Group sorted chunk indexes into (first, last) runs of consecutive values"""
+        runs = []
+        for index in indexes:
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        return runs
+
+
+def detect_encoding(sample):
+    """Return 'utf-8' or 'latin-1' for text, or None if sample looks binary"""
+    if b'\0' in sample:
+        return None
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the end of the sample is still UTF-8
+        if e.start >= len(sample) - 3 and e.reason == 'unexpected end of data':
+            return 'utf-8'
+    # Legacy 8-bit text has almost no control characters besides tab and newlines
+    control = sum(1 for b in sample if b < 32 and b not in (9, 10, 12, 13))
+    return 'latin-1' if control <= len(sample) // 100 else None
+
+
+def text_decoder(encoding):
+    """Return an incremental decoder, so characters split across ranges decode correctly"""
+    return codecs.getincrementaldecoder(encoding)(errors='replace')
+
+
+def hexdump(data, offset):
+    """Format data read from offset as hex dump lines (offset, hex bytes, ASCII)"""
+    lines = []
+    for i in range(0, len(data), HEX_WIDTH):
+        row = data[i:i + HEX_WIDTH]
+        hex_part = ' '.join(f'{b:02x}' for b in row)
+        text_part = ''.join(chr(b) if 32 <= b < 127 else '.' for b in row)
+        lines.append(f'{offset + i:010x}  {hex_part:<{HEX_WIDTH * 3}} {text_part}\n')
+    return ''.join(lines)
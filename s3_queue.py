@@ -0,0 +1,661 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from s3_bulk import MAX_PARTS, MB, BulkDownloader
+from s3_sync import DOWNLOAD, UPLOAD
+from s3_tasks import OperationCancelled, find_cancellation
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'Queued'
+RUNNING = 'Running'
+PAUSED = 'Paused'
+DONE = 'Done'
+FAILED = 'Failed'
+CANCELLED = 'Cancelled'
+
+# Jobs in these states are written to the journal; the rest only live until cleared
+UNFINISHED = (QUEUED, RUNNING, PAUSED, FAILED)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def describe_error(e):
+    """Short text for a job's error column; ClientErrors as 'Code: Message'"""
+    if isinstance(e, ClientError):
+        return f"{e.response['Error'].get('Code')}: {e.response['Error'].get('Message')}"
+    return str(e) or type(e).__name__
+
+
+class TokenBucket:
+    """Bandwidth cap of rate bytes per second shared by every thread consuming from it
+
+    Up to one second of unused allowance is saved up as a burst. Consumers
+    that overdraw sleep off the debt, so the total stays at rate however
+    many of them there are. A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+            self.updated = time.monotonic()
+
+    def consume(self, amount, stop_event=None):
+        """Take amount bytes of allowance, sleeping as long as the cap requires"""
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate
+
+        # Short sleeps so a pause or a raised limit takes effect right away
+        deadline = time.monotonic() + wait
+        while self.rate and wait > 0:
+            if stop_event is not None and stop_event.wait(min(wait, 0.1)):
+                raise OperationCancelled("transfer")
+            if stop_event is None:
+                time.sleep(min(wait, 0.1))
+            wait = deadline - time.monotonic()
+
+
+class PartReader:
+    """File-like window onto length bytes of a local file at offset, throttled by a TokenBucket
+
+    botocore may read a body more than once (payload signing, retries), so
+    only bytes past the furthest point read so far wait for the bucket and
+    are reported to on_bytes.
+    """
+
+    def __init__(self, path, offset, length, bandwidth, stop_event, on_bytes):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.length = length
+        self.bandwidth = bandwidth
+        self.stop_event = stop_event
+        self.on_bytes = on_bytes
+        self.position = 0
+        self.furthest = 0
+
+    def read(self, size=-1):
+        if self.stop_event.is_set():
+            raise OperationCancelled(self.file.name)
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        new = self.position + size - self.furthest
+        if new > 0:
+            self.bandwidth.consume(new, self.stop_event)
+        self.file.seek(self.offset + self.position)
+        data = self.file.read(size)
+        self.position += len(data)
+        if self.position > self.furthest:
+            self.on_bytes(self.position - self.furthest)
+            self.furthest = self.position
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.position, os.SEEK_END: self.length}[whence]
+        self.position = max(0, min(self.length, base + offset))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TransferJob:
+    """One queued upload or download, with everything needed to resume it after a restart"""
+
+    FIELDS = ('id', 'kind', 'bucket', 'key', 'local_path', 'size', 'priority', 'state', 'error',
+              'bytes_done', 'etag', 'mtime', 'upload_id', 'part_size', 'parts')
+
+    def __init__(self, id, kind, bucket, key, local_path, size=0, priority=0):
+        self.id = id
+        self.kind = kind
+        self.bucket = bucket
+        self.key = key
+        self.local_path = local_path
+        self.size = size
+        self.priority = priority
+        self.state = QUEUED
+        self.error = None
+        self.bytes_done = 0
+        self.etag = None       # Download: ETag of the object the part file holds pieces of
+        self.mtime = None      # Upload: modification time of the file its parts were read from
+        self.upload_id = None  # Upload: the multipart upload the parts belong to
+        self.part_size = None
+        self.parts = []        # Part numbers (from 1) already transferred
+        # Only meaningful while a worker runs the job
+        self.busy = False
+        self.stop_event = threading.Event()
+        self.started = None
+        self.bytes_at_start = 0
+
+    def check_stopped(self):
+        """Raise OperationCancelled once the job has been paused, cancelled or shut down"""
+        if self.stop_event.is_set():
+            raise OperationCancelled(self.name)
+
+    @property
+    def name(self):
+        if self.kind == UPLOAD:
+            return f"Upload {self.local_path} -> s3://{self.bucket}/{self.key}"
+        return f"Download s3://{self.bucket}/{self.key} -> {self.local_path}"
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started if self.started else 0.0
+
+    def throughput(self):
+        """Bytes per second moved by the current run"""
+        elapsed = self.elapsed
+        return (self.bytes_done - self.bytes_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def part_range(self, number):
+        """Return (offset, length) of part number (from 1)"""
+        start = (number - 1) * self.part_size
+        return start, min(self.part_size, self.size - start)
+
+    def part_count(self):
+        return -(-self.size // self.part_size)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['id'], data['kind'], data['bucket'], data['key'], data['local_path'])
+        for field in cls.FIELDS:
+            if field in data:
+                setattr(job, field, data[field])
+        return job
+
+
+class QueueJournal:
+    """The transfer queue as one JSON file, rewritten on every change
+
+    Each save goes to a temporary file that is then renamed over the old
+    one, so a crash leaves the previous or the new queue, never a torn one.
+    An empty path keeps the queue in memory only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Return (paused, job dicts) from the last save"""
+        if not self.path or not os.path.exists(self.path):
+            return False, []
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            return data.get('paused', False), data.get('jobs', [])
+        except (OSError, ValueError) as e:
+            logger.warning(f"Transfer queue {self.path} unreadable, starting empty: {e}")
+            return False, []
+
+    def save(self, paused, jobs):
+        if not self.path:
+            return
+        temp_path = self.path + '.tmp'
+        with self.lock:
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'paused': paused, 'jobs': jobs}, f)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not save transfer queue to {self.path}: {e}")
+
+
+class TransferManager:
+    """Persistent queue of single-file uploads and downloads
+
+    Jobs run highest priority first, then in queue order, at most
+    max_active at a time, each moving part_workers parts at once. All of
+    them draw from one TokenBucket, so the queue as a whole stays under the
+    bandwidth limit. The queue is journaled after every change and every
+    finished part; start() picks up what an earlier run left, continuing
+    multipart uploads by their UploadId and downloads from their part file.
+
+    on_finished(job) is called on the job's worker thread when it is done.
+    """
+
+    def __init__(self, s3_client, journal_path, max_active=2, bandwidth=0, part_size=8 * MB,
+                 multipart_threshold=8 * MB, part_workers=4):
+        self.s3_client = s3_client
+        self.journal = QueueJournal(journal_path)
+        self.max_active = max_active
+        self.bandwidth = TokenBucket(bandwidth)
+        self.part_size = part_size
+        self.multipart_threshold = multipart_threshold
+        self.part_workers = part_workers
+        self.jobs = []  # Queue order; ordered() applies priorities on top
+        self.active = 0
+        self.paused = False
+        self.started = False
+        self.closed = False
+        self.next_id = 1
+        self.on_finished = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Load the journal and start running queued jobs"""
+        paused, records = self.journal.load()
+        with self.lock:
+            self.paused = paused
+            for record in records:
+                job = TransferJob.from_dict(record)
+                if job.state == RUNNING:
+                    job.state = QUEUED
+                self.jobs.append(job)
+                self.next_id = max(self.next_id, job.id + 1)
+            self.started = True
+        if records:
+            logger.info(f"Resuming transfer queue: {len(records)} unfinished jobs")
+        self.schedule()
+
+    def add_upload(self, local_path, bucket, key, priority=0):
+        return self.add(UPLOAD, bucket, key, local_path, os.path.getsize(local_path), priority)
+
+    def add_download(self, bucket, key, local_path, size=0, priority=0):
+        return self.add(DOWNLOAD, bucket, key, local_path, size, priority)
+
+    def add(self, kind, bucket, key, local_path, size, priority):
+        with self.lock:
+            job = TransferJob(self.next_id, kind, bucket, key, local_path, size, priority)
+            self.next_id += 1
+            self.jobs.append(job)
+        logger.info(f"Queued transfer: {job.name}")
+        self.save()
+        self.schedule()
+        return job
+
+    def ordered(self):
+        """Return jobs in the order they run: by priority, then queue position"""
+        with self.lock:
+            return sorted(self.jobs, key=lambda job: -job.priority)
+
+    def find(self, job_id):
+        for job in self.jobs:
+            if job.id == job_id:
+                return job
+        raise KeyError(job_id)
+
+    def pause(self, job_id):
+        with self.lock:
+            job = self.find(job_id)
+            if job.state not in (QUEUED, RUNNING):
+                return
+            job.state = PAUSED
+            job.stop_event.set()
+        self.save()
+
+    def resume(self, job_id):
+        """Queue a paused or failed job again; it continues from its last finished part"""
+        with self.lock:
+            job = self.find(job_id)
+            if job.state not in (PAUSED, FAILED):
+                return
+            job.state = QUEUED
+            job.error = None
+        self.save()
+        self.schedule()
+
+    def cancel(self, job_id):
+        """Stop a job and throw away its partial upload or download"""
+        with self.lock:
+            job = self.find(job_id)
+            if job.state in (DONE, CANCELLED):
+                return
+            job.state = CANCELLED
+            job.stop_event.set()
+            idle = not job.busy
+        self.save()
+        if idle:
+            # Aborting a multipart upload is a request; keep it off the caller's thread
+            threading.Thread(target=self.discard, args=(job,), name='s3-queue-discard', daemon=True).start()
+
+    def set_priority(self, job_id, priority):
+        with self.lock:
+            self.find(job_id).priority = priority
+        self.save()
+
+    def move(self, job_id, offset):
+        """Move a job offset places in the run order, taking the priority of the job it passes"""
+        order = self.ordered()
+        with self.lock:
+            job = self.find(job_id)
+            index = order.index(job)
+            target = max(0, min(len(order) - 1, index + offset))
+            if target == index:
+                return
+            neighbour = order[target]
+            job.priority = neighbour.priority
+            self.jobs.remove(job)
+            position = self.jobs.index(neighbour)
+            self.jobs.insert(position if offset < 0 else position + 1, job)
+        self.save()
+
+    def pause_all(self):
+        """Hold the whole queue; running jobs stop and start again on resume_all()"""
+        with self.lock:
+            self.paused = True
+            for job in self.jobs:
+                if job.state == RUNNING:
+                    job.state = QUEUED
+                    job.stop_event.set()
+        self.save()
+
+    def resume_all(self):
+        with self.lock:
+            self.paused = False
+        self.save()
+        self.schedule()
+
+    def set_bandwidth(self, rate):
+        """Cap the queue at rate bytes per second (0 for no limit)"""
+        self.bandwidth.set_rate(rate)
+
+    def set_max_active(self, max_active):
+        with self.lock:
+            self.max_active = max(1, max_active)
+        self.schedule()
+
+    def clear_finished(self):
+        """Forget done and cancelled jobs"""
+        with self.lock:
+            self.jobs = [job for job in self.jobs if job.state not in (DONE, CANCELLED) or job.busy]
+
+    def is_busy(self):
+        """Return True while any job is running (safe from any thread)"""
+        return self.active > 0
+
+    def counts(self):
+        """Return {state: number of jobs}"""
+        counts = {}
+        with self.lock:
+            for job in self.jobs:
+                counts[job.state] = counts.get(job.state, 0) + 1
+        return counts
+
+    def shutdown(self):
+        """Stop running jobs where they are; the next start() resumes them"""
+        with self.lock:
+            self.closed = True
+            for job in self.jobs:
+                if job.state == RUNNING:
+                    job.stop_event.set()
+        self.save()
+
+    def save(self):
+        with self.lock:
+            paused = self.paused
+            records = [job.to_dict() for job in self.jobs if job.state in UNFINISHED]
+        self.journal.save(paused, records)
+
+    def add_bytes(self, job, amount):
+        with self.lock:
+            job.bytes_done += amount
+
+    def schedule(self):
+        """Start the next jobs in run order while there are free slots"""
+        order = self.ordered()
+        with self.lock:
+            if not self.started or self.closed or self.paused:
+                return
+            for job in order:
+                if self.active >= self.max_active:
+                    break
+                if job.state != QUEUED or job.busy:
+                    continue
+                job.state = RUNNING
+                job.busy = True
+                job.stop_event = threading.Event()
+                self.active += 1
+                threading.Thread(target=self.run, args=(job,), name=f's3-queue-{job.id}', daemon=True).start()
+
+    def run(self, job):
+        job.started = time.monotonic()
+        job.bytes_at_start = job.bytes_done
+        logger.info(f"Starting transfer: {job.name}")
+        try:
+            if job.kind == UPLOAD:
+                self.run_upload(job)
+            else:
+                self.run_download(job)
+        except Exception as e:
+            if find_cancellation(e) is not None:
+                # Paused, cancelled or shutting down: whoever stopped the job has set its state
+                logger.info(f"Transfer stopped ({job.state}): {job.name}")
+            else:
+                logger.warning(f"Transfer failed: {job.name}: {e}")
+                with self.lock:
+                    if job.state == RUNNING:
+                        job.state = FAILED
+                        job.error = describe_error(e)
+        else:
+            with self.lock:
+                job.state = DONE
+                job.bytes_done = job.size
+            logger.info(f"Finished transfer in {job.elapsed:.1f}s: {job.name}")
+        finally:
+            if job.state == CANCELLED:
+                self.discard(job)
+            with self.lock:
+                job.busy = False
+                self.active -= 1
+            self.save()
+            self.schedule()
+
+        if job.state == DONE and self.on_finished:
+            try:
+                self.on_finished(job)
+            except Exception as e:
+                logger.error(f"Finish callback for {job.name} failed: {e}", exc_info=True)
+
+    def run_parts(self, job, numbers, transfer_part):
+        """Call transfer_part(number) for every part number, part_workers at once
+
+        Stops handing out parts at the first error or when the job is stopped.
+        """
+        numbers = iter(numbers)
+        numbers_lock = threading.Lock()
+        errors = []
+
+        def worker():
+            while not errors and not job.stop_event.is_set():
+                with numbers_lock:
+                    number = next(numbers, None)
+                if number is None:
+                    return
+                try:
+                    transfer_part(number)
+                except Exception as e:
+                    errors.append(e)
+
+        with ThreadPoolExecutor(max_workers=self.part_workers, thread_name_prefix=f's3-queue-{job.id}') as executor:
+            for _ in range(self.part_workers):
+                executor.submit(worker)
+        job.check_stopped()
+        if errors:
+            raise errors[0]
+
+    def run_upload(self, job):
+        stat = os.stat(job.local_path)
+        if job.upload_id and (stat.st_size != job.size or stat.st_mtime != job.mtime):
+            logger.info(f"{job.local_path} changed since its upload started; starting over")
+            self.abort_upload(job)
+        with self.lock:
+            job.size = stat.st_size
+            job.mtime = stat.st_mtime
+
+        job.check_stopped()
+        if job.size < self.multipart_threshold:
+            with self.lock:
+                job.bytes_done = 0
+            with PartReader(job.local_path, 0, job.size, self.bandwidth, job.stop_event,
+                            lambda amount: self.add_bytes(job, amount)) as body:
+                self.s3_client.put_object(Bucket=job.bucket, Key=job.key, Body=body)
+            return
+
+        etags = self.uploaded_parts(job) if job.upload_id else {}
+        if not job.upload_id:
+            upload_id = self.s3_client.create_multipart_upload(Bucket=job.bucket, Key=job.key)['UploadId']
+            with self.lock:
+                job.upload_id = upload_id
+                job.part_size = max(self.part_size, -(-job.size // MAX_PARTS))
+            self.save()
+        with self.lock:
+            job.parts = sorted(etags)
+            job.bytes_done = sum(job.part_range(number)[1] for number in etags)
+        if etags:
+            logger.info(f"Resuming upload of {job.local_path}: {len(etags)}/{job.part_count()} parts already sent")
+
+        pending = [number for number in range(1, job.part_count() + 1) if number not in etags]
+        self.run_parts(job, pending, lambda number: self.upload_part(job, number, etags))
+        job.check_stopped()
+        self.s3_client.complete_multipart_upload(
+            Bucket=job.bucket, Key=job.key, UploadId=job.upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etags[number]} for number in sorted(etags)]})
+
+    def uploaded_parts(self, job):
+        """Return {part number: ETag} of the parts S3 already holds, or {} if the upload is gone"""
+        etags = {}
+        try:
+            for page in self.s3_client.get_paginator('list_parts').paginate(
+                    Bucket=job.bucket, Key=job.key, UploadId=job.upload_id):
+                for part in page.get('Parts', []):
+                    # A part of the wrong size was sent with a different part size; send it again
+                    if part['Size'] == job.part_range(part['PartNumber'])[1]:
+                        etags[part['PartNumber']] = part['ETag']
+        except ClientError as e:
+            if e.response['Error'].get('Code') != 'NoSuchUpload':
+                raise
+            logger.info(f"Multipart upload for {job.local_path} no longer exists; starting over")
+            with self.lock:
+                job.upload_id = None
+        return etags
+
+    def upload_part(self, job, number, etags):
+        job.check_stopped()
+        offset, length = job.part_range(number)
+        sent = [0]
+
+        def on_bytes(amount):
+            sent[0] += amount
+            self.add_bytes(job, amount)
+
+        try:
+            with PartReader(job.local_path, offset, length, self.bandwidth, job.stop_event, on_bytes) as body:
+                response = self.s3_client.upload_part(
+                    Bucket=job.bucket, Key=job.key, UploadId=job.upload_id, PartNumber=number,
+                    Body=body, ContentLength=length)
+        except BaseException:
+            self.add_bytes(job, -sent[0])
+            raise
+        with self.lock:
+            etags[number] = response['ETag']
+            job.parts.append(number)
+        self.save()
+
+    def abort_upload(self, job):
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=job.bucket, Key=job.key, UploadId=job.upload_id)
+        except ClientError as e:
+            logger.warning(f"Could not abort multipart upload of s3://{job.bucket}/{job.key}: {describe_error(e)}")
+        with self.lock:
+            job.upload_id = None
+            job.parts = []
+            job.bytes_done = 0
+
+    def run_download(self, job):
+        head = self.s3_client.head_object(Bucket=job.bucket, Key=job.key)
+        size, etag = head['ContentLength'], head['ETag']
+        part_path = job.local_path + BulkDownloader.PART_SUFFIX
+        resumable = (job.etag == etag and job.size == size and job.part_size
+                     and os.path.exists(part_path) and os.path.getsize(part_path) == size)
+        if not resumable:
+            if job.parts:
+                logger.info(f"s3://{job.bucket}/{job.key} changed since its download started; starting over")
+            os.makedirs(os.path.dirname(job.local_path) or '.', exist_ok=True)
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+            with self.lock:
+                job.etag = etag
+                job.size = size
+                job.part_size = self.part_size
+                job.parts = []
+            self.save()
+        with self.lock:
+            job.bytes_done = sum(job.part_range(number)[1] for number in job.parts)
+        if job.parts:
+            logger.info(f"Resuming download of s3://{job.bucket}/{job.key}: "
+                        f"{len(job.parts)}/{job.part_count()} parts already fetched")
+
+        done = set(job.parts)
+        pending = [number for number in range(1, job.part_count() + 1) if number not in done]
+        self.run_parts(job, pending, lambda number: self.download_part(job, number, part_path))
+        os.replace(part_path, job.local_path)
+
+    def download_part(self, job, number, part_path):
+        job.check_stopped()
+        offset, length = job.part_range(number)
+        body = self.s3_client.get_object(Bucket=job.bucket, Key=job.key, IfMatch=job.etag,
+                                         Range=f'bytes={offset}-{offset + length - 1}')['Body']
+        written = 0
+        try:
+            with open(part_path, 'r+b') as f:
+                f.seek(offset)
+                for chunk in body.iter_chunks(CHUNK_SIZE):
+                    # Reading slower than the link lets TCP flow control slow the sender down
+                    self.bandwidth.consume(len(chunk), job.stop_event)
+                    job.check_stopped()
+                    f.write(chunk)
+                    written += len(chunk)
+                    self.add_bytes(job, len(chunk))
+        except BaseException:
+            body.close()
+            self.add_bytes(job, -written)
+            raise
+        with self.lock:
+            job.parts.append(number)
+        self.save()
+
+    def discard(self, job):
+        """Throw away what a cancelled job leaves behind: its multipart upload or part file"""
+        if job.kind == UPLOAD and job.upload_id:
+            self.abort_upload(job)
+        elif job.kind == DOWNLOAD:
+            part_path = job.local_path + BulkDownloader.PART_SUFFIX
+            try:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            except OSError as e:
+                logger.warning(f"Could not remove {part_path}: {e}")
@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+
+from s3_bulk import BulkDownloader, DownloadJournal, iter_local_files
+from s3_listing import iter_prefix_objects, normalize_prefix
+from s3_tasks import OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+UPLOAD = 'upload'
+DOWNLOAD = 'download'
+
+
+class SyncManifest:
+    """Last-synced state of a local directory, persisted inside it
+
+    Stored as MANIFEST_NAME in the local root, with one section per remote
+    target ("s3://bucket/prefix/") mapping each relative path to the local
+    size and mtime and the remote ETag it had after the last sync. A file
+    whose current state matches its entry is known to be unchanged without
+    hashing it.
+    """
+
+    MANIFEST_NAME = '.s3sync-manifest.json'
+
+    def __init__(self, local_root, target):
+        self.path = os.path.join(local_root, self.MANIFEST_NAME)
+        self.target = target
+        self.data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable sync manifest {self.path}: {e}")
+        self.entries = self.data.get(target, {})  # relpath -> [size, mtime, etag]
+
+    def unchanged(self, relpath, local, remote):
+        """Return True if neither side changed since relpath was last synced"""
+        entry = self.entries.get(relpath)
+        return (entry is not None and local is not None and remote is not None
+                and entry[0] == local.size and entry[1] == local.mtime and entry[2] == remote.etag)
+
+    def save(self, entries):
+        self.data[self.target] = entries
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+
+class RemoteFile:
+    __slots__ = ('key', 'size', 'mtime', 'etag')
+
+    def __init__(self, key, size, mtime, etag):
+        self.key = key
+        self.size = size
+        self.mtime = mtime
+        self.etag = etag
+
+
+class SyncPlan:
+    """What a sync would do: files to transfer and files to delete"""
+
+    def __init__(self, direction, local_root, bucket, prefix, delete):
+        self.direction = direction
+        self.local_root = local_root
+        self.bucket = bucket
+        self.prefix = prefix
+        self.delete = delete
+        self.transfers = []  # [(relpath, size, etag), ...]
+        self.deletes = []    # [relpath, ...] on the destination side
+        self.unchanged = 0
+
+    @property
+    def transfer_bytes(self):
+        return sum(size for relpath, size, etag in self.transfers)
+
+    def describe(self, limit=None):
+        """Return the plan as printable lines, one per action"""
+        target = f"s3://{self.bucket}/{self.prefix}"
+        if self.direction == UPLOAD:
+            lines = [f"upload: {relpath} -> {target}{relpath}" for relpath, size, etag in self.transfers]
+            lines += [f"delete: {target}{relpath}" for relpath in self.deletes]
+        else:
+            lines = [f"download: {target}{relpath} -> {os.path.join(self.local_root, relpath)}"
+                     for relpath, size, etag in self.transfers]
+            lines += [f"delete: {os.path.join(self.local_root, relpath)}" for relpath in self.deletes]
+        if limit is not None and len(lines) > limit:
+            lines = lines[:limit] + [f"... and {len(lines) - limit} more"]
+        return lines
+
+
+class SyncEngine:
+    """Incremental sync between a local directory and an S3 prefix, either way
+
+    Planning compares a local scan with a recursive remote listing. Files
+    that match the manifest are skipped outright; otherwise a file is
+    transferred when the sizes differ or the source side is newer, like
+    'aws s3 sync'. Transfers reuse the parallel bulk uploader/downloader and
+    extraneous remote keys are removed with batched deletes.
+    """
+
+    # Files this tool leaves in a synced directory
+    IGNORED_NAMES = (SyncManifest.MANIFEST_NAME, SyncManifest.MANIFEST_NAME + '.tmp', DownloadJournal.JOURNAL_NAME)
+
+    def __init__(self, s3_client, uploader, downloader, deleter):
+        self.s3_client = s3_client
+        self.uploader = uploader
+        self.downloader = downloader
+        self.deleter = deleter
+
+    def scan_local(self, local_root):
+        files = {}
+        if os.path.isdir(local_root):
+            for f in iter_local_files(local_root):
+                if f.relpath in self.IGNORED_NAMES or f.relpath.endswith(BulkDownloader.PART_SUFFIX):
+                    continue
+                files[f.relpath] = f
+        return files
+
+    def scan_remote(self, bucket, prefix, cancel_event=None):
+        files = {}
+        for obj in iter_prefix_objects(self.s3_client, bucket, prefix, cancel_event):
+            relpath = obj['Key'][len(prefix):]
+            if '..' in relpath.split('/'):
+                logger.warning(f"Skipping key that cannot be mapped to a local path: {obj['Key']}")
+                continue
+            if relpath and not relpath.endswith('/'):
+                files[relpath] = RemoteFile(obj['Key'], obj['Size'], obj['LastModified'].timestamp(), obj['ETag'])
+        return files
+
+    def plan(self, direction, local_root, bucket, prefix, delete=False, cancel_event=None):
+        """Compare both sides and return a SyncPlan without changing anything"""
+        prefix = normalize_prefix(prefix)
+        manifest = SyncManifest(local_root, f"s3://{bucket}/{prefix}")
+        local = self.scan_local(local_root)
+        remote = self.scan_remote(bucket, prefix, cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            raise OperationCancelled(f"sync plan for s3://{bucket}/{prefix}")
+
+        plan = SyncPlan(direction, local_root, bucket, prefix, delete)
+        source, destination = (local, remote) if direction == UPLOAD else (remote, local)
+        for relpath, src in source.items():
+            dst = destination.get(relpath)
+            local_file, remote_file = (src, dst) if direction == UPLOAD else (dst, src)
+            if manifest.unchanged(relpath, local_file, remote_file):
+                plan.unchanged += 1
+            elif dst is None or dst.size != src.size or src.mtime > dst.mtime:
+                plan.transfers.append((relpath, src.size, getattr(src, 'etag', None)))
+            else:
+                plan.unchanged += 1
+        if delete:
+            plan.deletes = [relpath for relpath in destination if relpath not in source]
+
+        logger.info(f"Sync plan ({direction}) {local_root} <-> s3://{bucket}/{prefix}: "
+                    f"{len(plan.transfers)} to transfer, {len(plan.deletes)} to delete, {plan.unchanged} unchanged")
+        return plan
+
+    def execute(self, plan, progress, cancel_event=None):
+        """Carry out a plan, then record the new state in the manifest"""
+        root, bucket, prefix = plan.local_root, plan.bucket, plan.prefix
+        os.makedirs(root, exist_ok=True)
+        if plan.direction == UPLOAD:
+            if plan.transfers:
+                self.uploader.upload(((os.path.join(root, *relpath.split('/')), prefix + relpath, size)
+                                      for relpath, size, etag in plan.transfers), bucket, progress, cancel_event)
+            if plan.deletes:
+                self.deleter.delete((prefix + relpath for relpath in plan.deletes), bucket, progress, cancel_event)
+        else:
+            if plan.transfers:
+                self.downloader.download(((prefix + relpath, os.path.join(root, *relpath.split('/')), size, etag)
+                                          for relpath, size, etag in plan.transfers),
+                                         bucket, root, progress, cancel_event)
+            for relpath in plan.deletes:
+                progress.add_file(0)
+                try:
+                    os.remove(os.path.join(root, *relpath.split('/')))
+                    progress.file_done()
+                except OSError as e:
+                    progress.file_failed(relpath, e)
+
+        self.update_manifest(plan, progress, cancel_event)
+        return progress
+
+    def update_manifest(self, plan, progress, cancel_event=None):
+        """Record every file that is now identical on both sides
+
+        Uses one fresh listing for the new ETags; files that failed to
+        transfer are left out so the next run retries them.
+        """
+        failed = {name[len(plan.prefix):] if name.startswith(plan.prefix) else name
+                  for name, error in progress.failures}
+        local = self.scan_local(plan.local_root)
+        remote = self.scan_remote(plan.bucket, plan.prefix, cancel_event)
+        entries = {}
+        for relpath, local_file in local.items():
+            remote_file = remote.get(relpath)
+            if remote_file is not None and relpath not in failed and remote_file.size == local_file.size:
+                entries[relpath] = [local_file.size, local_file.mtime, remote_file.etag]
+        SyncManifest(plan.local_root, f"s3://{plan.bucket}/{plan.prefix}").save(entries)
+        logger.info(f"Sync manifest updated with {len(entries)} files")
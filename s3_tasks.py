@@ -0,0 +1,167 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class OperationCancelled(Exception):
+    """Raised inside a worker once its task has been cancelled"""
+
+
+def find_cancellation(e):
+    """Return the OperationCancelled e is or was raised while handling, or None
+
+    botocore wraps anything raised while a request body is being sent,
+    e.g. by a progress callback, in an HTTPClientError.
+    """
+    while e is not None:
+        if isinstance(e, OperationCancelled):
+            return e
+        e = e.__cause__ or e.__context__
+    return None
+
+
+class Task:
+    """Handle for one background operation submitted to a TaskRunner"""
+
+    def __init__(self, runner, name):
+        self.runner = runner
+        self.name = name
+        self.status = 'Queued'
+        self.progress = ''
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """Ask the worker to stop; results it posts afterwards are dropped"""
+        if not self.cancel_event.is_set():
+            logger.info(f"Cancelling operation: {self.name}")
+            self.cancel_event.set()
+
+    def check_cancelled(self):
+        """Raise OperationCancelled if cancel() has been called"""
+        if self.cancel_event.is_set():
+            raise OperationCancelled(self.name)
+
+    def post(self, callback, *args):
+        """Run callback(*args) on the Tk main thread, unless cancelled by then"""
+        self.runner.results.put((self, callback, args, False))
+
+    def set_status(self, status):
+        """Update the status shown for this task (safe from any thread)"""
+        self.status = status
+        self.runner.results.put((self, self.runner.notify_change, (), True))
+
+    def set_progress(self, progress):
+        """Update the progress text shown for this task (safe from any thread)"""
+        self.progress = progress
+        self.runner.results.put((self, self.runner.notify_change, (), True))
+
+
+class TaskRunner:
+    """Thread pool for S3 calls whose results are drained on the Tk main thread
+
+    Workers never touch widgets. They hand callbacks to a queue that the Tk
+    event loop drains every poll_interval milliseconds through root.after.
+    """
+
+    def __init__(self, root, max_workers=4, poll_interval=50, drain_budget=0.03):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-worker')
+        self.results = queue.Queue()
+        self.tasks = []
+        self.running = 0
+        self.running_lock = threading.Lock()
+        self.poll_interval = poll_interval
+        self.drain_budget = drain_budget  # Seconds of callbacks to run per poll
+        self.on_change = None
+        self.closed = False
+        self.root.after(self.poll_interval, self.drain)
+
+    def submit(self, name, fn, *args, on_success=None, on_error=None):
+        """Run fn(task, *args) on the pool and return its Task
+
+        on_success(result) and on_error(exception) are called on the Tk main
+        thread; neither is called when the task was cancelled.
+        """
+        task = Task(self, name)
+        self.tasks.append(task)
+        logger.info(f"Queued operation: {name}")
+
+        def run():
+            if task.cancelled:
+                task.set_status('Cancelled')
+                return
+            task.set_status('Running')
+            with self.running_lock:
+                self.running += 1
+            try:
+                result = fn(task, *args)
+                task.check_cancelled()
+            except OperationCancelled:
+                logger.info(f"Operation cancelled: {name}")
+                task.set_status('Cancelled')
+            except Exception as e:
+                task.set_status('Failed')
+                if on_error:
+                    task.post(on_error, e)
+                else:
+                    logger.error(f"Operation failed: {name}: {e}", exc_info=True)
+            else:
+                task.set_status('Done')
+                if on_success:
+                    task.post(on_success, result)
+            finally:
+                with self.running_lock:
+                    self.running -= 1
+
+        task.future = self.executor.submit(run)
+        self.notify_change()
+        return task
+
+    def is_busy(self):
+        """Return True while any task is executing (safe from any thread)"""
+        return self.running > 0
+
+    def active_tasks(self):
+        """Return tasks that are queued or still running"""
+        return [t for t in self.tasks if t.status in ('Queued', 'Running')]
+
+    def notify_change(self):
+        # Forget finished tasks so the list only grows with concurrent work
+        self.tasks = [t for t in self.tasks if t.status in ('Queued', 'Running')]
+        if self.on_change:
+            self.on_change()
+
+    def drain(self):
+        """Run queued callbacks on the main thread, then reschedule"""
+        deadline = time.monotonic() + self.drain_budget
+        while time.monotonic() < deadline:
+            try:
+                task, callback, args, always = self.results.get_nowait()
+            except queue.Empty:
+                break
+            # Stale results from cancelled tasks never reach the UI
+            if task.cancelled and not always:
+                continue
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Callback for '{task.name}' failed: {e}", exc_info=True)
+
+        if not self.closed:
+            self.root.after(self.poll_interval, self.drain)
+
+    def shutdown(self):
+        """Cancel every task and stop accepting work"""
+        self.closed = True
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+
+from s3_listing import ShardedLister, normalize_prefix
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixUsage:
+    """Totals for everything under one prefix
+
+    newest is the latest LastModified as a POSIX timestamp (0.0 when
+    empty). Folder placeholder keys ('name/') are not counted.
+    """
+    __slots__ = ('bytes', 'count', 'newest')
+
+    def __init__(self, bytes=0, count=0, newest=0.0):
+        self.bytes = bytes
+        self.count = count
+        self.newest = newest
+
+    def add(self, bytes, count, newest):
+        self.bytes += bytes
+        self.count += count
+        if newest > self.newest:
+            self.newest = newest
+
+    def copy(self):
+        return PrefixUsage(self.bytes, self.count, self.newest)
+
+
+class UsageCache:
+    """Completed PrefixUsage results keyed by (bucket, prefix)
+
+    Entries expire after ttl seconds. Writing or deleting a key makes every
+    ancestor prefix stale, which invalidate_key drops by walking up the key
+    instead of scanning the cache. Safe to use from worker threads.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.entries = {}  # (bucket, prefix) -> (stored_at, PrefixUsage)
+        self.lock = threading.Lock()
+
+    def get(self, bucket, prefix):
+        key = (bucket, normalize_prefix(prefix))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                return None
+            return entry[1].copy()
+
+    def put(self, bucket, prefix, usage):
+        with self.lock:
+            self.entries[(bucket, normalize_prefix(prefix))] = (time.monotonic(), usage.copy())
+
+    def invalidate_key(self, bucket, object_key):
+        """Forget every prefix that contains object_key"""
+        parts = object_key.split('/')[:-1]
+        with self.lock:
+            for depth in range(len(parts) + 1):
+                self.entries.pop((bucket, normalize_prefix('/'.join(parts[:depth]))), None)
+
+    def invalidate_tree(self, bucket, prefix):
+        """Forget a prefix, everything beneath it, and its ancestors"""
+        prefix = normalize_prefix(prefix)
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == bucket and k[1].startswith(prefix)]:
+                del self.entries[key]
+        if prefix:
+            self.invalidate_key(bucket, prefix)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class PrefixSizer:
+    """Computes PrefixUsage for a prefix with a parallel ShardedLister walk
+
+    Each page is added to its shard and all of the shard's ancestors as
+    soon as it arrives, and a folder's total is cached once all of its
+    shards have finished, so later runs over the same or an enclosing
+    prefix skip folders that are already known.
+    """
+
+    def __init__(self, s3_client, cache, max_workers=10, shard_depth=3, update_interval=0.5):
+        self.lister = ShardedLister(s3_client, max_workers, shard_depth)
+        self.cache = cache
+        self.update_interval = update_interval
+
+    def du(self, bucket, prefix, folders=None, cancel_event=None, on_update=None, use_cache=True):
+        """Return (total, {folder_name: PrefixUsage}) for bucket/prefix
+
+        With folders (names like 'photos/') only those sub-folders of prefix
+        are sized; otherwise the whole prefix is, including the files
+        directly in it. on_update(total, children) receives snapshots from
+        worker threads at most once every update_interval seconds.
+        Raises OperationCancelled if cancel_event was set.
+        """
+        prefix = normalize_prefix(prefix)
+        lock = threading.Lock()
+        last_update = [0.0]
+        totals = []    # the root's PrefixUsage
+        children = {}  # folder name -> PrefixUsage directly under prefix
+
+        def make_data(shard):
+            usage = PrefixUsage()
+            if shard.depth == 0:
+                totals.append(usage)
+            elif shard.depth == 1:
+                with lock:
+                    children[shard.prefix[len(prefix):]] = usage
+            return usage
+
+        def snapshot():
+            with lock:
+                return totals[0].copy(), {name: usage.copy() for name, usage in children.items()}
+
+        def add_usage(shard, bytes, count, newest):
+            with lock:
+                while shard is not None:
+                    shard.data.add(bytes, count, newest)
+                    shard = shard.parent
+            if on_update is not None:
+                now = time.monotonic()
+                if now - last_update[0] >= self.update_interval:
+                    last_update[0] = now
+                    on_update(*snapshot())
+
+        def on_objects(shard, objects):
+            total, count, newest = 0, 0, 0.0
+            for obj in objects:
+                if not obj['Key'].endswith('/'):
+                    total += obj['Size']
+                    count += 1
+                    newest = max(newest, obj['LastModified'].timestamp())
+            add_usage(shard, total, count, newest)
+
+        def skip(shard):
+            cached = self.cache.get(bucket, shard.prefix) if use_cache else None
+            if cached is None:
+                return False
+            add_usage(shard, cached.bytes, cached.count, cached.newest)
+            return True
+
+        def on_done(shard):
+            # A root limited to some folders is not the prefix's real total
+            if shard.depth or folders is None:
+                self.cache.put(bucket, shard.prefix, shard.data)
+
+        logger.info(f"Sizing s3://{bucket}/{prefix} with {self.lister.max_workers} workers")
+        started = time.monotonic()
+        self.lister.walk(bucket, prefix, on_objects, on_done, skip, make_data, folders, cancel_event)
+
+        total, sizes = snapshot()
+        logger.info(f"s3://{bucket}/{prefix}: {total.count} objects, {total.bytes} bytes "
+                    f"in {time.monotonic() - started:.1f}s")
+        if on_update is not None:
+            on_update(total, sizes)
+        return total, sizes